@@ -26,20 +26,288 @@
 # SOFTWARE.
 
 import os
-import json, time, datetime
+import json, time
+import functools
+import threading
+import multiprocessing
 import numpy as np
-from paho.mqtt import client as mqttc
-from pkg.configuration_manager import ConfigurationManager, MetadataManager
-from pkg.audio_packing import unpack_payload, unpack_metadata
-from pkg.conn_diagnostics import AudioStreamDiagnostics
+from pkg.configuration_manager import ConfigurationManager, MetadataManager, ConfigWatcher
+from pkg.audio_packing import decode_payload
+from pkg.conn_diagnostics import PacketDiagnostics, AudioStreamDiagnostics
+from pkg.worker_pool import WorkerPool
+from pkg.feature_engine import FeatureEngine
+from pkg.spectral_analysis import SpectralAnalyzer
+from pkg.output_batching import OutputBatcher
+from pkg.metrics_server import MetricsServer
+from pkg.reassembly import StreamReassembler
+from pkg.resampling import PolyphaseResampler
+from pkg.recorder import RingRecorder
+from pkg.trigger_engine import TriggerEngine
+from pkg.timestamps import NS_PER_SECOND, parse_timestamp_ns, format_timestamp_ns
+from pkg.profiling import StageProfiler
+from pkg.transport import create_transport, TraceRecorder
+from pkg.reconnect import ReconnectManager, Outbox
 
 APP_NAME = "AudioProcessor"
 CONFIG_FILE = '/app/config/config.json'
 CONFIG_DATA = {}
 CONFIG_MANAGER = None
 METADATA_MANAGER = None
-DIAGNOSTICS_ENGINE = None
-MQTT_CLIENT = mqttc.Client(client_id=APP_NAME)
+DIAGNOSTICS_ENGINE = None # app-wide diagnostics, across all connections
+DIAGNOSTICS_INTERVAL = 60 # seconds between diagnostics reports
+DIAGNOSTICS_HISTORY = 10 # packets kept for diagnostics analysis
+WORKER_POOL = None # None = process messages inline in the MQTT network loop
+CONNECTIONS = {} # connection name -> StreamConnection
+STREAM_ROUTES = {} # streaming topic -> StreamConnection
+CONNECTIONS_LOCK = threading.RLock() # serializes changes of CONNECTIONS by metadata and config updates
+CONFIG_WATCHER = None
+PROFILER = StageProfiler() # disabled unless configured or toggled by signal
+MQTT_CLIENT = None # created from the "transport" config, see pkg.transport
+RECONNECT = None # reconnects MQTT_CLIENT and buffers results while it is disconnected, see pkg.reconnect
+STAGE_SECTIONS = ("channels", "reassembly", "resampling", "features", "spectrum", "output", "triggers", "recorder") # config sections of per-connection stages
+
+class StreamConnection(object):
+    """Processing state of one audio connection: its metadata, diagnostics and analysis stages."""
+
+    def __init__(self, metadata):
+        self.name = metadata["connection_name"]
+        self.metadata = metadata
+        self.lock = threading.RLock() # held while processing a frame, and while its stages are replaced
+        self._select_channels()
+        self.diagnostics = AudioStreamDiagnostics(name=self.name, interval=DIAGNOSTICS_INTERVAL,
+                                history=DIAGNOSTICS_HISTORY, samp_rate=metadata["sampling_rate"][0])
+        self.reassembly = self._create_reassembler()
+        self.resampler = self._create_resampler()
+        self.features = self._create_feature_engine()
+        self.spectrum = self._create_spectral_analyzer()
+        self.output = self._create_output_batcher()
+        self.triggers = self._create_trigger_engine()
+        self.recorder = self._create_recorder()
+        self.recorded_until = None # end of the last event recording exported (ns)
+        self.diagnostics.add_report_source(self._stage_stats, counters=StreamReassembler.STATS_COUNTERS +
+                                           TriggerEngine.STATS_COUNTERS + RingRecorder.STATS_COUNTERS)
+
+    @property
+    def sampling_rate(self):
+        return self.metadata["sampling_rate"][0]
+
+    @property
+    def analysis_rate(self):
+        # sampling rate of the stages after the resampler
+        return self.sampling_rate if self.resampler is None else self.resampler.target_rate
+
+    @property
+    def select(self):
+        return self.layout[0]
+
+    @property
+    def data_types(self):
+        return self.layout[1]
+
+    @property
+    def scaling(self):
+        return self.layout[2]
+
+    @property
+    def num_channels(self):
+        return self.layout[3]
+
+    @property
+    def streaming_topic(self):
+        return self.metadata["streaming_topic"]
+
+    def update_metadata(self, metadata):
+        with self.lock: # process_frame must not see a mix of old and new stages
+            self.metadata = metadata
+            self._select_channels() # datapoint ids may have changed
+            # Update Diagnostics Engine if sampling_rate changed
+            if self.diagnostics.data_sampling_rate != metadata["sampling_rate"][0]:
+                self.diagnostics.set_sampling_rate(metadata["sampling_rate"][0])
+                self.diagnostics.reset() # reset statistics
+            self.reassembly = self._create_reassembler()
+            self.resampler = self._create_resampler()
+            self.features = self._create_feature_engine() # windows depend on sampling rate and channels
+            self.spectrum = self._create_spectral_analyzer()
+            self.triggers = self._create_trigger_engine()
+            if self.output is not None:
+                self.output.header = self._output_header()
+            self._replace_recorder() # file layout depends on sampling rate and channels
+
+    def reconfigure(self, sections=STAGE_SECTIONS):
+        """Recreates the stages of the given config sections after a config change; returns the pending output messages."""
+        with self.lock:
+            messages = []
+            if "channels" in sections:
+                self._select_channels()
+                sections = STAGE_SECTIONS # all stages depend on the number of channels
+            if "reassembly" in sections:
+                self.reassembly = self._create_reassembler()
+            if "resampling" in sections:
+                self.resampler = self._create_resampler()
+                sections = set(sections) | {"features", "spectrum", "triggers", "recorder"} # all run at the new rate
+            if "features" in sections:
+                self.features = self._create_feature_engine()
+            if "spectrum" in sections:
+                self.spectrum = self._create_spectral_analyzer()
+            if "output" in sections:
+                messages = self.output.flush() if self.output is not None else []
+                self.output = self._create_output_batcher()
+            if "triggers" in sections or "features" in sections:
+                self.triggers = self._create_trigger_engine() # rules apply to the features computed
+            if "recorder" in sections:
+                self._replace_recorder()
+            return messages
+
+    def _select_channels(self):
+        """Resolves the configured channels against the datapoints of the connection. Sets the layout, a
+        (select, data_types, scaling, num_channels) tuple replaced as a whole: the datapoint ids to decode
+        (None for all), their data types, their (offsets, gains) scaling (None if unscaled) and their count."""
+        all_types = dict(zip(self.metadata["datapoint_ids"], self.metadata["data_type"]))
+        # datapoint id -> dataType, so the decoder reads each datapoint in its own data type
+        self.layout = (None, all_types, None, self.metadata["num_chan"])
+        channels_config = CONFIG_DATA.get("channels")
+        if channels_config is None:
+            return # analyze all datapoints as they are
+        by_name = dict(zip(self.metadata.get("datapoint_names", []), self.metadata["datapoint_ids"]))
+        by_id = {str(id): id for id in self.metadata["datapoint_ids"]}
+        select, offsets, gains = [], [], []
+        for channel in channels_config:
+            if not isinstance(channel, dict):
+                channel = {"datapoint": channel} # plain name or id
+            key = str(channel["datapoint"])
+            id = by_name.get(key, by_id.get(key))
+            if id is None:
+                print(f'{APP_NAME}::[CONFIG] Warning: connection {self.name} has no datapoint {key}', flush=True)
+                continue
+            select.append(id)
+            offsets.append(channel.get("offset", 0.))
+            gains.append(channel.get("gain", 1.))
+        if len(select) == 0:
+            print(f'{APP_NAME}::[CONFIG] Warning: none of the channels found in connection {self.name}, analyzing all', flush=True)
+            return
+        scaling = None
+        if any(offset != 0 for offset in offsets) or any(gain != 1 for gain in gains):
+            scaling = (np.array(offsets, dtype=np.float64), np.array(gains, dtype=np.float64))
+        self.layout = (select, {id: all_types[id] for id in select}, scaling, len(select))
+
+    def _create_reassembler(self):
+        reassembly_config = CONFIG_DATA.get("reassembly")
+        if reassembly_config is None:
+            return None # analyze frames as they arrive
+        return StreamReassembler(self.sampling_rate,
+                                 jitter_ms=reassembly_config.get("jitter_ms", 200),
+                                 fill=reassembly_config.get("fill", "zeros"),
+                                 max_fill_ms=reassembly_config.get("max_fill_ms", 1000),
+                                 max_frames=reassembly_config.get("max_frames", 64),
+                                 max_hold_ms=reassembly_config.get("max_hold_ms"))
+
+    def _create_trigger_engine(self):
+        triggers_config = CONFIG_DATA.get("triggers")
+        if triggers_config is None:
+            return None
+        engine = TriggerEngine(triggers_config.get("rules", []),
+                               pre_ms=triggers_config.get("pre_ms", 500),
+                               post_ms=triggers_config.get("post_ms", 500))
+        features_config = CONFIG_DATA.get("features")
+        computed = ["rms"] if features_config is None else features_config.get("set", ["rms"])
+        for rule in engine.rules:
+            if rule.feature not in computed:
+                print(f'{APP_NAME}::[TRIGGERS] Warning: rule {rule.name} applies to {rule.feature}, which is not computed', flush=True)
+        return engine
+
+    def _create_recorder(self):
+        recorder_config = CONFIG_DATA.get("recorder")
+        if recorder_config is None:
+            return None
+        return RingRecorder(self.name, self.analysis_rate,
+                            directory=recorder_config.get("directory", "/tmp/recordings"),
+                            retention_s=recorder_config.get("retention_s", 60),
+                            export_dir=recorder_config.get("export_dir"),
+                            queue_size=recorder_config.get("queue_size", 256))
+
+    def _replace_recorder(self):
+        recorder = self.recorder
+        self.recorder = self._create_recorder()
+        if recorder is not None:
+            recorder.stop() # writes its queued frames first
+        if self.recorder is not None:
+            self.recorder.start()
+
+    def _stage_stats(self):
+        stats = {}
+        for stage in (self.reassembly, self.triggers, self.recorder):
+            if stage is not None:
+                stats.update(stage.get_stats())
+        return stats
+
+    def _create_resampler(self):
+        resampling_config = CONFIG_DATA.get("resampling")
+        if resampling_config is None or resampling_config.get("target_rate", self.sampling_rate) == self.sampling_rate:
+            return None # analyze at the source rate
+        return PolyphaseResampler(self.sampling_rate, resampling_config["target_rate"],
+                                  half_width=resampling_config.get("half_width", 10))
+
+    def _create_feature_engine(self):
+        features_config = CONFIG_DATA.get("features")
+        if features_config is None:
+            return None # publish per-frame RMS only
+        window = max(2, round(features_config.get("window_ms", 100) * self.analysis_rate / 1000))
+        hop = max(1, round(features_config.get("hop_ms", features_config.get("window_ms", 100)) * self.analysis_rate / 1000))
+        return FeatureEngine(self.analysis_rate, self.num_channels, window, hop,
+                             features=features_config.get("set", ["rms"]),
+                             bands=features_config.get("bands_hz"))
+
+    def _create_spectral_analyzer(self):
+        spectrum_config = CONFIG_DATA.get("spectrum")
+        if spectrum_config is None:
+            return None
+        frame_size = max(2, round(spectrum_config.get("frame_ms", 100) * self.analysis_rate / 1000))
+        return SpectralAnalyzer(self.analysis_rate, frame_size,
+                                bands=spectrum_config.get("bands", "third_octave"),
+                                window=spectrum_config.get("window", "hann"),
+                                frames_per_batch=spectrum_config.get("frames_per_batch", 1),
+                                average=spectrum_config.get("average", True),
+                                min_freq=spectrum_config.get("min_freq_hz", 20.))
+
+    def _create_output_batcher(self):
+        output_config = CONFIG_DATA.get("output")
+        if output_config is None:
+            return None # publish every result on its own
+        return OutputBatcher(self._output_header(),
+                             max_records=output_config.get("batch_size", 10),
+                             max_delay_ms=output_config.get("batch_interval_ms", 1000),
+                             decimation=output_config.get("decimation", 1),
+                             change_threshold=output_config.get("change_threshold"))
+
+    def _output_header(self):
+        return {"connection_name":self.name, "streaming_topic":self.streaming_topic}
+
+    def decode_args(self, payload):
+        """Decoder arguments for a payload, and the channel layout they decode to; both are taken now,
+        as the frame may be processed after a config or metadata update replaced the layout."""
+        layout = self.layout
+        select, data_types, _, _ = layout
+        return (payload, data_types, self.metadata["encoding"], select), layout
+
+    def start(self):
+        self.diagnostics.start_reporting()
+        if self.recorder is not None:
+            self.recorder.start()
+
+    def stop(self, client=None):
+        """Ends the processing of the connection. Trigger events still waiting for their post-trigger context
+        are published with the context received so far, or logged without a client."""
+        with self.lock:
+            events = self.triggers.flush() if self.triggers is not None else []
+        if client is not None:
+            publish_events(client, self, events) # before the recorder stops, so it still exports the events
+        else:
+            for event in events:
+                print(f'{APP_NAME}::[TRIGGERS] {self.name}: event {event["rule"]} at '+
+                      f'{format_timestamp_ns(event["timestamp"])} not published, the connection was stopped', flush=True)
+        self.diagnostics.stop_reporting()
+        if self.recorder is not None:
+            self.recorder.stop()
 
 #### define supporting mqtt client methods
 def on_connect(client, userdata, flags, rc):
@@ -53,83 +321,402 @@ def on_connect(client, userdata, flags, rc):
         # subscribe to metadata, wait for first message
         print(f'{APP_NAME}::[DATABUS] resubscribing to {CONFIG_DATA["databus"]["metadata_topic"]}', flush=True)
         client.subscribe(CONFIG_DATA["databus"]["metadata_topic"], qos=CONFIG_DATA["databus"]["metadata_qos"])
-        
-        if METADATA_MANAGER.current["streaming_topic"] != "":
-            # also subscribe to streaming topic
-            print(f'{APP_NAME}::[DATABUS] resubscribing to {METADATA_MANAGER.current["streaming_topic"]}', flush=True)
-            client.subscribe(METADATA_MANAGER.current["streaming_topic"], qos=CONFIG_DATA["databus"]["streaming_qos"])
+
+        # also subscribe to all streaming topics
+        for streaming_topic in STREAM_ROUTES:
+            print(f'{APP_NAME}::[DATABUS] resubscribing to {streaming_topic}', flush=True)
+            client.subscribe(streaming_topic, qos=CONFIG_DATA["databus"]["streaming_qos"])
+
+        # and to the recorder trigger topic, if any
+        trigger_topic = CONFIG_DATA.get("recorder", {}).get("trigger_topic")
+        if trigger_topic is not None:
+            print(f'{APP_NAME}::[DATABUS] resubscribing to {trigger_topic}', flush=True)
+            client.subscribe(trigger_topic, qos=CONFIG_DATA["databus"]["metadata_qos"])
+    if RECONNECT is not None:
+        RECONNECT.handle_connect(rc) # replays the results buffered meanwhile
 
 def on_disconnect(client, userdata, rc):
     print(f'{APP_NAME}::[DATABUS] on_disconnect() called', flush=True)
     client.connected_flag = False
-    if rc != 0:
-    #ERROR: unexpected broker disconection. Try to reconnect. Stop only if config file changes
-        while True:
-            try:
-                client.reconnect()
-                return
-            except:
-                #ERROR:broker not available. Keep trying
-                continue        
+    if RECONNECT is not None:
+        RECONNECT.handle_disconnect(rc) # reconnects with backoff if unexpected, without blocking the network loop
 
-def on_message(client, userdata, msg):
+def get_publisher(client):
+    """Results are published through the reconnect manager, if any, so they are buffered while disconnected."""
+    return client if RECONNECT is None else RECONNECT
 
-    # case 1: metadata message handling
-    if msg.topic==CONFIG_DATA["databus"]["metadata_topic"]:
-        # unpack metadata payload
-        meta_changed = METADATA_MANAGER.update_metadata_objects(unpack_metadata(msg.payload)) # update internal objects
+def on_message(client, userdata, msg):
 
-        # set connection from config; can only be done once we have parsed a metadata message (update_metadata_objects)
-        if METADATA_MANAGER.current["connection_name"] != CONFIG_DATA["connection_name"]:
-            METADATA_MANAGER.set_connection(CONFIG_DATA["connection_name"]) # this will also set the streaming_topic
+    # case 1: stream payload handling
+    connection = STREAM_ROUTES.get(msg.topic)
+    if connection is not None:
+        decode_args, layout = connection.decode_args(msg.payload)
+        context = (get_publisher(client), connection, time.time_ns(), layout) # receive time, for latency diagnostics
+        if WORKER_POOL is None:
+            PROFILER.run(process_payload, decode_args, context)
+        else:
+            # hand over to the worker pool; keeps the network loop free for acknowledgements
+            WORKER_POOL.submit(msg.topic, decode_args, context)
 
-        if meta_changed:
+    # case 2: metadata message handling
+    elif msg.topic==CONFIG_DATA["databus"]["metadata_topic"]:
+        # diff metadata payload against the known connections
+        changed = METADATA_MANAGER.update_from_message(msg.payload)
+        if changed or len(CONNECTIONS) == 0:
             print(f'{APP_NAME}::[METADATA] metadata changed at source, adapting...',flush=True)
-            if METADATA_MANAGER.previous["streaming_topic"] != "":
-                # unsubscribe from previous streaming topic
-                print(f'{APP_NAME}::[STREAMING] unsubscribing from: {METADATA_MANAGER.previous["streaming_topic"]}',flush=True)
-                client.unsubscribe(METADATA_MANAGER.previous["streaming_topic"])
-            # subscribe to new streaming topic
-            print(f'{APP_NAME}::[STREAMING] subscribing to: {METADATA_MANAGER.current["streaming_topic"]}',flush=True)
-            client.subscribe(METADATA_MANAGER.current["streaming_topic"], qos=CONFIG_DATA["databus"]["streaming_qos"])
-
-        # Update Diagnostics Engine if sampling_rate changed
-        if DIAGNOSTICS_ENGINE.data_sampling_rate != METADATA_MANAGER.current["sampling_rate"][0]:
-            DIAGNOSTICS_ENGINE.set_sampling_rate(METADATA_MANAGER.current["sampling_rate"][0])
-            DIAGNOSTICS_ENGINE.reset() # reset statistics
-
-    # case 2: stream payload handling
-    elif msg.topic==METADATA_MANAGER.current["streaming_topic"]:
-        # unpack payload
-        msg_array, msg_timestamp, msg_array_shape = unpack_payload(msg.payload)
-
-        # Update Diagnostics Engine if frame_size changed
-        if DIAGNOSTICS_ENGINE.packet_size != msg_array_shape[0]:
-            DIAGNOSTICS_ENGINE.set_packet_size(msg_array_shape[0])
-            DIAGNOSTICS_ENGINE.reset() # reset statistics
-
-        # Upload to Diagnostics Engine
-        decimal_index = msg_timestamp.find('.')
-        msg_ts = datetime.datetime.fromisoformat(msg_timestamp[:decimal_index+7]) # drop the 7th decimal place and/or the Z
-        DIAGNOSTICS_ENGINE.store_packet(json.loads(msg.payload),ts=msg_ts)
-
-        # analyze data frame and publish result
-        data_packet = {
-            "timestamp":msg_timestamp,
-            "connection_name":METADATA_MANAGER.current["connection_name"],
-            "streaming_topic":METADATA_MANAGER.current["streaming_topic"],
-            "result":_compute_rms(msg_array[:,:METADATA_MANAGER.current["num_chan"]]).tolist()
-        }
-        client.publish(CONFIG_DATA["databus"]["output_topic"], json.dumps(data_packet), qos=CONFIG_DATA["databus"]["output_qos"])
+            update_connections(client, changed if len(CONNECTIONS) > 0 else None)
+
+    # case 3: recorder export trigger
+    elif msg.topic==CONFIG_DATA.get("recorder", {}).get("trigger_topic"):
+        handle_record_trigger(msg.payload)
 
     # otherwise: ignore all other topics
     else:
         return
 
+def handle_record_trigger(payload):
+    """Exports the recent audio of the connections named in a trigger message, e.g.
+    {"connection_name": "piano2.wav", "seconds": 10}; of all connections, if no name is given."""
+    try:
+        request = json.loads(payload)
+    except ValueError as err:
+        print(f'{APP_NAME}::[RECORDER] Error - ignoring invalid trigger message: {err}', flush=True)
+        return
+    names = request.get("connection_name")
+    if isinstance(names, str):
+        names = [names]
+    seconds = request.get("seconds", CONFIG_DATA.get("recorder", {}).get("export_seconds", 10))
+    for connection in list(CONNECTIONS.values()):
+        if connection.recorder is not None and (names is None or connection.name in names):
+            connection.recorder.export(seconds)
+
+def update_connections(client, changed=None):
+    """Match the configured connection names against the metadata; (un)subscribe streaming topics as needed.
+    changed are the names of the connections whose metadata changed; None re-derives all of them."""
+    with CONNECTIONS_LOCK:
+        _update_connections(client, changed)
+
+def _update_connections(client, changed):
+    global STREAM_ROUTES
+    patterns = CONFIG_DATA["connection_name"]
+    if isinstance(patterns, str):
+        patterns = [patterns]
+
+    # collect the metadata of all matching connections
+    matched = {}
+    for connection_name in METADATA_MANAGER.match_connections(patterns):
+        if changed is not None and connection_name not in changed and connection_name in CONNECTIONS:
+            matched[connection_name] = CONNECTIONS[connection_name].metadata # unchanged
+            continue
+        metadata = METADATA_MANAGER.get_connection_metadata(connection_name)
+        if metadata is not None:
+            matched[connection_name] = metadata
+    if len(matched) == 0:
+        print(f'{APP_NAME}::[METADATA] Error: no connection matches {patterns}',flush=True)
+
+    # drop connections which are no longer available
+    for connection_name in [name for name in CONNECTIONS if name not in matched]:
+        connection = CONNECTIONS.pop(connection_name)
+        with connection.lock:
+            messages = connection.output.flush() if connection.output is not None else []
+        for message in messages: # buffered like all results while disconnected
+            get_publisher(client).publish(CONFIG_DATA["databus"]["output_topic"], message, qos=CONFIG_DATA["databus"]["output_qos"])
+        print(f'{APP_NAME}::[STREAMING] unsubscribing from: {connection.streaming_topic}',flush=True)
+        client.unsubscribe(connection.streaming_topic)
+        connection.stop(get_publisher(client))
+
+    # add new connections, adapt changed ones
+    for connection_name, metadata in matched.items():
+        connection = CONNECTIONS.get(connection_name)
+        if connection is None:
+            connection = StreamConnection(metadata)
+            CONNECTIONS[connection_name] = connection
+            connection.start()
+        elif connection.metadata != metadata:
+            if connection.streaming_topic != metadata["streaming_topic"]:
+                print(f'{APP_NAME}::[STREAMING] unsubscribing from: {connection.streaming_topic}',flush=True)
+                client.unsubscribe(connection.streaming_topic)
+            connection.update_metadata(metadata)
+        else:
+            continue
+        # subscribe to new streaming topic
+        print(f'{APP_NAME}::[STREAMING] subscribing to: {connection.streaming_topic}',flush=True)
+        client.subscribe(connection.streaming_topic, qos=CONFIG_DATA["databus"]["streaming_qos"])
+
+    # swap in the new routing table in one go; on_message may be reading the old one
+    routes = {}
+    for connection in CONNECTIONS.values():
+        if connection.streaming_topic in routes:
+            print(f'{APP_NAME}::[STREAMING] Warning: {connection.name} shares its streaming topic with '+
+                  f'{routes[connection.streaming_topic].name}, ignoring it',flush=True)
+            continue
+        routes[connection.streaming_topic] = connection
+    STREAM_ROUTES = routes
+    DIAGNOSTICS_ENGINE.packet_rate = sum(conn.diagnostics.packet_rate for conn in routes.values()) or 1.
+
+def process_payload(decode_args, context):
+    process_frame(decode_payload(*decode_args), context)
+
+def handle_frame(frame, context):
+    """Worker pool handler; lets profiler captures cover the worker threads."""
+    PROFILER.run(process_frame, frame, context)
+
+def process_frame(frame, context):
+    """Analyze a decoded data frame and publish the result; all stages work on the same decoded frame."""
+    start = time.perf_counter()
+    client, connection, arrival_time, layout = context
+    _, _, scaling, num_channels = layout # as decoded
+    PROFILER.record("decode", int(frame.decode_time * 1e9))
+    t = PROFILER.start()
+    diagnostics = connection.diagnostics
+
+    # Update Diagnostics Engine if frame_size changed
+    if diagnostics.packet_size != frame.num_samples:
+        diagnostics.set_packet_size(frame.num_samples)
+        diagnostics.reset() # reset statistics
+
+    # Upload to Diagnostics Engines
+    frame_ts = parse_timestamp_ns(frame.timestamp) # int ns since the epoch
+    t = PROFILER.lap("timestamp", t)
+    diagnostics.store_packet(frame,ts=frame_ts,arrival_time=arrival_time)
+    DIAGNOSTICS_ENGINE.count_packet()
+    t = PROFILER.lap("diagnostics", t)
+
+    with connection.lock: # all stages of one configuration, see StreamConnection.reconfigure
+        if num_channels != connection.num_channels:
+            return # decoded before an update changed the channels; the stages are built for the new ones
+        # windowed stages run on the continuous stream: (timestamp, samples, gap) chunks
+        signal = frame.array[:,:num_channels] # only the selected datapoints are decoded
+        if scaling is not None:
+            offsets, gains = scaling
+            signal = (signal - offsets) * gains
+        if connection.reassembly is None:
+            chunks = [(frame_ts, signal, 0)]
+        else:
+            chunks = connection.reassembly.push(signal, frame_ts, seq=frame.seq, rseq=frame.rseq)
+            t = PROFILER.lap("reassembly", t)
+
+        # analyze data frame and publish result(s)
+        results = [] # (timestamp, key, value)
+        events = [] # completed trigger events
+        if connection.features is None:
+            rms = _compute_rms(signal)
+            results.append((frame.timestamp, "result", rms.tolist()))
+            if connection.triggers is not None:
+                events += connection.triggers.push([frame_ts], {"rms":rms.reshape(1, -1)})
+        process_chunks(client, connection, chunks, results, events, t)
+    diagnostics.record_processing_time(frame.decode_time + time.perf_counter() - start)
+
+def process_chunks(client, connection, chunks, results=None, events=None, t=0):
+    """Run the windowed stages on (timestamp, samples, gap) chunks of the continuous stream and publish their
+    results, after the given ones of the frame; called with the connection's lock held."""
+    results = [] if results is None else results # (timestamp, key, value)
+    events = [] if events is None else events # completed trigger events
+    if connection.resampler is not None:
+        resampled = []
+        for chunk_ts, chunk, gap in chunks:
+            if chunk is None:
+                connection.resampler.reset() # the stream restarts after the gap
+                resampled.append((chunk_ts, None, gap))
+                continue
+            chunk_ts, chunk = connection.resampler.push(chunk, chunk_ts)
+            if chunk.shape[0] > 0 or gap > 0:
+                resampled.append((chunk_ts, chunk, gap))
+        chunks = resampled
+        t = PROFILER.lap("resampling", t)
+    if connection.recorder is not None:
+        for chunk_ts, chunk, gap in chunks:
+            if chunk is not None:
+                connection.recorder.add(chunk_ts, chunk) # queued; written by the recorder's own thread
+
+    for chunk_ts, chunk, gap in chunks:
+        if gap > 0:
+            results.append((format_timestamp_ns(chunk_ts), "gap", {"samples":gap, "filled":chunk is not None}))
+            if chunk is None:
+                if connection.features is not None:
+                    connection.features.reset() # windows must not span the gap
+                continue
+        if connection.features is not None:
+            # one result per completed feature window
+            offsets, features = connection.features.push(chunk)
+            window_ts = chunk_ts + np.round(offsets * NS_PER_SECOND / connection.analysis_rate).astype(np.int64)
+            for indx in range(len(offsets)):
+                results.append((format_timestamp_ns(window_ts[indx]), "features",
+                                {name:values[indx].tolist() for name, values in features.items()}))
+            if connection.triggers is not None:
+                events += connection.triggers.push(window_ts, features)
+    t = PROFILER.lap("analysis", t)
+    if connection.triggers is not None:
+        publish_events(client, connection, events)
+        t = PROFILER.lap("triggers", t)
+    if connection.spectrum is not None:
+        for chunk_ts, chunk, gap in chunks:
+            if chunk is None:
+                connection.spectrum.reset() # frames must not span the gap
+                continue
+            for spectrum_ts, centers, levels in connection.spectrum.push(chunk, chunk_ts):
+                results.append((format_timestamp_ns(spectrum_ts), "spectrum",
+                                {"band_centers_hz":np.round(centers, 1).tolist(), "levels_db":np.round(levels, 2).tolist()}))
+        t = PROFILER.lap("spectrum", t)
+
+    for timestamp, key, value in results:
+        publish_result(client, connection, timestamp, key, value)
+    PROFILER.lap("publish", t)
+
+def publish_result(client, connection, timestamp, key, value):
+    if connection.output is not None:
+        for message in connection.output.add(timestamp, key, value):
+            client.publish(CONFIG_DATA["databus"]["output_topic"], message, qos=CONFIG_DATA["databus"]["output_qos"])
+        return
+    data_packet = {
+        "timestamp":timestamp,
+        "connection_name":connection.name,
+        "streaming_topic":connection.streaming_topic,
+        key:value
+    }
+    client.publish(CONFIG_DATA["databus"]["output_topic"], json.dumps(data_packet), qos=CONFIG_DATA["databus"]["output_qos"])
+
+def publish_events(client, connection, events):
+    """Publishes trigger events right away, bypassing output batching; optionally exports their recordings,
+    from pre_ms before the start of each event to post_ms after its trigger. Events whose recordings overlap
+    share one recording."""
+    triggers_config = CONFIG_DATA.get("triggers", {})
+    windows = []
+    for event in events:
+        data_packet = {
+            "timestamp":format_timestamp_ns(event["timestamp"]),
+            "start_timestamp":format_timestamp_ns(event["start_timestamp"]),
+            "connection_name":connection.name,
+            "streaming_topic":connection.streaming_topic,
+            "event":event["rule"],
+            "feature":event["feature"],
+            "channel":event["channel"],
+            "value":event["value"],
+            "context":{
+                "timestamps":[format_timestamp_ns(ts) for ts in event["context_timestamps"]],
+                "values":event["context_values"].tolist(),
+            },
+        }
+        client.publish(triggers_config.get("topic", CONFIG_DATA["databus"]["output_topic"]), json.dumps(data_packet),
+                       qos=CONFIG_DATA["databus"]["output_qos"])
+        windows.append((event["start_timestamp"] - connection.triggers.pre, event["timestamp"] + connection.triggers.post))
+    if not triggers_config.get("record", False) or connection.recorder is None:
+        return
+    merged = []
+    for start_ns, end_ns in sorted(windows):
+        if len(merged) > 0 and start_ns <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end_ns)
+        else:
+            merged.append([start_ns, end_ns])
+    for start_ns, end_ns in merged:
+        if connection.recorded_until is not None and start_ns <= connection.recorded_until:
+            if end_ns <= connection.recorded_until:
+                continue # within the last recording
+            start_ns = connection.recorded_until # continues it
+        connection.recorder.export(start_ns=start_ns, end_ns=end_ns)
+        connection.recorded_until = end_ns
+
+def flush_outputs(client, due_only=True):
+    """Publish batched results which are due (or all of them), e.g. of streams that went quiet."""
+    for connection in list(CONNECTIONS.values()):
+        with connection.lock:
+            messages = connection.output.flush(due_only=due_only) if connection.output is not None else []
+        for message in messages:
+            client.publish(CONFIG_DATA["databus"]["output_topic"], message, qos=CONFIG_DATA["databus"]["output_qos"])
+
+def release_held_frames(client):
+    """Process the frames held back after a gap which waited too long, e.g. as their stream stalled."""
+    for connection in list(CONNECTIONS.values()):
+        with connection.lock:
+            if connection.reassembly is not None:
+                chunks = connection.reassembly.release()
+                if len(chunks) > 0:
+                    process_chunks(client, connection, chunks)
+
+def run_output_flusher(client):
+    while True:
+        # half the batch interval, so batches are published at most that late
+        time.sleep(CONFIG_DATA.get("output", {}).get("batch_interval_ms", 1000) / 2000.)
+        release_held_frames(client)
+        flush_outputs(client)
+
+def apply_diagnostics_config(diagnostics_config):
+    """Resizes the diagnostics of the app and all connections, keeping their counters."""
+    global DIAGNOSTICS_INTERVAL, DIAGNOSTICS_HISTORY
+    DIAGNOSTICS_INTERVAL = diagnostics_config.get("report_interval", 60)
+    DIAGNOSTICS_HISTORY = diagnostics_config.get("history_size", 10)
+    for diagnostics in [DIAGNOSTICS_ENGINE] + [conn.diagnostics for conn in list(CONNECTIONS.values())]:
+        diagnostics.report_interval = DIAGNOSTICS_INTERVAL
+        if diagnostics.history_size != DIAGNOSTICS_HISTORY:
+            diagnostics.set_history_size(DIAGNOSTICS_HISTORY)
+
+def apply_config(old_config, new_config):
+    """Applies a changed config.json while running, without touching the MQTT session.
+    Called by the CONFIG_WATCHER thread; the message handlers pick up the new CONFIG_DATA at once."""
+    global CONFIG_DATA
+    print(f'{APP_NAME}::[CONFIG] config file changed, applying...', flush=True)
+    client = MQTT_CLIENT
+    old_bus, new_bus = old_config["databus"], new_config["databus"]
+    with CONNECTIONS_LOCK:
+        CONFIG_DATA = new_config # output topic and qos are read per message
+
+        # settings of the session itself, or of components set up once at start
+        for key in ("databus_host", "databus_port", "databus_username", "databus_password"):
+            if old_bus.get(key) != new_bus.get(key):
+                print(f'{APP_NAME}::[CONFIG] Warning: change of {key} takes effect after a restart', flush=True)
+        for section in ("processing", "transport", "reconnect", "profiling"):
+            if old_config.get(section) != new_config.get(section):
+                print(f'{APP_NAME}::[CONFIG] Warning: change of {section} takes effect after a restart', flush=True)
+
+        # resubscribe changed topics only
+        if (old_bus["metadata_topic"], old_bus["metadata_qos"]) != (new_bus["metadata_topic"], new_bus["metadata_qos"]):
+            if old_bus["metadata_topic"] != new_bus["metadata_topic"]:
+                print(f'{APP_NAME}::[DATABUS] unsubscribing from: {old_bus["metadata_topic"]}', flush=True)
+                client.unsubscribe(old_bus["metadata_topic"])
+            print(f'{APP_NAME}::[DATABUS] subscribing to: {new_bus["metadata_topic"]}', flush=True)
+            client.subscribe(new_bus["metadata_topic"], qos=new_bus["metadata_qos"])
+        if old_bus["streaming_qos"] != new_bus["streaming_qos"]:
+            for streaming_topic in STREAM_ROUTES:
+                client.subscribe(streaming_topic, qos=new_bus["streaming_qos"])
+
+        if old_config.get("diagnostics", {}) != new_config.get("diagnostics", {}):
+            apply_diagnostics_config(new_config.get("diagnostics", {}))
+
+        old_trigger = old_config.get("recorder", {}).get("trigger_topic")
+        new_trigger = new_config.get("recorder", {}).get("trigger_topic")
+        if old_trigger != new_trigger:
+            if old_trigger is not None:
+                print(f'{APP_NAME}::[DATABUS] unsubscribing from: {old_trigger}', flush=True)
+                client.unsubscribe(old_trigger)
+            if new_trigger is not None:
+                print(f'{APP_NAME}::[DATABUS] subscribing to: {new_trigger}', flush=True)
+                client.subscribe(new_trigger, qos=new_bus["metadata_qos"])
+
+        sections = [section for section in STAGE_SECTIONS if old_config.get(section) != new_config.get(section)]
+        if len(sections) > 0:
+            for connection in CONNECTIONS.values():
+                for message in connection.reconfigure(sections):
+                    get_publisher(client).publish(old_bus["output_topic"], message, qos=old_bus["output_qos"])
+
+        # swap the active connections
+        if old_config["connection_name"] != new_config["connection_name"]:
+            update_connections(client)
+
+def collect_snapshots():
+    """Diagnostics snapshots of the app and of every connection, for the metrics endpoint and status topic."""
+    return [DIAGNOSTICS_ENGINE.snapshot()] + [conn.diagnostics.snapshot() for conn in list(CONNECTIONS.values())]
+
+def run_status_publisher(client, topic, interval, qos=0):
+    while True:
+        time.sleep(interval)
+        status = {"timestamp":format_timestamp_ns(time.time_ns()), "diagnostics":collect_snapshots()}
+        client.publish(topic, json.dumps(status), qos=qos)
+
 def _compute_rms(buff,axis=0):
     return np.sqrt(np.mean(np.power(buff,2.0),axis))
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # process pool workers of the pyinstaller executable
 
     # load CONFIG_FILE if it exists
     if os.path.isfile(CONFIG_FILE):
@@ -140,23 +727,86 @@ if __name__ == "__main__":
         time.sleep(10)
         exit(1)
 
-    # configure MQTT client
+    # configure MQTT client (or its in-process stand-in)
+    transport_config = CONFIG_DATA.get("transport", {})
+    MQTT_CLIENT = create_transport(transport_config, client_id=APP_NAME)
     MQTT_CLIENT.on_connect = on_connect
     MQTT_CLIENT.on_disconnect = on_disconnect
     MQTT_CLIENT.on_message = on_message
+    if transport_config.get("record_trace") is not None:
+        MQTT_CLIENT.on_message = TraceRecorder(transport_config["record_trace"]).wrap(on_message)
     MQTT_CLIENT.username_pw_set(CONFIG_DATA["databus"]['databus_username'], CONFIG_DATA["databus"]['databus_password'])
+    reconnect_config = CONFIG_DATA.get("reconnect", {})
+    outbox = None
+    if reconnect_config.get("outbox_size", 1000) > 0 or reconnect_config.get("spill_dir") is not None:
+        outbox = Outbox(APP_NAME, max_messages=reconnect_config.get("outbox_size", 1000),
+                        spill_dir=reconnect_config.get("spill_dir"),
+                        max_spill_bytes=reconnect_config.get("max_spill_mb", 100) * 2**20)
+    RECONNECT = ReconnectManager(MQTT_CLIENT, name="DATABUS",
+                                 min_delay=reconnect_config.get("min_delay", 1.),
+                                 max_delay=reconnect_config.get("max_delay", 60.),
+                                 jitter=reconnect_config.get("jitter", 0.5), outbox=outbox)
+
+    # Start Diagnostics Engine; per-connection engines start once their metadata arrives
+    DIAGNOSTICS_INTERVAL = CONFIG_DATA.get("diagnostics", {}).get("report_interval", DIAGNOSTICS_INTERVAL)
+    DIAGNOSTICS_HISTORY = CONFIG_DATA.get("diagnostics", {}).get("history_size", DIAGNOSTICS_HISTORY)
+    DIAGNOSTICS_ENGINE = PacketDiagnostics(name="DATABUS",interval=DIAGNOSTICS_INTERVAL,history=DIAGNOSTICS_HISTORY)
+    DIAGNOSTICS_ENGINE.add_report_source(RECONNECT.get_stats, counters=ReconnectManager.STATS_COUNTERS)
 
-    # start subscription
+    # start subscription; streaming topics are subscribed once the metadata arrives
     MQTT_CLIENT.connect(CONFIG_DATA["databus"]['databus_host'])
     MQTT_CLIENT.subscribe(CONFIG_DATA["databus"]["metadata_topic"], qos=CONFIG_DATA["databus"]["metadata_qos"])
-    if METADATA_MANAGER.current["streaming_topic"] != "":
-        MQTT_CLIENT.subscribe(METADATA_MANAGER.current["streaming_topic"], qos=CONFIG_DATA["databus"]["streaming_qos"])
+    if CONFIG_DATA.get("recorder", {}).get("trigger_topic") is not None:
+        MQTT_CLIENT.subscribe(CONFIG_DATA["recorder"]["trigger_topic"], qos=CONFIG_DATA["databus"]["metadata_qos"])
     print(f'{APP_NAME}::[DATABUS] MQTT client subscriptions created!', flush=True)
 
-    # Start Diagnostics Engine
-    DIAGNOSTICS_ENGINE = AudioStreamDiagnostics(name="DATABUS",interval=60,history=10,
-                            samp_rate=METADATA_MANAGER.current["sampling_rate"][0])
+    # Start worker pool, unless messages are processed inline
+    processing_config = CONFIG_DATA.get("processing", {})
+    if processing_config.get("mode", "inline") != "inline":
+        WORKER_POOL = WorkerPool(handle_frame, decode_payload,
+                            num_workers=processing_config.get("workers", 2),
+                            queue_size=processing_config.get("queue_size", 64),
+                            policy=processing_config.get("backpressure", "block"),
+                            mode=processing_config["mode"])
+        WORKER_POOL.start()
+        DIAGNOSTICS_ENGINE.add_report_source(WORKER_POOL.get_stats, peek=functools.partial(WORKER_POOL.get_stats, reset_peak=False),
+                                             counters=WorkerPool.STATS_COUNTERS)
+
+    # Optional hot path profiling; also toggled at runtime by SIGUSR2 (stage timing) and SIGUSR1 (cProfile capture)
+    profiling_config = CONFIG_DATA.get("profiling", {})
+    PROFILER = StageProfiler(enabled=profiling_config.get("stage_timing", False),
+                            capture_dir=profiling_config.get("capture_dir", "/tmp"),
+                            capture_seconds=profiling_config.get("capture_seconds", 30))
+    PROFILER.install_signal_handlers()
+    if profiling_config.get("capture_on_start", False):
+        PROFILER.start_capture()
+    DIAGNOSTICS_ENGINE.add_report_source(PROFILER.get_stats, peek=functools.partial(PROFILER.get_stats, reset=False))
     DIAGNOSTICS_ENGINE.start_reporting()
 
-    # blocking call to hold the program here
-    MQTT_CLIENT.loop_forever()
+    # Expose diagnostics via a metrics endpoint and/or a status topic
+    diagnostics_config = CONFIG_DATA.get("diagnostics", {})
+    if diagnostics_config.get("metrics_port") is not None:
+        MetricsServer(collect_snapshots, port=diagnostics_config["metrics_port"]).start()
+    if diagnostics_config.get("status_topic") is not None:
+        status_publisher = threading.Thread(target=run_status_publisher, args=(RECONNECT,
+                                diagnostics_config["status_topic"], diagnostics_config.get("status_interval", 10)))
+        status_publisher.daemon = True
+        status_publisher.start()
+
+    # Publish batched results and frames held back after a gap in time, even if their stream stops
+    flusher = threading.Thread(target=run_output_flusher, args=(RECONNECT, ))
+    flusher.daemon = True
+    flusher.start()
+
+    # Apply changes of the config file while running
+    CONFIG_WATCHER = ConfigWatcher(CONFIG_MANAGER, apply_config,
+                                   debounce=CONFIG_DATA.get("config_reload", {}).get("debounce", 1.),
+                                   poll_interval=CONFIG_DATA.get("config_reload", {}).get("poll_interval", 5.))
+    CONFIG_WATCHER.start()
+
+    # blocking call to hold the program here; returns only once a replayed trace has ended
+    RECONNECT.loop_forever() # runs the client's network loop, reconnecting with backoff
+    RECONNECT.stop()
+    for connection in list(CONNECTIONS.values()):
+        connection.stop(MQTT_CLIENT)
+    flush_outputs(MQTT_CLIENT, due_only=False)
@@ -26,39 +26,77 @@
 # SOFTWARE.
 
 import json
+import time
+import zlib
 import base64
 import numpy as np
+from pkg.timestamps import format_timestamp_ns
+
+# numpy data types for the dataType field of dataPointDefinitions
+DATA_TYPES = {
+    "Int8": np.int8,
+    "Int16": np.int16,
+    "Int32": np.int32,
+    "Int64": np.int64,
+    "UInt8": np.uint8,
+    "UInt16": np.uint16,
+    "UInt32": np.uint32,
+    "UInt64": np.uint64,
+    "Float": np.float32,
+    "Float32": np.float32,
+    "Double": np.float64,
+    "Float64": np.float64,
+}
+# metadata dataType name of each numpy dtype; the first name listed above wins
+DATA_TYPE_NAMES = {}
+for _name, _type in DATA_TYPES.items():
+    DATA_TYPE_NAMES.setdefault(np.dtype(_type), _name)
+
+# encodings of the "val" field of streaming payloads, advertised as "payloadEncoding" in the metadata
+ENCODING_JSON = "json"          # plain json list of samples
+ENCODING_BASE64 = "base64"      # base64 of the raw little-endian sample buffer
+ENCODING_ZLIB = "base64-zlib"   # base64 of the zlib-compressed raw little-endian sample buffer
+PAYLOAD_ENCODINGS = (ENCODING_JSON, ENCODING_BASE64, ENCODING_ZLIB)
 
 # Crude emulation of dpMetadataSimaticV1 format
 # from v1.2.2 of [Edge Databus Payload Specification](https://code.siemens.com/drehermi/edge-databus-payload)
-def pack_metadata(device_name,sampling_rate,num_chan,data_type,streaming_topic):
+def pack_metadata(device_name,sampling_rate,num_chan,data_type,streaming_topic,encoding=ENCODING_JSON):
+    datapoints = {
+        "name":device_name,
+        "topic":streaming_topic,
+        "publishType":"timeseries",
+        "dataPointDefinitions":_gen_datapoint_defs(sampling_rate,
+                                num_chan,
+                                data_type)
+    }
+    if encoding != ENCODING_JSON:
+        # only advertise non-default encodings; plain json lists need no negotiation
+        datapoints["payloadEncoding"] = encoding
     metadata = {
         "seq": 0,
         "connections":[
             {
                 "name":device_name,
                 "type":"Audio Device",
-                "dataPoints":[
-                    {
-                        "name":device_name,
-                        "topic":streaming_topic,
-                        "publishType":"timeseries",
-                        "dataPointDefinitions":_gen_datapoint_defs(sampling_rate,
-                                                num_chan,
-                                                data_type)
-                    }
-                ]
+                "dataPoints":[datapoints]
             }
         ]
     }
     return json.dumps(metadata)
 
+def get_data_type_name(data_type):
+    """Returns the metadata dataType string of a numpy dtype; strings are passed through unchanged."""
+    if isinstance(data_type, str):
+        return data_type
+    return DATA_TYPE_NAMES[np.dtype(data_type)]
+
 def _gen_datapoint_defs(sampling_rate,num_chan,data_type):
     # extend scalars to num_chan length lists
     if not isinstance(sampling_rate,list):
         sampling_rate = [sampling_rate] * num_chan
     if not isinstance(data_type,list):
         data_type = [data_type] * num_chan
+    data_type = [get_data_type_name(dtype) for dtype in data_type] # numpy dtypes or dataType strings
     
     # generate definition for each datapoint
     dpt_defs = []
@@ -93,7 +131,8 @@ def unpack_metadata(metadata_msg):
     available_datapoints = []
     for conn in full_metadata["connections"]:
         if "dataPoints" not in conn.keys():
-            # skip empty connections
+            # empty connection; keep the list aligned with available_connections
+            available_datapoints.append([])
             continue
         timeseries_dpts = [dpt for dpt in conn["dataPoints"] if dpt["publishType"]=="timeseries"]        
         available_datapoints.append(timeseries_dpts)
@@ -102,12 +141,17 @@ def unpack_metadata(metadata_msg):
 
 # Crude emulation of subDpValueSimaticV11TimeSeriesPayload format
 # from v1.2.2 of [Edge Databus Payload Specification](https://code.siemens.com/drehermi/edge-databus-payload)
-def pack_payload(array, timestamp, ids=None):
+def pack_payload(array, timestamp, ids=None, encoding=ENCODING_JSON, seq=1):
     """Packs an audio array + timestamp into json message for MQTT transmission.
-    See also unpack_payload."""
+    timestamp is int ns since the epoch, or an isoformat string with 6 decimal places (the 7th and a Z are added).
+    encoding is one of PAYLOAD_ENCODINGS; seq is the message sequence number. See also unpack_payload."""
     # print('Packing payload... '+str(array[:10,0].flatten()),flush=True)
     if ids is None: # assume 0,1,2,...
         ids = [*range(array.shape[1])]
+    if isinstance(timestamp, (int, np.integer)):
+        timestamp = format_timestamp_ns(timestamp)
+    else:
+        timestamp += "0Z" # add 7th decimal place & Z
 
     var_list = []
     for col in range(array.shape[1]):
@@ -115,17 +159,16 @@ def pack_payload(array, timestamp, ids=None):
             "id": ids[col],
             "qc": 3, # TODO: provide this
             "qx": 0, # TODO: what is this
-            "ts": timestamp+"0Z", # keep as string; add 7th decimal place & Z
-            # "val": base64.b64encode(array[:,col].flatten('C')).decode('utf-8')
-            "val": array[:,col].flatten().tolist() # TODO: should be list of int16s
+            "ts": timestamp, # keep as string
+            "val": _encode_values(array[:,col], encoding)
         }
         var_list.append(var_entry)
     buff_json = {
-        "seq": 1, # TODO: increment this
+        "seq": seq,
         "mdHashVer": 1, # TODO: what is this
         "records": [{
             "rseq": 1, # TODO: increment this
-            "ts": timestamp+"0Z", # add 7th decimal place & Z
+            "ts": timestamp,
             "vals": var_list
             }]
         }
@@ -133,45 +176,235 @@ def pack_payload(array, timestamp, ids=None):
     # print('Packed the payload! '+str(buff_json),flush=True)
     return json.dumps(buff_json)
 
+def _encode_values(values, encoding=ENCODING_JSON):
+    if encoding == ENCODING_JSON:
+        return values.tolist()
+    raw = values.astype(values.dtype.newbyteorder('<'), copy=False).tobytes() # little-endian samples
+    if encoding == ENCODING_ZLIB:
+        raw = zlib.compress(raw)
+    elif encoding != ENCODING_BASE64:
+        raise ValueError(f'unknown payload encoding: {encoding}')
+    return base64.b64encode(raw).decode('ascii')
+
+def _decode_values(val, dtype=None, encoding=ENCODING_JSON, raw_dtype=None):
+    """Decodes the "val" field of a datapoint into a 1-D array; see also _encode_values.
+    Binary encodings are interpreted as raw_dtype, the datapoint's own data type (default: dtype)."""
+    if isinstance(val, str):
+        if raw_dtype is None:
+            raw_dtype = dtype
+        if raw_dtype is None:
+            raise ValueError('binary payload encodings need the datapoint data type')
+        raw = base64.b64decode(val)
+        if encoding == ENCODING_ZLIB:
+            raw = zlib.decompress(raw)
+        return np.frombuffer(raw, dtype=np.dtype(raw_dtype).newbyteorder('<')) # zero-copy view of the samples
+    if dtype is None:
+        return np.array(val)
+    return np.fromiter(val, dtype, len(val))
+
+def _count_values(val, dtype=None, encoding=ENCODING_JSON, raw_dtype=None):
+    """Number of values in the "val" field of a datapoint, without decoding it: the length of a JSON list, or
+    for base64 the size of the decoded bytes, known from the length of the string and its padding. zlib does not
+    store the decompressed size, so compressed values are still decompressed, but not converted."""
+    if not isinstance(val, str):
+        return len(val)
+    if raw_dtype is None:
+        raw_dtype = dtype
+    if raw_dtype is None:
+        raise ValueError('binary payload encodings need the datapoint data type')
+    if encoding == ENCODING_ZLIB:
+        num_bytes = len(zlib.decompress(base64.b64decode(val)))
+    else:
+        num_bytes = len(val) // 4 * 3 - (len(val) - len(val.rstrip('=')))
+    return num_bytes // np.dtype(raw_dtype).itemsize
+
+class AudioFrame(object):
+    """Audio frame decoded from a single streaming payload.
+    Holds the sample array together with the payload's timestamp, datapoint ids and record sequence numbers."""
+
+    __slots__ = ("array", "timestamp", "ids", "rseq", "seq", "num_bytes", "decode_time")
+
+    def __init__(self, array, timestamp, ids, rseq, seq=None, num_bytes=0, decode_time=0.):
+        self.array = array          # (frames, channels) sample array
+        self.timestamp = timestamp  # timestamp string of the first record
+        self.ids = ids              # datapoint id of each column
+        self.rseq = rseq            # record sequence numbers, sorted
+        self.seq = seq              # payload sequence number
+        self.num_bytes = num_bytes  # size of the encoded payload
+        self.decode_time = decode_time # seconds spent decoding the payload
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    @property
+    def num_samples(self):
+        return self.array.shape[0]
+
 # Following subDpValueSimaticV11TimeSeriesPayload format
 # from v1.2.2 of [Edge Databus Payload Specification](https://code.siemens.com/drehermi/edge-databus-payload)
-def unpack_payload(payload):
-    """Unpacks a json message received via MQTT into an audio array + timestamp.
+def decode_payload(payload, data_types=None, encoding=ENCODING_JSON, select=None):
+    """Decodes a json message received via MQTT into an AudioFrame, parsing the payload only once.
+    data_types are the metadata dataType strings of the datapoints: a single string, a list in datapoint
+    order, or a dict by datapoint id; when omitted, the dtype is inferred. The frame's array has a dtype
+    holding all of them, while binary encoded datapoints are read in their own data type.
+    encoding is the payloadEncoding advertised in the metadata. select is an optional list of datapoint ids:
+    only these are decoded, as columns in this order, while the values of all others are skipped unread.
+    Float json values of integer datapoints are rounded to the nearest integer, not truncated.
     See also pack_payload."""
-    msg_dict = json.loads(payload)
-    # print(f'Unpacking payload with {len(msg_dict["records"])} records...',flush=True)
+    start = time.perf_counter()
+    dtype = get_dtype(list(data_types.values()) if isinstance(data_types, dict) else data_types)
+    if dtype is not None and dtype.kind in "iu":
+        floats = [] # np.fromiter would truncate float values of integer datapoints
+        msg_dict = json.loads(payload, parse_float=lambda text: floats.append(text) or float(text))
+    else:
+        floats = None
+        msg_dict = json.loads(payload)
+    records = msg_dict["records"]
+    # float64 holds integers of up to 53 bits exactly, and keeps the fractions for rounding
+    decode_dtype = np.dtype(np.float64) if floats else dtype
+    try:
+        array, ids, rseq, ts = _fast_decode_records(records, decode_dtype, encoding, data_types, select)
+    except (KeyError, TypeError, ValueError, IndexError):
+        # malformed payload (e.g. records with differing datapoints or lengths): use the generic decoder
+        array, ids, rseq, ts = _decode_records(records, decode_dtype, encoding, data_types, select)
+    if decode_dtype is not dtype:
+        array = np.rint(array).astype(dtype)
+    return AudioFrame(array, ts[0], ids, rseq, seq=msg_dict.get("seq"), num_bytes=len(payload),
+                      decode_time=time.perf_counter() - start)
+
+# Following subDpValueSimaticV11TimeSeriesPayload format
+# from v1.2.2 of [Edge Databus Payload Specification](https://code.siemens.com/drehermi/edge-databus-payload)
+def unpack_payload(payload, data_types=None, encoding=ENCODING_JSON):
+    """Unpacks a json message received via MQTT into an audio array + timestamp.
+    See also pack_payload and decode_payload."""
+    frame = decode_payload(payload, data_types, encoding)
+    return frame.array, frame.timestamp, frame.shape
+
+def get_dtype(data_types):
+    """Returns the numpy dtype able to hold all given metadata dataType strings, or None if unknown."""
+    if data_types is None:
+        return None
+    if isinstance(data_types, str):
+        data_types = [data_types]
+    np_types = [DATA_TYPES.get(data_type) for data_type in data_types]
+    if len(np_types) == 0 or None in np_types:
+        return None
+    return np.result_type(*np_types)
+
+def _raw_dtypes(data_types, ids):
+    """Data type of each of the (sorted) datapoint ids, for decoding binary encoded values."""
+    if data_types is None or isinstance(data_types, str):
+        return [DATA_TYPES.get(data_types)] * len(ids)
+    if isinstance(data_types, dict):
+        return [DATA_TYPES.get(data_types.get(id, data_types.get(str(id)))) for id in ids]
+    if len(data_types) != len(ids):
+        return [get_dtype(data_types)] * len(ids)
+    return [DATA_TYPES.get(data_type) for data_type in data_types] # in datapoint order
+
+def _id_sort_key(id):
+    # numeric ids sort by value ("2" before "10"), any others after them by name
+    id = str(id)
+    return (0, int(id), "") if id.isdigit() else (1, 0, id)
+
+def _select_ids(ids, select):
+    """The ids of the selected datapoints, in the order of select; ids may be numbers or strings."""
+    by_name = {str(id): id for id in ids}
+    return [by_name[str(id)] for id in select if str(id) in by_name]
+
+def _fast_decode_records(records, dtype=None, encoding=ENCODING_JSON, data_types=None, select=None):
+    """Decodes well-formed records into one preallocated (frames, channels) array in a single pass.
+    Raises an exception if the records do not all hold the same datapoints with equal-length values."""
+    if len(records) > 1:
+        records = sorted(records, key=lambda record: record["rseq"])
+    first_vals = records[0]["vals"]
+    num_datapoints = len(first_vals)
+    ids = sorted((ch["id"] for ch in first_vals), key=_id_sort_key)
+    if select is not None:
+        if isinstance(data_types, list) and len(data_types) == len(ids):
+            data_types = dict(zip(ids, data_types)) # list in datapoint order
+        ids = _select_ids(ids, select)
+        if len(ids) == 0:
+            raise ValueError("none of the selected datapoints")
+    columns = {id: col for col, id in enumerate(ids)}
+    if len(columns) != len(ids):
+        raise ValueError("duplicate datapoint id")
+    raw_dtypes = _raw_dtypes(data_types, ids) if encoding != ENCODING_JSON else [None] * len(ids)
+
+    # decode and validate all records before allocating
+    record_values = []
+    num_rows = []
+    for record in records:
+        vals = record["vals"]
+        if len(vals) != num_datapoints:
+            raise ValueError("records hold differing datapoints")
+        values = [(columns[ch["id"]], _decode_values(ch["val"], dtype, encoding, raw_dtypes[columns[ch["id"]]]))
+                  for ch in vals if ch["id"] in columns] # unselected values are never converted
+        if len({col for col, _ in values}) != len(ids):
+            raise ValueError("duplicate datapoint id")
+        rows = len(values[0][1])
+        if any(len(val) != rows for _, val in values):
+            raise ValueError("datapoints of differing length")
+        record_values.append(values)
+        num_rows.append(rows)
+
+    if dtype is None:
+        dtype = record_values[0][0][1].dtype
+    array = np.empty((sum(num_rows), len(ids)), dtype=dtype)
+    row = 0
+    for values, rows in zip(record_values, num_rows):
+        for col, val in values:
+            array[row:row+rows, col] = val
+        row += rows
+    if select is not None:
+        ids = _select_ids(select, ids) # as named in select, like those of the generic decoder
+    return array, ids, [record["rseq"] for record in records], [record["ts"] for record in records]
+
+def _decode_records(records, dtype=None, encoding=ENCODING_JSON, data_types=None, select=None):
+    """Generic (slow) decoder which tolerates records with differing datapoints."""
     array_list = []
     ids_list = []
     rseq_list = []
     ts_list = []
-    for payload_record in msg_dict["records"]: # loop through records
-        array, ids, rseq, ts = _unpack_payload_record(payload_record)
+    for payload_record in records: # loop through records
+        array, ids, rseq, ts = _unpack_payload_record(payload_record, dtype, encoding, data_types, select)
         array_list.append(array)
         ids_list.append(ids)
         rseq_list.append(rseq)
         ts_list.append(ts)
     merged_array, merged_ids, sorted_rseq, sorted_ts = _merge_payload_records(array_list,ids_list,rseq_list,ts_list)
-    # if len(array_list) > 1:
-    #     merged_array, merged_ids, sorted_rseq, sorted_ts = _merge_payload_records(array_list,ids_list,rseq_list,ts_list)
-    # else:
-    #     merged_array = array_list[0]
-    #     id_list = ids_list[0]
-    #     sorted_ts = ts_list
-    array_shape = merged_array.shape
-
-    # print('Unpacked the payload! '+str(merged_array[:10,:]),flush=True)
-    timestamp = sorted_ts[0]
-    return merged_array, timestamp, array_shape
-
-def _unpack_payload_record(payload_record):
+    if select is not None:
+        # columns in the order of select
+        columns = {id: col for col, id in enumerate(merged_ids)}
+        merged_ids = _select_ids(merged_ids, select)
+        merged_array = merged_array[:, [columns[id] for id in merged_ids]]
+    if dtype is not None:
+        merged_array = merged_array.astype(dtype, copy=False)
+    return merged_array, merged_ids, sorted_rseq, sorted_ts
+
+def _unpack_payload_record(payload_record, dtype=None, encoding=ENCODING_JSON, data_types=None, select=None):
     rseq = payload_record["rseq"]
     timestamp = payload_record["ts"]
-    ids = []
+    vals = payload_record["vals"]
+    ids = [ch["id"] for ch in vals] # each id is one column -- what about 2-D arrays?
+    if isinstance(data_types, list) and len(data_types) == len(ids):
+        # list in datapoint order; this record's datapoints may come in any order
+        data_types = dict(zip(sorted(ids, key=_id_sort_key), data_types))
+    if select is not None:
+        selected = {str(id): id for id in select}
+        if not any(str(ch["id"]) in selected for ch in vals):
+            # none of the selected datapoints: zeros, so the record's samples keep their place in the frame
+            rows = _count_values(vals[0]["val"], dtype, encoding, _raw_dtypes(data_types, ids[:1])[0]) if vals else 0
+            return np.zeros((rows, len(select)), dtype=dtype or np.float64), list(select), rseq, timestamp
+        vals = [ch for ch in vals if str(ch["id"]) in selected]
+        ids = [ch["id"] for ch in vals]
+    raw_dtypes = _raw_dtypes(data_types, ids)
     ch_list = []
-    for ch in payload_record["vals"]: # loop over datapoints
-        ids.append(ch["id"]) # each id is one column -- what about 2-D arrays?
-        ch_list.append(np.reshape(np.array([ch["val"]]),(-1,1))) # TODO: should be list of int16s
-    array = np.hstack(tuple(ch_list)) # TODO: each datapoint could have its own data type
+    for ch, raw_dtype in zip(vals, raw_dtypes): # loop over datapoints
+        ch_list.append(np.reshape(_decode_values(ch["val"], dtype, encoding, raw_dtype),(-1,1)))
+    array = np.hstack(tuple(ch_list)) # datapoints of differing data types are promoted to a common one
+    if select is not None:
+        ids = [selected[str(id)] for id in ids] # as named in select, like the ids of zero-filled records
     # print(f'Unpacked {array.shape[0]}x{array.shape[1]} data from record {rseq}: ids={ids}, data={array[:10,:]}',flush=True)
     return array, ids, rseq, timestamp
 
@@ -184,9 +417,10 @@ def _merge_payload_records(array_list,ids_list,rseq_list,ts_list):
     for ids in ids_list:
         id_set.update(ids)
 
-    # build up signals one datapoint at a time
+    # build up signals one datapoint at a time, in a stable order
+    id_list = sorted(id_set, key=_id_sort_key)
     ch_list = []
-    for id in id_set: # loop over all datapoint ids
+    for id in id_list: # loop over all datapoint ids
         ch_data_items = []
         for ii in range(len(rseq_list)):
             # now we are accessing record jj
@@ -197,9 +431,9 @@ def _merge_payload_records(array_list,ids_list,rseq_list,ts_list):
             if id in jj_ids:
                 # if the record has that datapoint, add it to the output
                 ch_data_items.append(np.reshape(jj_array[:,jj_ids.index(id)],(-1,1)))
-            # else:
-            #     # TODO: fill with zeros and continue
-            #     ch_data_items.append(np.zeros((jj_len,1), dtype=np_dtype))
+            else:
+                # the datapoint is missing from this record: fill with zeros, so all columns stay aligned
+                ch_data_items.append(np.zeros((jj_len,1), dtype=np_dtype))
         if len(ch_data_items) > 1:
             ch_data = np.vstack(tuple(ch_data_items))
         else:
@@ -207,4 +441,4 @@ def _merge_payload_records(array_list,ids_list,rseq_list,ts_list):
         ch_list.append(ch_data)
     merged_array = np.hstack(tuple(ch_list))
 
-    return merged_array, list(id_set), [rseq_list[ii] for ii in sort_key], [ts_list[ii] for ii in sort_key]
+    return merged_array, id_list, [rseq_list[ii] for ii in sort_key], [ts_list[ii] for ii in sort_key]
@@ -26,13 +26,20 @@
 # SOFTWARE.
 
 import os
+import re
 import json
+import time
+import ctypes
+import select
+import fnmatch
 import datetime
+import threading
+import ctypes.util
 
 APPNAME = 'ConfigurationManager'
 
 def last_changed(fpath):
-    return os.stat(fpath)[8]
+    return os.stat(fpath).st_mtime # sub-second resolution, where the file system has it
 
 class ConfigurationManager():
     """Configuration Manager class for apps configured via a config.json file."""
@@ -121,8 +128,107 @@ class ConfigurationManager():
         self.update_mod_date()
 
 
+SEQ_PATTERN = re.compile(rb'"seq"\s*:\s*-?\d+') # sequence numbers change with every metadata message
+
+def _timeseries_datapoints(connection):
+    # same selection as audio_packing.unpack_metadata
+    return [dpt for dpt in connection.get("dataPoints", []) if dpt["publishType"]=="timeseries"]
+
+# inotify events which may change a file in the watched directory (incl. editors replacing it)
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+def _inotify_watch(dir_path):
+    """Returns an inotify file descriptor watching dir_path, or None where inotify is not available."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(dir_path), IN_WATCH_MASK) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+class ConfigWatcher(object):
+    """Watches the config.json file of a ConfigurationManager and calls on_change(old_data, new_data)
+    from its own thread whenever the file's contents change.
+
+    The file's directory is watched with inotify where available, so changes are picked up at once,
+    also when editors or mounted volumes replace the file. In addition, and as the only means elsewhere,
+    the file is stat'ed every poll_interval seconds. Changes are debounced: the file is reloaded once
+    it was left unmodified for debounce seconds; a file which is not valid json is reported and skipped."""
+
+    def __init__(self, config_mgr, on_change, debounce=1., poll_interval=5.):
+        self.config_mgr = config_mgr
+        self.on_change = on_change
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        config_path = self.config_mgr.get_config_path()
+        fd = _inotify_watch(os.path.dirname(os.path.abspath(config_path)))
+        print(f'{APPNAME}::[CONFIG] watching {config_path} for changes'+
+              (' (inotify)' if fd is not None else f' (every {self.poll_interval} s)'), flush=True)
+        pending = False
+        try:
+            while not self.stop_event.is_set():
+                timeout = self.debounce if pending else self.poll_interval
+                if fd is None:
+                    self.stop_event.wait(timeout)
+                elif select.select([fd], [], [], timeout)[0]:
+                    os.read(fd, 65536) # drain the events; any change in the directory triggers a check
+                pending = self.check()
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def check(self):
+        """Reloads the file if it changed and settled; returns True if a change is still settling."""
+        try:
+            moddate = last_changed(self.config_mgr.get_config_path())
+        except OSError:
+            return True # (re)placed right now
+        if moddate == self.config_mgr.config_moddate:
+            return False
+        if time.time() - moddate < self.debounce:
+            return True
+        old_data = self.config_mgr.get_config_data()
+        try:
+            changed = self.config_mgr.check_changes()
+        except ValueError as e: # json.JSONDecodeError
+            print(f'{APPNAME}::[CONFIG] Error - ignoring invalid config file: {e}', flush=True)
+            self.config_mgr.update_mod_date() # wait for the next modification
+            return False
+        if changed and old_data != self.config_mgr.get_config_data():
+            try:
+                self.on_change(old_data, self.config_mgr.get_config_data())
+            except Exception as e: # keep watching
+                print(f'{APPNAME}::[CONFIG] Error - applying the changed config failed: {e!r}', flush=True)
+        return False
+
 class MetadataManager(object):
-    """Class for managing connection metadata."""
+    """Class for managing connection metadata.
+
+    Connections are indexed by name, so a new metadata message is diffed connection by connection:
+    only added, removed or changed connections are re-derived. A message which differs from the
+    previous one only in its seq numbers is recognized on the raw bytes, without parsing it."""
     def __init__(self,config_mgr):
         self.current = {
             "connection_name":"",
@@ -130,7 +236,10 @@ class MetadataManager(object):
             "sampling_rate":[1.],
             "num_chan":1,
             "data_type":[""],
+            "datapoint_ids":[""],
+            "datapoint_names":[""],
             "streaming_topic":"",
+            "encoding":"json",
         }
         self.previous = self.current.copy()
         self.config_mgr = config_mgr
@@ -139,29 +248,58 @@ class MetadataManager(object):
         self.full_metadata = {}
         self.available_connections = []
         self.available_datapoints = []
+        self.metadata_content = None # last metadata message, seq numbers zeroed
+        self.connection_index = {} # name -> {"connection", "datapoints", "metadata" (derived on first use)}
 
     def set_connection(self,connection_name):
-        try:
-            conn_indx = self.available_connections.index(connection_name)
-        except ValueError:
-            print(f'{APPNAME}::[METADATA] Error: connection {connection_name} could not be found.')
+        metadata_dict = self.get_connection_metadata(connection_name)
+        if metadata_dict is None:
             return False
-            
-        # NOTE: takes only the first timeseries datapoint set (available_datapoints[conn_indx][0])
-        conn_dpts = self.available_datapoints[conn_indx][0]
+        self.update(metadata_dict)
+        return True
+
+    def get_connection_metadata(self,connection_name):
+        """Returns the metadata dict of a connection (same keys as self.current), or None if it is not available.
+        The dict is derived once per change of the connection's metadata; treat it as read-only."""
+        entry = self.connection_index.get(connection_name)
+        if entry is None:
+            print(f'{APPNAME}::[METADATA] Error: connection {connection_name} could not be found.')
+            return None
+
+        if len(entry["datapoints"]) == 0:
+            print(f'{APPNAME}::[METADATA] Error: connection {connection_name} has no timeseries datapoints.')
+            return None
+
+        if entry["metadata"] is None:
+            entry["metadata"] = self._derive_connection_metadata(connection_name, entry["datapoints"])
+        return entry["metadata"]
+
+    def _derive_connection_metadata(self,connection_name,datapoints):
+        # NOTE: takes only the first timeseries datapoint set (datapoints[0])
+        conn_dpts = datapoints[0]
 
         sampling_rate_list = [float(dpt_def["sampleRateHz"]) for dpt_def in conn_dpts["dataPointDefinitions"]]
         data_type_list = [dpt_def["dataType"] for dpt_def in conn_dpts["dataPointDefinitions"]]
-        metadata_dict = {
+        datapoint_id_list = [dpt_def["id"] for dpt_def in conn_dpts["dataPointDefinitions"]]
+        datapoint_name_list = [dpt_def.get("name", dpt_def["id"]) for dpt_def in conn_dpts["dataPointDefinitions"]]
+        return {
             "connection_name":connection_name,
             "device_name":connection_name, # TODO: device name
             "sampling_rate":sampling_rate_list,
             "num_chan":len(conn_dpts["dataPointDefinitions"]),
             "data_type":data_type_list,
-            "streaming_topic":conn_dpts["topic"]
+            "datapoint_ids":datapoint_id_list,
+            "datapoint_names":datapoint_name_list,
+            "streaming_topic":conn_dpts["topic"],
+            "encoding":conn_dpts.get("payloadEncoding","json") # see audio_packing.PAYLOAD_ENCODINGS
         }
-        self.update(metadata_dict)
-        return True
+
+    def match_connections(self,patterns):
+        """Returns the available connection names matching any of the given names or glob patterns."""
+        if isinstance(patterns,str):
+            patterns = [patterns]
+        return [conn for conn in self.available_connections
+                if any(fnmatch.fnmatchcase(conn,pattern) for pattern in patterns)]
 
     def update(self,input:dict):
         self.previous = self.current.copy()
@@ -173,15 +311,36 @@ class MetadataManager(object):
         return (self.current != self.previous)
     
     def update_metadata_objects(self, unpacked_metadata):
-        full_metadata = unpacked_metadata[0]
-        available_connections = unpacked_metadata[1]
-        available_datapoints = unpacked_metadata[2]
-        change_flag = False
+        """Updates the connections from the output of audio_packing.unpack_metadata; returns True on any change."""
+        return len(self.update_full_metadata(unpacked_metadata[0])) > 0
+
+    def update_from_message(self, metadata_msg):
+        """Updates the connections from a metadata message; returns the names of the connections
+        which were added, removed or changed. full_metadata is only updated by messages which
+        differ from the previous one in more than their seq numbers."""
+        if isinstance(metadata_msg, str):
+            metadata_msg = metadata_msg.encode('utf-8')
+        content = SEQ_PATTERN.sub(b'"seq":0', metadata_msg)
+        if content == self.metadata_content:
+            return set() # nothing but seq changed
+        self.metadata_content = content
+        return self.update_full_metadata(json.loads(metadata_msg))
+
+    def update_full_metadata(self, full_metadata):
+        """Diffs the connections of a parsed metadata message against the index."""
         self.full_metadata = full_metadata # seq will always change
-        if self.available_connections != available_connections:
-            self.available_connections = available_connections
-            change_flag = True
-        if self.available_datapoints != available_datapoints:
-            self.available_datapoints = available_datapoints
-            change_flag = True
-        return change_flag
+        index = {}
+        changed = set()
+        for conn in full_metadata.get("connections", []):
+            entry = self.connection_index.get(conn["name"])
+            if entry is None or entry["connection"] != conn:
+                entry = {"connection":conn, "datapoints":_timeseries_datapoints(conn), "metadata":None}
+                changed.add(conn["name"])
+            index[conn["name"]] = entry
+        changed.update(name for name in self.connection_index if name not in index)
+
+        if changed or list(index) != self.available_connections:
+            self.connection_index = index
+            self.available_connections = list(index)
+            self.available_datapoints = [entry["datapoints"] for entry in index.values()]
+        return changed
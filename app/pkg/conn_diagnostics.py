@@ -31,93 +31,242 @@ import time
 import datetime
 import threading
 import numpy as np
+from pkg.timestamps import NS_PER_SECOND, datetime_to_ns
 
 APPNAME = 'DiagnosticsEngine'
 
-class PacketDiagnostics(object):
-    """Parent class for diagnostics engines."""
+class LogHistogram(object):
+    """Streaming histogram with logarithmically spaced buckets (HDR-style).
+    Memory is constant, and quantiles are accurate to within the given relative precision for values
+    between min_value and max_value; smaller and larger values are counted in an under-/overflow bucket."""
+
+    __slots__ = ("min_value", "max_value", "log_ratio", "counts", "num_values", "min_seen", "max_seen",
+                 "lifetime_count", "lifetime_sum")
+
+    def __init__(self,min_value=1e-6,max_value=1e3,precision=0.01):
+        self.min_value = min_value
+        self.max_value = max_value
+        self.log_ratio = math.log1p(2. * precision) # bucket upper/lower edge ratio
+        num_buckets = math.ceil(math.log(max_value / min_value) / self.log_ratio)
+        self.counts = np.zeros(num_buckets + 2, dtype=np.int64) # + underflow and overflow bucket
+        self.lifetime_count = 0 # never reset, for monotonic metrics
+        self.lifetime_sum = 0.
+        self.reset()
 
-    # reporting parameters
-    obj_name = "" # user-specified name for the diagnostics engine
-    report_interval = 10 # seconds between consecutive reports
-    last_report_time = None # time of last generated report
-    report_data = {} # diagnostics to be included in the report
+    def reset(self):
+        self.counts[:] = 0
+        self.num_values = 0
+        self.min_seen = None
+        self.max_seen = None
 
-    # data payload parameters
-    packet_rate = 1. # packets per second
+    def record(self,value):
+        if value < self.min_value:
+            indx = 0
+        elif value >= self.max_value:
+            indx = len(self.counts) - 1
+        else:
+            indx = 1 + int(math.log(value / self.min_value) / self.log_ratio)
+        self.counts[indx] += 1
+        self.num_values += 1
+        self.lifetime_count += 1
+        self.lifetime_sum += value
+        if self.min_seen is None or value < self.min_seen:
+            self.min_seen = value
+        if self.max_seen is None or value > self.max_seen:
+            self.max_seen = value
+
+    def quantile(self,q):
+        """Value below which a fraction q of all recorded values lie; None if nothing was recorded."""
+        if self.num_values == 0:
+            return None
+        indx = int(np.searchsorted(np.cumsum(self.counts), q * self.num_values))
+        if indx == 0:
+            value = self.min_value
+        elif indx == len(self.counts) - 1:
+            value = self.max_value
+        else:
+            value = self.min_value * math.exp((indx - 0.5) * self.log_ratio) # geometric bucket center
+        return min(max(value, self.min_seen), self.max_seen)
 
-    # diagnostics memory
-    history_size = 10 # number of packets to store for analysis
-    packet_history = [] # running list of the history_size most recent packets
-    previous_packet_ts = None
+    def summary(self,quantiles=(0.5,0.95,0.99,0.999)):
+        """Dict of count, min, max and the given quantiles, e.g. for reports."""
+        summary = {"count":self.num_values, "min":self.min_seen, "max":self.max_seen}
+        for q in quantiles:
+            summary[f'p{q*100:g}'] = self.quantile(q)
+        return summary
 
-    # system parameters
-    num_devices = 0
-    num_clients = 0 # number of clients connected
+    def snapshot(self,quantiles=(0.5,0.95,0.99,0.999)):
+        """Quantiles since the last reset, plus lifetime count and sum (Prometheus summary semantics)."""
+        return {
+            "quantiles":{q:self.quantile(q) for q in quantiles},
+            "count":self.lifetime_count,
+            "sum":self.lifetime_sum,
+        }
+
+class PacketDiagnostics(object):
+    """Parent class for diagnostics engines.
+
+    The packet history is a preallocated, fixed-size ring buffer of per-packet arrival time, source
+    timestamp, sample count and byte size; packets themselves are never stored. Times are kept as
+    int64 nanoseconds since the epoch, and only converted to seconds for the reports."""
+
+    __slots__ = (
+        # reporting parameters
+        "obj_name",             # user-specified name for the diagnostics engine
+        "report_interval",      # seconds between consecutive reports
+        "last_report_time",     # time of last generated report
+        "report_data",          # diagnostics to be included in the report
+        "report_sources",       # (source, peek, counters) callables returning extra dicts to include in each report
+        "stop_event",
+        "thread",
+        "lock",                 # guards all statistics; reports and snapshots read them atomically
+        # data payload parameters
+        "packet_rate",          # packets per second
+        # diagnostics memory: ring buffer of the history_size most recent packets
+        "history_size",         # number of packets to store for analysis
+        "arrival_times",        # local receive time (ns since epoch)
+        "source_times",         # source timestamp (ns since epoch)
+        "sample_counts",        # samples per packet
+        "byte_counts",          # bytes per packet
+        "history_pos",          # index of the next packet in the ring buffer
+        "history_len",          # number of valid packets in the ring buffer
+        "previous_packet_ts",
+        # system parameters
+        "num_devices",
+        "num_clients",          # number of clients connected
+        # minimum and maximum time difference between consecutive packets
+        "min_packet_delay",
+        "max_packet_delay",
+        # Total number of packets counted (i.e., received or sent) versus expected
+        "num_packets_counted",
+        "num_packets_expected",
+        # lifetime totals, never reset (for monotonic metrics)
+        "total_packets",
+        "total_bytes",
+    )
 
-    # minimum and maximum time difference between consecutive packets
-    min_packet_delay = None
-    max_packet_delay = None
     key_min_packet_delay = "Minimum packet delay (s)"
     key_max_packet_delay = "Maximum packet delay (s)"
-
-    # Total number of packets counted (i.e., received or sent) versus expected
-    num_packets_counted = 0
-    num_packets_expected = 0
+    key_packet_jitter = "Packet delay jitter (s)"
+    key_arrival_jitter = "Arrival jitter (s)"
+    key_num_gaps = "Gaps in packet history"
+    key_mean_packet_size = "Mean packet size (bytes)"
 
     def __init__(self,name="DIAG",interval=10,history=10,packet_rate=1.):
         self.obj_name = name # user-specified name for the diagnostics engine
         self.report_interval = interval # seconds between consecutive reports
-        self.history_size = history # number of packets to store for analysis
+        self.last_report_time = None
+        self.report_data = {}
+        self.report_sources = []
+        self.stop_event = None
+        self.thread = None
+        self.lock = threading.RLock()
+        self.total_packets = 0
+        self.total_bytes = 0
         self.packet_rate = packet_rate # packets per second
+        self.num_devices = 0
+        self.num_clients = 0
+        self.num_packets_expected = 0
+        self.set_history_size(history) # number of packets to store for analysis
         self.reset(print_reset=False)
 
+    def add_report_source(self,source,peek=None,counters=()):
+        """Include the dict returned by source() in every report, e.g. counters of other components.
+        Sources which reset statistics when read (e.g. peaks per report interval) pass peek, a variant which
+        does not; snapshots call it instead, so that reading them leaves the next report intact.
+        counters are the keys whose values are lifetime totals, as opposed to current values."""
+        self.report_sources.append((source, source if peek is None else peek, frozenset(counters)))
+
+    def set_history_size(self,history):
+        """(Re)allocate the packet history ring buffer; clears the history."""
+        with self.lock:
+            self.history_size = max(2, int(history))
+            self.arrival_times = np.zeros(self.history_size, dtype=np.int64)
+            self.source_times = np.zeros(self.history_size, dtype=np.int64)
+            self.sample_counts = np.zeros(self.history_size, dtype=np.int64)
+            self.byte_counts = np.zeros(self.history_size, dtype=np.int64)
+            self.history_pos = 0
+            self.history_len = 0
+
     def count_packet(self,ts=None):
-        self.num_packets_counted += 1
+        with self.lock:
+            self.num_packets_counted += 1
+            self.total_packets += 1
+            if ts is None:
+                return
+            ts = _to_ns(ts)
+
+            if self.previous_packet_ts is None:
+                self.previous_packet_ts = ts
+                return
 
-        if self.previous_packet_ts is None:
+            self._update_delay((ts - self.previous_packet_ts) / NS_PER_SECOND)
             self.previous_packet_ts = ts
-            return
-        
-        keys = self.report_data.keys()
-        latest_packet_delay = (ts - self.previous_packet_ts).total_seconds()
+
+    def store_packet(self,packet,ts=None,arrival_time=None):
+        """Adds a packet to the history. ts is its source timestamp and arrival_time its local receive time,
+        as int ns (or datetime objects, or float seconds) since the epoch; arrival_time defaults to now,
+        and packets without ts are taken as arriving on time."""
+        # store only what the analysis needs; never hold on to the payload itself
+        num_bytes = _packet_size(packet)
+        arrival_time = time.time_ns() if arrival_time is None else _to_ns(arrival_time)
+        with self.lock:
+            pos = self.history_pos
+            self.arrival_times[pos] = arrival_time
+            self.source_times[pos] = arrival_time if ts is None else _to_ns(ts)
+            self.sample_counts[pos] = getattr(packet,'num_samples',0)
+            self.byte_counts[pos] = num_bytes
+            self.history_pos = (pos + 1) % self.history_size
+            if self.history_len < self.history_size:
+                self.history_len += 1
+
+            self.num_packets_counted += 1
+            self.total_packets += 1
+            self.total_bytes += num_bytes
+            if self.history_len >= 2:
+                # O(1) update of the delay extremes with the latest packet
+                self._update_delay(int(self.source_times[pos] - self.source_times[pos-1]) / NS_PER_SECOND)
+
+    def _update_delay(self,latest_packet_delay,keys=None):
+        if keys is None:
+            keys = self.report_data.keys()
         if self.key_min_packet_delay in keys and (self.min_packet_delay is None or latest_packet_delay < self.min_packet_delay):
             self.min_packet_delay = latest_packet_delay
         if self.key_max_packet_delay in keys and (self.max_packet_delay is None or latest_packet_delay > self.max_packet_delay):
             self.max_packet_delay = latest_packet_delay
-        self.previous_packet_ts = ts
-
-    def store_packet(self,packet,ts=None):
-        # store raw packets; make no assumptions about payload structure
-        new_packet = {'ts': ts, 'packet': packet}
-        # print(f'{APPNAME}::[{self.obj_name}] packet received for diagnostics: '+str(new_packet),flush=True)
-
-        self.packet_history.append(new_packet) # add the newest packet to history
-        if len(self.packet_history) >= self.history_size:
-            self.packet_history.pop(0) # remove the oldest one
-        
-        self.num_packets_counted += 1
-        # print(f'{APPNAME}::[{self.obj_name}] new packet received, now counted: '+str(self.num_packets_counted),flush=True)
-        self.analyze() # analyze packet history and update report data
-
-    def analyze(self,keys=None):
-        if keys is None:
-            keys = self.report_data.keys()
-        
-        if len(self.packet_history) >= 2:
-            latest_packet_delay = (self.packet_history[-1]['ts'] - self.packet_history[-2]['ts']).total_seconds()
-            if self.key_min_packet_delay in keys and (self.min_packet_delay is None or latest_packet_delay < self.min_packet_delay):
-                self.min_packet_delay = latest_packet_delay
-            if self.key_max_packet_delay in keys and (self.max_packet_delay is None or latest_packet_delay > self.max_packet_delay):
-                self.max_packet_delay = latest_packet_delay
-    
+
+    def history(self):
+        """Returns the ring buffer contents, oldest packet first: (arrival, source, samples, bytes) arrays."""
+        order = (np.arange(self.history_len) + self.history_pos - self.history_len) % self.history_size
+        return self.arrival_times[order], self.source_times[order], self.sample_counts[order], self.byte_counts[order]
+
+    def analyze(self):
+        """Computes jitter and gap statistics, vectorized over the packet history."""
+        stats = {
+            self.key_packet_jitter: None,
+            self.key_arrival_jitter: None,
+            self.key_num_gaps: None,
+            self.key_mean_packet_size: None,
+        }
+        if self.history_len < 2:
+            return stats
+        arrival_times, source_times, _, byte_counts = self.history()
+        packet_delays = np.diff(source_times) / NS_PER_SECOND # differences of int64 ns are exact
+        stats[self.key_packet_jitter] = float(np.std(packet_delays))
+        stats[self.key_arrival_jitter] = float(np.std(np.diff(arrival_times) / NS_PER_SECOND))
+        stats[self.key_num_gaps] = int(np.count_nonzero(packet_delays > 1.5 / self.packet_rate))
+        stats[self.key_mean_packet_size] = float(np.mean(byte_counts))
+        return stats
+
     def reset(self,print_reset=True):
-        self.num_packets_counted = 0
-        self.packet_history = []
-        self.last_report_time = datetime.datetime.now()
-        self.previous_packet_ts = None
-        self.min_packet_delay = None
-        self.max_packet_delay = None
+        with self.lock:
+            self.num_packets_counted = 0
+            self.history_pos = 0
+            self.history_len = 0
+            self.last_report_time = datetime.datetime.now()
+            self.previous_packet_ts = None
+            self.min_packet_delay = None
+            self.max_packet_delay = None
         if print_reset:
             print(f'{APPNAME}::[{self.obj_name}] Diagnostics statistics reset!',flush=True)
 
@@ -131,7 +280,8 @@ class PacketDiagnostics(object):
         self.thread.start()                                  # Start the execution
     
     def stop_reporting(self):
-        self.stop_event.set() # set stop flag
+        if self.stop_event is not None:
+            self.stop_event.set() # set stop flag
 
     def run_reporting(self, stop):
         while not stop.is_set():
@@ -145,33 +295,117 @@ class PacketDiagnostics(object):
                     time.sleep(self.report_interval - time_since_last_report)
     
     def generate_report(self,time_since_last_report=None,print_report=True):
-        if time_since_last_report is None:
-            self.num_packets_expected = -1
-        else:
-            self.num_packets_expected = math.floor(time_since_last_report * self.packet_rate)
-
-        # populate report_data
-        self.report_data["Diagnostics ID"] = self.obj_name
-        self.report_data["Time since last report (s)"] = time_since_last_report
-        self.report_data["Number of packets expected"] = self.num_packets_expected
-        self.report_data["Number of packets counted"] = self.num_packets_counted
-        self.report_data["Expected packet delay (s)"] = 1. / self.packet_rate
-        self.report_data[self.key_min_packet_delay] = self.min_packet_delay
-        self.report_data[self.key_max_packet_delay] = self.max_packet_delay
-
-        # print the report & reset
-        self.last_report_time = datetime.datetime.now()
+        with self.lock: # read and reset all statistics atomically
+            if time_since_last_report is None:
+                self.num_packets_expected = -1
+            else:
+                self.num_packets_expected = math.floor(time_since_last_report * self.packet_rate)
+
+            # populate report_data; rebuilt every time, so keys a source no longer reports are gone
+            report_data = {}
+            report_data["Diagnostics ID"] = self.obj_name
+            report_data["Time since last report (s)"] = time_since_last_report
+            report_data["Number of packets expected"] = self.num_packets_expected
+            report_data["Number of packets counted"] = self.num_packets_counted
+            report_data["Expected packet delay (s)"] = 1. / self.packet_rate
+            report_data[self.key_min_packet_delay] = self.min_packet_delay
+            report_data[self.key_max_packet_delay] = self.max_packet_delay
+            report_data.update(self.analyze())
+            for source, _, _ in self.report_sources:
+                report_data.update(source())
+            self.report_data = report_data
+            report = dict(report_data)
+            self.last_report_time = datetime.datetime.now()
+            self.reset(print_reset=False)
+
+        # print the report
         if print_report:
             print(f'{APPNAME}::[{self.obj_name}] Diagnostics Report -- {self.last_report_time}\n'+
-                  json.dumps(self.report_data,indent=4),flush=True)
-        self.reset(print_reset=False)
+                  json.dumps(report,indent=4),flush=True)
+
+    def snapshot(self):
+        """Returns counters, gauges and summaries of this engine, read atomically, e.g. for metrics endpoints.
+        Counters are lifetime totals; gauges and summary quantiles cover the current report interval."""
+        with self.lock:
+            snapshot = {
+                "name":self.obj_name,
+                "counters":{
+                    "packets_total":self.total_packets,
+                    "bytes_total":self.total_bytes,
+                },
+                "gauges":{
+                    "packets_counted":self.num_packets_counted,
+                    "expected_packet_rate":self.packet_rate,
+                    "min_packet_delay_seconds":self.min_packet_delay,
+                    "max_packet_delay_seconds":self.max_packet_delay,
+                },
+                "summaries":{},
+                "extra":{},
+                "extra_counters":[], # keys of extra which are lifetime totals
+            }
+            stats = PacketDiagnostics.analyze(self)
+            snapshot["gauges"]["packet_jitter_seconds"] = stats[self.key_packet_jitter]
+            snapshot["gauges"]["arrival_jitter_seconds"] = stats[self.key_arrival_jitter]
+            for _, peek, counters in self.report_sources:
+                extra = peek()
+                snapshot["extra"].update(extra)
+                snapshot["extra_counters"].extend(key for key in extra if key in counters)
+        return snapshot
+
+def _to_ns(ts):
+    """Timestamp as int nanoseconds since the epoch; accepts ints (ns), floats (s) and datetime objects."""
+    if isinstance(ts, (int, np.integer)):
+        return int(ts)
+    if isinstance(ts, datetime.datetime):
+        return datetime_to_ns(ts)
+    return round(ts * NS_PER_SECOND)
+
+def _packet_size(packet):
+    """Size of a packet in bytes; accepts decoded frames (num_bytes) as well as raw str/bytes payloads."""
+    if hasattr(packet,'num_bytes'):
+        return packet.num_bytes
+    try:
+        return len(packet)
+    except TypeError:
+        return 0
 
 class AudioStreamDiagnostics(PacketDiagnostics):
+    """Diagnostics engine for audio streams.
 
-    data_sampling_rate = 1. # samples per second
-    packet_size = 1 # samples per packet
+    In addition to the packet statistics, tracks end-to-end latency (source timestamp to local receive
+    time), inter-arrival jitter (deviation of the time between packets from the expected packet delay)
+    and processing time in constant-memory histograms, and detects gaps and overlaps between consecutive
+    packets from their timestamps and lengths, to the sample."""
 
-    def __init__(self,name="DIAG",interval=10,history=10,samp_rate=1.,buff_size=1):
+    __slots__ = (
+        "data_sampling_rate",   # samples per second
+        "packet_size",          # samples per packet
+        "gap_tolerance",        # seconds of timestamp deviation tolerated before a gap/overlap is counted
+        "latency_hist",
+        "jitter_hist",
+        "processing_hist",
+        "expected_next_ts",     # source timestamp expected for the next packet (ns since epoch)
+        "previous_arrival",
+        "num_gaps",
+        "num_overlaps",
+        "gap_samples",          # total samples missing in gaps
+        "overlap_samples",      # total samples received twice in overlaps
+        # lifetime totals, never reset (for monotonic metrics)
+        "total_gaps",
+        "total_overlaps",
+        "total_gap_samples",
+        "total_overlap_samples",
+    )
+
+    def __init__(self,name="DIAG",interval=10,history=10,samp_rate=1.,buff_size=1,gap_tolerance=1e-3):
+        self.latency_hist = LogHistogram()
+        self.jitter_hist = LogHistogram()
+        self.processing_hist = LogHistogram()
+        self.gap_tolerance = gap_tolerance
+        self.total_gaps = 0
+        self.total_overlaps = 0
+        self.total_gap_samples = 0
+        self.total_overlap_samples = 0
         PacketDiagnostics.__init__(self, name=name, interval=interval, history=history,
             packet_rate = samp_rate / buff_size)
         self.data_sampling_rate = samp_rate # samples per second
@@ -185,3 +419,98 @@ class AudioStreamDiagnostics(PacketDiagnostics):
     def set_packet_size(self, buff_size):
         self.packet_size = buff_size # samples per packet
         self.packet_rate = self.data_sampling_rate / buff_size
+
+    def store_packet(self,packet,ts=None,arrival_time=None):
+        arrival_time = time.time_ns() if arrival_time is None else _to_ns(arrival_time)
+        source_time = arrival_time if ts is None else _to_ns(ts)
+        num_samples = getattr(packet,'num_samples',self.packet_size)
+        duration = round(num_samples * NS_PER_SECOND / self.data_sampling_rate) # ns
+        with self.lock:
+            PacketDiagnostics.store_packet(self, packet, ts=source_time, arrival_time=arrival_time)
+
+            self.latency_hist.record((arrival_time - source_time) / NS_PER_SECOND)
+            if self.previous_arrival is not None:
+                self.jitter_hist.record(abs(arrival_time - self.previous_arrival - duration) / NS_PER_SECOND)
+            self.previous_arrival = arrival_time
+
+            # gap/overlap detection: does this packet start where the previous one ended?
+            if self.expected_next_ts is not None:
+                deviation = (source_time - self.expected_next_ts) / NS_PER_SECOND
+                if deviation > self.gap_tolerance:
+                    missing = round(deviation * self.data_sampling_rate)
+                    self.num_gaps += 1
+                    self.gap_samples += missing
+                    self.total_gaps += 1
+                    self.total_gap_samples += missing
+                elif deviation < -self.gap_tolerance:
+                    overlapping = round(-deviation * self.data_sampling_rate)
+                    self.num_overlaps += 1
+                    self.overlap_samples += overlapping
+                    self.total_overlaps += 1
+                    self.total_overlap_samples += overlapping
+            self.expected_next_ts = source_time + duration
+
+    def record_processing_time(self,seconds):
+        with self.lock:
+            self.processing_hist.record(seconds)
+
+    def analyze(self):
+        stats = PacketDiagnostics.analyze(self)
+        stats["Latency (s)"] = self.latency_hist.summary()
+        stats["Inter-arrival jitter (s)"] = self.jitter_hist.summary()
+        stats["Processing time (s)"] = self.processing_hist.summary()
+        stats["Achieved sampling rate (Hz)"] = self.achieved_sampling_rate()
+        stats["Achieved speed (x real time)"] = None if stats["Achieved sampling rate (Hz)"] is None else \
+            stats["Achieved sampling rate (Hz)"] / self.data_sampling_rate
+        stats["Number of gaps"] = self.num_gaps
+        stats["Samples missing in gaps"] = self.gap_samples
+        stats["Number of overlaps"] = self.num_overlaps
+        stats["Samples overlapping"] = self.overlap_samples
+        return stats
+
+    def achieved_sampling_rate(self):
+        """Samples per second of local (arrival) time over the packet history; None before two packets arrived."""
+        if self.history_len < 2:
+            return None
+        arrival_times, _, sample_counts, _ = self.history()
+        duration = (arrival_times[-1] - arrival_times[0]) / NS_PER_SECOND
+        if duration <= 0:
+            return None
+        # the first packet only opens the time span; raw payloads carry no sample count
+        samples = np.where(sample_counts[1:] > 0, sample_counts[1:], self.packet_size).sum()
+        return float(samples / duration)
+
+    def snapshot(self):
+        with self.lock:
+            snapshot = PacketDiagnostics.snapshot(self)
+            snapshot["gauges"]["achieved_sampling_rate_hz"] = self.achieved_sampling_rate()
+            snapshot["counters"].update({
+                "gaps_total":self.total_gaps,
+                "gap_samples_total":self.total_gap_samples,
+                "overlaps_total":self.total_overlaps,
+                "overlap_samples_total":self.total_overlap_samples,
+            })
+            snapshot["gauges"]["sampling_rate_hz"] = self.data_sampling_rate
+            snapshot["gauges"]["packet_size_samples"] = self.packet_size
+            snapshot["summaries"] = {
+                "latency_seconds":self.latency_hist.snapshot(),
+                "inter_arrival_jitter_seconds":self.jitter_hist.snapshot(),
+                "processing_time_seconds":self.processing_hist.snapshot(),
+            }
+        return snapshot
+
+    def reset(self,print_reset=True):
+        with self.lock:
+            self._reset_stream_stats()
+        PacketDiagnostics.reset(self, print_reset=print_reset)
+
+    def _reset_stream_stats(self):
+        self.latency_hist.reset()
+        self.jitter_hist.reset()
+        self.processing_hist.reset()
+        self.expected_next_ts = None
+        self.previous_arrival = None
+        self.num_gaps = 0
+        self.num_overlaps = 0
+        self.gap_samples = 0
+        self.overlap_samples = 0
@@ -0,0 +1,178 @@
+# Feature Engine Module
+#
+# This file is part of the Audio Connector Getting Started repository.
+# https://github.com/industrial-edge/audio-connector-getting-started
+#
+# MIT License
+#
+# Copyright (c) Siemens 2022
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import numpy as np
+from pkg.spectral_analysis import get_window, get_band_table
+
+APPNAME = 'FeatureEngine'
+
+# supported windowed features
+FEATURE_RMS = "rms"                    # root mean square
+FEATURE_PEAK = "peak"                  # maximum absolute value
+FEATURE_CREST_FACTOR = "crest_factor"  # peak / rms
+FEATURE_ZCR = "zcr"                    # zero crossings per second
+FEATURE_BAND_ENERGY = "band_energy"    # mean square power per frequency band
+FEATURES = (FEATURE_RMS, FEATURE_PEAK, FEATURE_CREST_FACTOR, FEATURE_ZCR, FEATURE_BAND_ENERGY)
+
+class FeatureEngine(object):
+    """Computes windowed features per channel over a continuous stream of frames.
+
+    Window length and hop are independent of the incoming frame size. Incoming samples are appended to
+    a per-channel buffer along with running (prefix) sums of their squares and zero crossings, so RMS and
+    zero-crossing rate of every window are a difference of two prefix sums; peak and band energies are
+    computed on views of the buffered windows. Only the samples of the next, still incomplete window are
+    kept between frames."""
+
+    def __init__(self, sampling_rate, num_chan, window, hop=None, features=(FEATURE_RMS,), bands=None):
+        if hop is None:
+            hop = window
+        unknown = [feature for feature in features if feature not in FEATURES]
+        if len(unknown) > 0:
+            raise ValueError(f'unknown features: {unknown}')
+        if window < 2 or hop < 1:
+            raise ValueError(f'invalid window ({window}) or hop ({hop}) length')
+        self.sampling_rate = float(sampling_rate)
+        self.num_chan = num_chan
+        self.window = int(window)
+        self.hop = int(hop)
+        self.features = tuple(features)
+        self.bands = [] if bands is None else [tuple(band) for band in bands]
+        if FEATURE_BAND_ENERGY in self.features:
+            self._init_bands()
+        self.reset()
+
+    def reset(self):
+        """Forget all buffered samples, e.g. after a gap in the stream."""
+        capacity = 2 * self.window
+        self._buf = np.zeros((capacity, self.num_chan))        # samples, from the start of the next window
+        self._sq_sum = np.zeros((capacity + 1, self.num_chan))  # _sq_sum[k] = sum of squares of _buf[:k]
+        self._zc_sum = np.zeros((capacity + 1, self.num_chan))  # _zc_sum[k] = zero crossings within _buf[:k]
+        self._len = 0
+        self._skip = 0 # samples to drop before the next window starts (hop > window)
+        self._prev_sign = None # sign of the last sample pushed, for crossings at the frame boundary
+
+    def push(self, array):
+        """Append a (frames, channels) block of samples.
+        Returns the offsets of all windows completed by this block (in samples, relative to the first sample
+        of the block; negative if a window started in a previous block) and a dict of feature name to array,
+        shaped (windows, channels) or (windows, channels, bands) for band energies."""
+        skipped = 0
+        if self._skip > 0:
+            # hop > window: drop the samples between the end of the last window and the start of the next one
+            skipped = min(self._skip, array.shape[0])
+            array = array[skipped:]
+            self._skip -= skipped
+        num_new = array.shape[0]
+        start = self._len
+        self._reserve(start + num_new)
+
+        # append samples and extend the running sums by the new samples only
+        new = self._buf[start:start+num_new]
+        new[...] = array
+        self._sq_sum[start+1:start+num_new+1] = self._sq_sum[start] + np.cumsum(new * new, axis=0)
+        sign = np.signbit(new)
+        crossings = np.zeros(sign.shape)
+        crossings[1:] = sign[1:] != sign[:-1]
+        if num_new > 0 and self._prev_sign is not None:
+            crossings[0] = sign[0] != self._prev_sign
+        self._zc_sum[start+1:start+num_new+1] = self._zc_sum[start] + np.cumsum(crossings, axis=0)
+        self._len = start + num_new
+        if num_new > 0:
+            self._prev_sign = sign[-1].copy()
+
+        # complete windows start at 0, hop, 2*hop, ...
+        num_windows = 0 if self._len < self.window else (self._len - self.window) // self.hop + 1
+        offsets = np.arange(num_windows) * self.hop - start + skipped
+        results = {}
+        if num_windows > 0:
+            results = self._compute(num_windows)
+            self._consume(num_windows * self.hop)
+        return offsets, results
+
+    def _compute(self, num_windows):
+        starts = np.arange(num_windows) * self.hop
+        ends = starts + self.window
+        results = {}
+        rms = np.sqrt((self._sq_sum[ends] - self._sq_sum[starts]) / self.window)
+        if FEATURE_RMS in self.features:
+            results[FEATURE_RMS] = rms
+        if FEATURE_ZCR in self.features:
+            # crossings between consecutive samples of the window, i.e. excluding the one into its first sample
+            crossings = self._zc_sum[ends] - self._zc_sum[starts + 1]
+            results[FEATURE_ZCR] = crossings * self.sampling_rate / (self.window - 1)
+        if FEATURE_PEAK in self.features or FEATURE_CREST_FACTOR in self.features or FEATURE_BAND_ENERGY in self.features:
+            windows = self._windows(num_windows) # (windows, channels, window) view, no copy
+        if FEATURE_PEAK in self.features or FEATURE_CREST_FACTOR in self.features:
+            peak = np.maximum(windows.max(axis=-1), -windows.min(axis=-1))
+            if FEATURE_PEAK in self.features:
+                results[FEATURE_PEAK] = peak
+            if FEATURE_CREST_FACTOR in self.features:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    results[FEATURE_CREST_FACTOR] = np.where(rms > 0, peak / rms, 0.)
+        if FEATURE_BAND_ENERGY in self.features:
+            results[FEATURE_BAND_ENERGY] = self._band_energy(windows)
+        return results
+
+    def _windows(self, num_windows):
+        view = np.lib.stride_tricks.sliding_window_view(self._buf[:self._len], self.window, axis=0)
+        return view[:(num_windows - 1) * self.hop + 1:self.hop]
+
+    def _init_bands(self):
+        # cached tables, shared with all engines of the same window length and sampling rate
+        self._taper = get_window("hann", self.window)
+        self._band_matrix = get_band_table(self.window, self.sampling_rate, tuple(self.bands), "hann")[1]
+
+    def _band_energy(self, windows):
+        if len(self.bands) == 0:
+            return np.zeros(windows.shape[:2] + (0,))
+        spectrum = np.fft.rfft(windows * self._taper, axis=-1)
+        power = spectrum.real**2 + spectrum.imag**2
+        return power @ self._band_matrix # (windows, channels, bands)
+
+    def _reserve(self, length):
+        capacity = self._buf.shape[0]
+        if length <= capacity:
+            return
+        new_capacity = max(length, 2 * capacity)
+        for name in ("_buf", "_sq_sum", "_zc_sum"):
+            old = getattr(self, name)
+            new = np.zeros((old.shape[0] - capacity + new_capacity, self.num_chan))
+            new[:old.shape[0]] = old
+            setattr(self, name, new)
+
+    def _consume(self, num_samples):
+        # keep only the samples from the start of the next window; rebase the running sums on it
+        if num_samples >= self._len:
+            self._skip = num_samples - self._len
+            self._len = 0
+            self._prev_sign = None # the next window starts a new run of samples
+            return
+        remaining = self._len - num_samples
+        self._buf[:remaining] = self._buf[num_samples:self._len]
+        self._sq_sum[:remaining+1] = self._sq_sum[num_samples:self._len+1] - self._sq_sum[num_samples]
+        self._zc_sum[:remaining+1] = self._zc_sum[num_samples:self._len+1] - self._zc_sum[num_samples]
+        self._len = remaining
@@ -0,0 +1,128 @@
+# Metrics Server Module
+#
+# This file is part of the Audio Connector Getting Started repository.
+# https://github.com/industrial-edge/audio-connector-getting-started
+#
+# MIT License
+#
+# Copyright (c) Siemens 2022
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import re
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+APPNAME = 'MetricsServer'
+METRIC_PREFIX = "audio_processor_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def format_metrics(snapshots):
+    """Formats diagnostics snapshots (see PacketDiagnostics.snapshot) in the Prometheus text exposition format.
+    Each snapshot's name becomes the connection label of its samples."""
+    families = {} # metric name -> (type, list of sample lines)
+
+    def add(name, metric_type, labels, value, suffix=""):
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return
+        family = families.setdefault(name, (metric_type, []))
+        label_str = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+        family[1].append(f'{name}{suffix}{{{label_str}}} {_format_value(value)}')
+
+    for snapshot in snapshots:
+        labels = {"connection":snapshot["name"]}
+        for name, value in snapshot["counters"].items():
+            add(METRIC_PREFIX + name, "counter", labels, value)
+        for name, value in snapshot["gauges"].items():
+            add(METRIC_PREFIX + name, "gauge", labels, value)
+        extra_counters = set(snapshot.get("extra_counters", ()))
+        for name, value in snapshot["extra"].items():
+            if not isinstance(value, (int, float)):
+                continue
+            if name in extra_counters:
+                # lifetime totals, e.g. "Messages dropped" -> messages_dropped_total, for rate()
+                add(METRIC_PREFIX + _metric_name(name) + "_total", "counter", labels, value)
+            else:
+                add(METRIC_PREFIX + _metric_name(name), "gauge", labels, value)
+        for name, summary in snapshot["summaries"].items():
+            metric = METRIC_PREFIX + name
+            for q, value in summary["quantiles"].items():
+                add(metric, "summary", dict(labels, quantile=f'{q:g}'), value)
+            add(metric, "summary", labels, summary["count"], suffix="_count")
+            add(metric, "summary", labels, summary["sum"], suffix="_sum")
+
+    lines = []
+    for name, (metric_type, samples) in families.items():
+        lines.append(f'# TYPE {name} {metric_type}')
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+def _metric_name(text):
+    # "Worker queue depth" -> "worker_queue_depth"
+    return re.sub(r'[^a-z0-9_]+', '_', text.lower()).strip('_')
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsServer(object):
+    """Small HTTP server exposing diagnostics snapshots at /metrics in the Prometheus text format.
+    collect() must return the list of snapshots to expose; it is called once per scrape."""
+
+    def __init__(self, collect, port=9100, host="0.0.0.0"):
+        self.collect = collect
+        self.port = port
+        self.host = host
+        self.httpd = None
+        self.thread = None
+
+    def start(self):
+        collect = self.collect
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = format_metrics(collect()).encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # keep scrapes out of the container logs
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        print(f'{APPNAME}::[METRICS] serving metrics on http://{self.host}:{self.port}/metrics', flush=True)
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
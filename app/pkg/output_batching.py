@@ -0,0 +1,117 @@
+# Output Batching Module
+#
+# This file is part of the Audio Connector Getting Started repository.
+# https://github.com/industrial-edge/audio-connector-getting-started
+#
+# MIT License
+#
+# Copyright (c) Siemens 2022
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import time
+import threading
+import numpy as np
+
+APPNAME = 'OutputBatching'
+
+# fields which are the same for every record of a batch; sent once per batch
+STATIC_FIELDS = ("band_centers_hz",)
+
+class OutputBatcher(object):
+    """Collects the results of one connection and packs them into batched messages.
+
+    Results are grouped by their key (e.g. "result", "features", "spectrum"). A batch is packed once it
+    holds max_records results or its oldest result is max_delay_ms old, using a columnar layout: one list
+    of timestamps, and per value the list of its results over time (time being the innermost axis).
+    Optionally only every decimation-th result is kept, and results which differ from the last kept one
+    by no more than change_threshold are skipped."""
+
+    def __init__(self, header, max_records=10, max_delay_ms=1000, decimation=1, change_threshold=None):
+        self.header = header # fields included in every message, e.g. connection_name
+        self.max_records = max(1, int(max_records))
+        self.max_delay = max_delay_ms / 1000.
+        self.decimation = max(1, int(decimation))
+        self.change_threshold = change_threshold
+        self.lock = threading.Lock()
+        self.batches = {}     # key -> list of (timestamp, value)
+        self.first_time = {}  # key -> time.monotonic() when the batch was started
+        self.counters = {}    # key -> results seen, for decimation
+        self.last_kept = {}   # key -> last value kept, for the change threshold
+
+    def add(self, timestamp, key, value):
+        """Add a result; returns the list of messages (json strings) ready for publishing."""
+        with self.lock:
+            count = self.counters.get(key, 0)
+            self.counters[key] = count + 1
+            if count % self.decimation != 0:
+                return []
+            if self.change_threshold is not None:
+                flat = _flatten(value)
+                last = self.last_kept.get(key)
+                if last is not None and len(last) == len(flat) and np.max(np.abs(flat - last), initial=0.) <= self.change_threshold:
+                    return []
+                self.last_kept[key] = flat
+            batch = self.batches.setdefault(key, [])
+            if len(batch) == 0:
+                self.first_time[key] = time.monotonic()
+            batch.append((timestamp, value))
+            if len(batch) >= self.max_records or time.monotonic() - self.first_time[key] >= self.max_delay:
+                return [self._pack(key)]
+            return []
+
+    def flush(self, due_only=False):
+        """Pack all pending batches (or only those older than max_delay_ms) into messages."""
+        now = time.monotonic()
+        with self.lock:
+            return [self._pack(key) for key, batch in self.batches.items()
+                    if len(batch) > 0 and (not due_only or now - self.first_time[key] >= self.max_delay)]
+
+    def _pack(self, key):
+        batch = self.batches[key]
+        self.batches[key] = []
+        message = dict(self.header)
+        message["timestamps"] = [timestamp for timestamp, _ in batch]
+        message[key] = _columnar([value for _, value in batch])
+        return json.dumps(message)
+
+def _columnar(values):
+    """Turns a list of per-record values into one value whose innermost axis is time.
+    Values whose shape varies within the batch (e.g. spectra after a change of the frame size) can not be
+    stacked; they are kept as the list of per-record values, as are static fields which are not the same
+    for all records."""
+    if isinstance(values[0], dict):
+        return {field: (_static([value[field] for value in values]) if field in STATIC_FIELDS
+                        else _columnar([value[field] for value in values]))
+                for field in values[0]}
+    if len({np.shape(value) for value in values}) > 1:
+        return [np.asarray(value).tolist() for value in values]
+    return np.moveaxis(np.asarray(values), 0, -1).tolist()
+
+def _static(values):
+    if all(value == values[0] for value in values[1:]):
+        return values[0]
+    return values
+
+def _flatten(value):
+    if isinstance(value, dict):
+        parts = [_flatten(value[field]) for field in value if field not in STATIC_FIELDS]
+        return np.concatenate(parts) if len(parts) > 0 else np.zeros(0)
+    return np.ravel(np.asarray(value, dtype=float))
@@ -0,0 +1,185 @@
+# Profiling Module
+#
+# This file is part of the Audio Connector Getting Started repository.
+# https://github.com/industrial-edge/audio-connector-getting-started
+#
+# MIT License
+#
+# Copyright (c) Siemens 2022
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import time
+import signal
+import pstats
+import cProfile
+import threading
+
+APPNAME = 'StageProfiler'
+
+class StageProfiler(object):
+    """Opt-in instrumentation of the processing pipeline.
+
+    Stage timing: the hot path brackets its stages with start() and lap(stage, t), which aggregate call
+    count, total and maximum duration per stage using perf_counter_ns. While disabled, both return at
+    once after a single attribute check.
+
+    Capture: while a capture runs, run(func, *args) executes func under a cProfile profiler of the
+    calling thread. Once the capture ends, the profiles of all threads are merged into a single .prof
+    file (readable by pstats, snakeviz, flameprof, ...). Captures can be started and stopped from
+    outside the process with signals (see install_signal_handlers)."""
+
+    def __init__(self, enabled=False, capture_dir="/tmp", capture_seconds=30):
+        self.enabled = enabled
+        self.capture_dir = capture_dir
+        self.capture_seconds = capture_seconds
+        self.capturing = False
+        self.lock = threading.Lock()
+        self.stages = {} # stage -> [count, total ns, max ns]
+        self.local = threading.local()
+        self.profiles = [] # (lock, cProfile.Profile) of each thread taking part in the capture
+        self.capture_deadline = None
+        self.capture_stop_requested = False
+
+    # stage timing
+
+    def start(self):
+        """Returns the start time of a stage, or 0 while disabled."""
+        return time.perf_counter_ns() if self.enabled else 0
+
+    def lap(self, stage, start):
+        """Records the time since start for stage; returns the current time as start of the next stage."""
+        if not self.enabled:
+            return 0
+        now = time.perf_counter_ns()
+        if start:
+            self.record(stage, now - start)
+        return now
+
+    def record(self, stage, elapsed_ns):
+        """Records a stage duration measured elsewhere (e.g. in a worker process)."""
+        if not self.enabled:
+            return
+        with self.lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = [0, 0, 0]
+            stats[0] += 1
+            stats[1] += elapsed_ns
+            if elapsed_ns > stats[2]:
+                stats[2] = elapsed_ns
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        print(f'{APPNAME}::[PROFILER] stage timing {"enabled" if enabled else "disabled"}', flush=True)
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+
+    def get_stats(self, reset=True):
+        """Returns the stage statistics since the last report, for the diagnostics report."""
+        with self.lock:
+            stages = self.stages
+            if reset:
+                self.stages = {}
+        stats = {}
+        total_ns = sum(values[1] for values in stages.values())
+        for stage, (count, stage_ns, max_ns) in stages.items():
+            stats[f'Stage {stage} calls'] = count
+            stats[f'Stage {stage} mean us'] = round(stage_ns / count / 1e3, 2)
+            stats[f'Stage {stage} max us'] = round(max_ns / 1e3, 2)
+            stats[f'Stage {stage} share percent'] = round(100. * stage_ns / total_ns, 1) if total_ns else 0.
+        return stats
+
+    # cProfile capture
+
+    def start_capture(self, seconds=None):
+        """Starts a capture; it ends after seconds (default: capture_seconds) or on stop_capture()."""
+        seconds = self.capture_seconds if seconds is None else seconds
+        with self.lock:
+            if self.capturing:
+                return
+            self.profiles = []
+            self.capture_deadline = time.monotonic() + seconds
+            self.capture_stop_requested = False
+            self.capturing = True
+        print(f'{APPNAME}::[PROFILER] capture started for {seconds} s', flush=True)
+
+    def stop_capture(self):
+        """Requests the end of the running capture; it is written by the next call of run()."""
+        self.capture_stop_requested = True
+
+    def toggle_capture(self):
+        if self.capturing:
+            self.stop_capture()
+        else:
+            self.start_capture()
+
+    def run(self, func, *args):
+        """Calls func(*args), under the calling thread's profiler while a capture runs."""
+        if not self.capturing:
+            return func(*args)
+        entry = getattr(self.local, "entry", None)
+        if entry is None or entry not in self.profiles:
+            entry = self.local.entry = (threading.Lock(), cProfile.Profile())
+            with self.lock:
+                self.profiles.append(entry)
+        with entry[0]:
+            result = entry[1].runcall(func, *args)
+        if self.capture_stop_requested or time.monotonic() >= self.capture_deadline:
+            self._finish_capture()
+        return result
+
+    def _finish_capture(self):
+        with self.lock:
+            if not self.capturing:
+                return
+            self.capturing = False
+            profiles, self.profiles = self.profiles, []
+        stats = None
+        for profile_lock, profile in profiles:
+            with profile_lock: # wait until the profile's thread left runcall
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+        if stats is None:
+            print(f'{APPNAME}::[PROFILER] capture ended without any profiled call', flush=True)
+            return
+        file_name = os.path.join(self.capture_dir, time.strftime("profile-%Y%m%d-%H%M%S.prof"))
+        stats.dump_stats(file_name)
+        print(f'{APPNAME}::[PROFILER] capture of {len(profiles)} thread(s) written to {file_name}', flush=True)
+
+    def install_signal_handlers(self, capture_signal="SIGUSR1", timing_signal="SIGUSR2"):
+        """Lets capture_signal start/stop a capture and timing_signal toggle stage timing.
+        Must be called from the main thread; a no-op on platforms without these signals."""
+        capture_signum = getattr(signal, capture_signal, None)
+        timing_signum = getattr(signal, timing_signal, None)
+        if capture_signum is not None:
+            signal.signal(capture_signum, lambda signum, frame: self._run_detached(self.toggle_capture))
+        if timing_signum is not None:
+            signal.signal(timing_signum, lambda signum, frame: self._run_detached(self.set_enabled, not self.enabled))
+
+    def _run_detached(self, func, *args):
+        # signal handlers interrupt the main thread, possibly while it holds self.lock or the stdout lock
+        thread = threading.Thread(target=func, args=args)
+        thread.daemon = True
+        thread.start()
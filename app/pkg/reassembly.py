@@ -0,0 +1,209 @@
+# Stream Reassembly Module
+#
+# This file is part of the Audio Connector Getting Started repository.
+# https://github.com/industrial-edge/audio-connector-getting-started
+#
+# MIT License
+#
+# Copyright (c) Siemens 2022
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+import heapq
+import numpy as np
+from pkg.timestamps import NS_PER_SECOND
+
+APPNAME = 'Reassembly'
+
+# how samples missing in a gap are replaced
+FILL_ZEROS = "zeros"                # silence
+FILL_INTERPOLATE = "interpolate"    # straight line from the last sample before the gap to the first one after it
+FILL_NONE = "none"                  # not replaced; the stream restarts after the gap
+FILL_METHODS = (FILL_ZEROS, FILL_INTERPOLATE, FILL_NONE)
+
+class StreamReassembler(object):
+    """Reassembles the decoded frames of one stream into a continuous sample stream.
+
+    Frames are placed by their timestamps. A frame starting where the stream left off is passed on at once;
+    frames arriving after a gap are held in a jitter buffer, ordered by timestamp, until the missing frames
+    arrive, or until the buffer holds frames starting jitter_ms or more after the gap (or max_frames frames).
+    The gap is then filled, or, if longer than max_fill_ms, the stream restarts after it. If the stream stalls
+    instead, release passes the held frames on once they waited max_hold_ms (default: jitter_ms) of wall-clock
+    time. Frames arriving after their place in the stream was passed on are dropped, and samples overlapping
+    ones passed on already are trimmed; timestamps jumping back by more than max_fill_ms restart the stream
+    as well. Sequence numbers of messages (seq) and records (rseq) are checked in stream order, for the
+    diagnostics only.
+
+    push returns the continuous stream as a list of (timestamp, array, gap) chunks, timestamps in ns: received
+    samples come with gap 0, while gap > 0 marks a gap of that many samples, filled by the chunk's array, or
+    not filled if the array is None."""
+
+    STATS_COUNTERS = ("Frames reordered", "Late frames dropped", "Gaps filled", "Samples filled", "Stream restarts",
+                      "Overlapping samples trimmed", "Messages missing (seq)", "Records missing (rseq)")
+
+    def __init__(self, sampling_rate, jitter_ms=200, fill=FILL_ZEROS, max_fill_ms=1000, max_frames=64, tolerance=1,
+                 max_hold_ms=None):
+        if fill not in FILL_METHODS:
+            raise ValueError(f'unknown fill method: {fill}')
+        self.sampling_rate = float(sampling_rate)
+        self.jitter = round(jitter_ms * NS_PER_SECOND / 1000) # ns
+        self.fill = fill
+        self.max_fill = round(max_fill_ms * self.sampling_rate / 1000) # samples
+        self.max_frames = max(1, int(max_frames))
+        self.tolerance = tolerance # samples of timestamp deviation not counted as gap or overlap
+        self.max_hold = (jitter_ms if max_hold_ms is None else max_hold_ms) / 1000. # s
+        self._heap = []         # jitter buffer: (timestamp, arrival order, array, seq, rseq)
+        self._held_since = None # time.monotonic() since frames are held back
+        self._num_pushed = 0
+        self._anchor = None     # timestamp of the first sample since the stream (re)started
+        self._pos = 0           # samples passed on since the anchor
+        self._latest = None     # latest frame timestamp pushed
+        self._last_sample = None
+        self._last_seq = None
+        self._last_rseq = None
+        # counters for the diagnostics
+        self.num_reordered = 0
+        self.num_late = 0
+        self.num_gaps = 0
+        self.gap_samples = 0
+        self.num_restarts = 0
+        self.overlap_samples = 0
+        self.missing_seq = 0
+        self.missing_rseq = 0
+
+    def push(self, array, ts, seq=None, rseq=None):
+        """Adds a (frames, channels) array starting at timestamp ts (ns); returns the chunks now continuous."""
+        chunks = []
+        if self._anchor is None:
+            self._anchor = ts
+        offset = self._offset(ts)
+        if offset + array.shape[0] <= -self.tolerance:
+            if -offset <= self.max_fill:
+                self.num_late += 1 # its place in the stream was passed on already
+                return []
+            # timestamps jumped back further than any gap filled, e.g. the sender restarted: so does the stream
+            chunks = self.flush()
+            self.num_restarts += 1
+            self._restart(ts)
+            self._latest = None
+        if self._latest is not None and ts < self._latest:
+            self.num_reordered += 1
+        else:
+            self._latest = ts
+        heapq.heappush(self._heap, (ts, self._num_pushed, array, seq, rseq))
+        self._num_pushed += 1
+        return chunks + self._drain(flush=False)
+
+    def flush(self):
+        """Passes on all buffered frames, filling the gaps between them; e.g. before the stream ends."""
+        return self._drain(flush=True)
+
+    def release(self, now=None):
+        """Passes on all buffered frames like flush, once they were held back for max_hold_ms; to be called
+        periodically, as a stalled stream pushes no frames which would release them."""
+        if self._held_since is None or (time.monotonic() if now is None else now) - self._held_since < self.max_hold:
+            return []
+        return self.flush()
+
+    def get_stats(self):
+        """Returns the reassembly counters for the diagnostics report."""
+        return {
+            "Frames buffered": len(self._heap),
+            "Frames reordered": self.num_reordered,
+            "Late frames dropped": self.num_late,
+            "Gaps filled": self.num_gaps,
+            "Samples filled": self.gap_samples,
+            "Stream restarts": self.num_restarts,
+            "Overlapping samples trimmed": self.overlap_samples,
+            "Messages missing (seq)": self.missing_seq,
+            "Records missing (rseq)": self.missing_rseq,
+        }
+
+    def _offset(self, ts):
+        # samples between the next sample due and ts; negative if ts lies before it
+        return round((ts - self._anchor) * self.sampling_rate / NS_PER_SECOND) - self._pos
+
+    def _next_ts(self):
+        return self._anchor + round(self._pos * NS_PER_SECOND / self.sampling_rate)
+
+    def _drain(self, flush):
+        chunks = []
+        while len(self._heap) > 0:
+            ts, _, array, seq, rseq = self._heap[0]
+            offset = self._offset(ts)
+            if offset > self.tolerance:
+                # gap ahead of the earliest buffered frame: wait for the missing frames, up to the jitter bound
+                if not flush and len(self._heap) <= self.max_frames and self._latest - self._next_ts() < self.jitter:
+                    break
+                chunks.append(self._fill_gap(offset, ts, array))
+            heapq.heappop(self._heap)
+            self._check_sequence(seq, rseq)
+            if offset < -self.tolerance:
+                trimmed = min(-offset, array.shape[0])
+                self.overlap_samples += trimmed
+                array = array[trimmed:]
+                if array.shape[0] == 0:
+                    continue
+            chunks.append((self._next_ts(), array, 0))
+            self._pos += array.shape[0]
+            self._last_sample = array[-1]
+        if len(self._heap) == 0:
+            self._held_since = None
+        elif self._held_since is None:
+            self._held_since = time.monotonic()
+        return chunks
+
+    def _fill_gap(self, num_samples, ts, array):
+        gap_ts = self._next_ts()
+        if self.fill == FILL_NONE or num_samples > self.max_fill:
+            # restart the stream at the frame after the gap
+            self.num_restarts += 1
+            self._restart(ts)
+            return (gap_ts, None, num_samples)
+        if self.fill == FILL_INTERPOLATE and self._last_sample is not None:
+            steps = np.arange(1, num_samples + 1).reshape(-1, 1) / (num_samples + 1)
+            fill = self._last_sample + (array[0].astype(float) - self._last_sample) * steps
+            if np.issubdtype(array.dtype, np.integer):
+                fill = np.rint(fill)
+            fill = fill.astype(array.dtype)
+        else:
+            fill = np.zeros((num_samples, array.shape[1]), dtype=array.dtype)
+        self.num_gaps += 1
+        self.gap_samples += num_samples
+        self._pos += num_samples
+        return (gap_ts, fill, num_samples)
+
+    def _restart(self, ts):
+        self._anchor = ts
+        self._pos = 0
+        self._last_sample = None
+
+    def _check_sequence(self, seq, rseq):
+        # only senders numbering their messages/records advance them; repeated numbers are not checked
+        if seq is not None:
+            if self._last_seq is not None and seq > self._last_seq + 1:
+                self.missing_seq += seq - self._last_seq - 1
+            self._last_seq = seq
+        if rseq is not None and len(rseq) > 0:
+            steps = np.diff(rseq)
+            self.missing_rseq += int(np.sum(steps[steps > 1] - 1))
+            if self._last_rseq is not None and rseq[0] > self._last_rseq + 1:
+                self.missing_rseq += rseq[0] - self._last_rseq - 1
+            self._last_rseq = rseq[-1]
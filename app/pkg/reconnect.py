@@ -0,0 +1,340 @@
+# Reconnect Module
+#
+# This file is part of the Audio Connector Getting Started repository.
+# https://github.com/industrial-edge/audio-connector-getting-started
+#
+# MIT License
+#
+# Copyright (c) Siemens 2022
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import json
+import time
+import base64
+import random
+import threading
+import collections
+
+APPNAME = 'Reconnect'
+
+# connection states, as reported in the diagnostics
+STATE_CONNECTING = "connecting"      # first connection not yet established
+STATE_CONNECTED = "connected"
+STATE_RECONNECTING = "reconnecting"  # connection lost, retrying with backoff
+STATE_DISCONNECTED = "disconnected"  # disconnected on purpose
+
+MQTT_ERR_SUCCESS = 0 # same values as paho's
+MQTT_ERR_NO_CONN = 4
+
+class Outbox(object):
+    """Bounded FIFO of (topic, payload, qos, retain) messages waiting to be published.
+
+    Once max_messages are held in memory, further messages are appended to a spill file in spill_dir,
+    if given, up to max_spill_bytes; any beyond are dropped. Messages are popped in the order they were
+    added. A spill file left over by a previous run is picked up and replayed first."""
+
+    def __init__(self, name, max_messages=1000, spill_dir=None, max_spill_bytes=100 * 2**20):
+        self.max_messages = max(0, int(max_messages))
+        self.max_spill_bytes = max_spill_bytes
+        self.memory = collections.deque()
+        self.spill_path = None
+        self.spill_writer = None
+        self.spill_reader = None
+        self.spill_bytes = 0
+        self.num_spill_pending = 0 # messages in the spill file not read back yet
+        self.num_spilled = 0
+        self.num_dropped = 0
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+            self.spill_path = os.path.join(spill_dir, f'{name}.outbox')
+            if os.path.exists(self.spill_path):
+                with open(self.spill_path) as f:
+                    self.num_spill_pending = sum(1 for line in f if line.strip())
+                self.spill_bytes = os.path.getsize(self.spill_path)
+                if self.num_spill_pending > 0:
+                    print(f'{APPNAME}::[{name}] {self.num_spill_pending} messages left in {self.spill_path} from a previous run', flush=True)
+
+    def __len__(self):
+        return len(self.memory) + self.num_spill_pending
+
+    def push(self, message):
+        """Adds a message; returns False if it was dropped."""
+        if self.num_spill_pending == 0 and len(self.memory) < self.max_messages:
+            self.memory.append(message)
+            return True
+        if self.spill_path is not None and self.spill_bytes < self.max_spill_bytes:
+            self._spill(message) # later messages follow the spilled ones, to keep the order
+            return True
+        self.num_dropped += 1
+        return False
+
+    def push_front(self, messages):
+        """Puts messages popped but not published back at the front, in their order."""
+        self.memory.extendleft(reversed(messages))
+
+    def pop(self, max_count=100):
+        """Removes and returns up to max_count of the oldest messages."""
+        messages = []
+        while len(self.memory) > 0 and len(messages) < max_count:
+            messages.append(self.memory.popleft())
+        while self.num_spill_pending > 0 and len(messages) < max_count:
+            messages.append(self._unspill())
+        return messages
+
+    def _spill(self, message):
+        topic, payload, qos, retain = message
+        entry = {"topic":topic, "qos":qos, "retain":retain}
+        if isinstance(payload, str):
+            entry["payload"] = payload
+        else:
+            entry["payload"] = base64.b64encode(bytes(payload or b"")).decode('ascii')
+            entry["encoding"] = "base64"
+        line = json.dumps(entry) + "\n"
+        if self.spill_writer is None:
+            self.spill_writer = open(self.spill_path, 'a')
+        self.spill_writer.write(line)
+        self.spill_writer.flush() # visible to the reader right away
+        self.spill_bytes += len(line)
+        self.num_spill_pending += 1
+        self.num_spilled += 1
+
+    def _unspill(self):
+        if self.spill_reader is None:
+            self.spill_reader = open(self.spill_path)
+        line = self.spill_reader.readline()
+        while line.strip() == "":
+            line = self.spill_reader.readline()
+        self.num_spill_pending -= 1
+        if self.num_spill_pending == 0:
+            # all read back: start over with an empty file
+            self.spill_reader.close()
+            self.spill_reader = None
+            if self.spill_writer is not None:
+                self.spill_writer.close()
+                self.spill_writer = None
+            os.remove(self.spill_path)
+            self.spill_bytes = 0
+        entry = json.loads(line)
+        payload = entry["payload"]
+        if entry.get("encoding") == "base64":
+            payload = base64.b64decode(payload)
+        return entry["topic"], payload, entry["qos"], entry["retain"]
+
+class ReconnectManager(object):
+    """Reconnects a transport client with exponential backoff and jitter, and buffers what is published
+    while the connection is down, replaying it in order once reconnected.
+
+    The app's on_connect and on_disconnect callbacks pass their rc on to handle_connect and handle_disconnect,
+    which never block the network loop. After an unexpected disconnect, the n-th attempt waits
+    min(max_delay, min_delay * 2^n), shortened by a random fraction of up to jitter, so clients losing the
+    broker together do not all come back at once. paho's loop_forever would retry with its own backoff, so
+    loop_forever runs the paho network loop here instead and reconnects in between; other transports run their
+    own loop and are reconnected from a timer thread.
+
+    Publishing through publish (same arguments as the client's) goes to the outbox while disconnected or while
+    older messages are still waiting in it; without an outbox, such messages are passed to the client as before."""
+
+    STATS_COUNTERS = ("Disconnections", "Reconnect attempts", "Seconds disconnected", "Outbox messages spilled",
+                      "Outbox messages dropped", "Outbox messages replayed")
+
+    def __init__(self, client, name="", min_delay=1., max_delay=60., jitter=0.5, outbox=None):
+        self.client = client
+        self.name = name
+        self.min_delay = max(0.001, float(min_delay))
+        self.max_delay = max(self.min_delay, float(max_delay))
+        self.jitter = min(1., max(0., float(jitter)))
+        self.outbox = outbox
+        self.paho = hasattr(client, "reconnect_delay_set")
+        self.lock = threading.Lock()
+        self.state = STATE_CONNECTING
+        self.attempt = 0
+        self.timer = None
+        self.reconnect_time = None # when loop_forever makes the next attempt (monotonic), for paho
+        self.stopped = threading.Event()
+        self.replaying = False
+        self.disconnect_time = None
+        self.seconds_disconnected = 0.
+        self.num_disconnects = 0
+        self.num_attempts = 0
+        self.num_replayed = 0
+
+    def next_delay(self):
+        """Backoff delay before the next reconnect attempt, in seconds."""
+        delay = min(self.max_delay, self.min_delay * 2**min(self.attempt, 32))
+        self.attempt += 1
+        return delay * (1. - self.jitter * random.random())
+
+    def handle_connect(self, rc):
+        """To be called by the client's on_connect callback."""
+        if rc != 0:
+            return # refused; handle_disconnect schedules the next attempt once the connection is closed
+        with self.lock:
+            if self.disconnect_time is not None:
+                self.seconds_disconnected += time.monotonic() - self.disconnect_time
+                self.disconnect_time = None
+            self.state = STATE_CONNECTED
+            self.attempt = 0
+            replay = self.outbox is not None and self._start_replay()
+        if replay:
+            self._run_replay()
+
+    def handle_disconnect(self, rc):
+        """To be called by the client's on_disconnect callback; rc 0 means disconnected on purpose."""
+        with self.lock:
+            if self.state == STATE_CONNECTED:
+                self.num_disconnects += 1
+                self.disconnect_time = time.monotonic()
+            if rc == 0:
+                self.state = STATE_DISCONNECTED
+                return
+            self.state = STATE_RECONNECTING
+            delay = self.next_delay()
+        print(f'{APPNAME}::[{self.name}] connection lost (rc={rc}), reconnecting in {delay:.1f} s', flush=True)
+        self._schedule(delay)
+
+    def loop_forever(self, timeout=1.):
+        """Runs the client's network loop until it is disconnected on purpose or stop is called. Blocks, like
+        the client's loop_forever, which runs the loop of other transports."""
+        if not self.paho:
+            self.client.loop_forever()
+            return
+        while not self.stopped.is_set():
+            rc = self.client.loop(timeout)
+            if rc == MQTT_ERR_SUCCESS:
+                continue
+            with self.lock:
+                state, reconnect_time = self.state, self.reconnect_time
+            if state == STATE_DISCONNECTED:
+                break
+            if state != STATE_RECONNECTING or reconnect_time is None:
+                # lost without a call of on_disconnect, e.g. before the first connect or after a reconnect attempt
+                self.handle_disconnect(rc)
+            elif not self.stopped.wait(max(0., reconnect_time - time.monotonic())):
+                self._attempt_reconnect()
+
+    def _schedule(self, delay):
+        if self.paho:
+            self.reconnect_time = time.monotonic() + delay # the next attempt of loop_forever
+            return
+        self.timer = threading.Timer(delay, self._attempt_reconnect)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _attempt_reconnect(self):
+        with self.lock:
+            if self.state != STATE_RECONNECTING:
+                return
+            self.num_attempts += 1
+            self.reconnect_time = None
+        try:
+            self.client.reconnect()
+        except Exception as err:
+            with self.lock:
+                delay = self.next_delay()
+            print(f'{APPNAME}::[{self.name}] reconnect failed: {err!r}, retrying in {delay:.1f} s', flush=True)
+            self._schedule(delay)
+
+    def stop(self):
+        with self.lock:
+            self.state = STATE_DISCONNECTED
+        self.stopped.set()
+        if self.timer is not None:
+            self.timer.cancel()
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        """Publishes right away if connected and nothing is waiting in the outbox, queues the message otherwise.
+        Returns the rc of the client's publish, or MQTT_ERR_SUCCESS if queued."""
+        if self.outbox is None:
+            return self.client.publish(topic, payload, qos=qos, retain=retain)[0]
+        with self.lock:
+            if self.state != STATE_CONNECTED or self.replaying or len(self.outbox) > 0:
+                self.outbox.push((topic, payload, qos, retain))
+                replay = self._start_replay()
+            else:
+                replay = None
+        if replay is None:
+            rc = self.client.publish(topic, payload, qos=qos, retain=retain)[0]
+            if rc != MQTT_ERR_SUCCESS and not self._kept_by_client(rc, qos):
+                with self.lock: # lost the connection meanwhile
+                    self.outbox.push((topic, payload, qos, retain))
+        elif replay:
+            self._run_replay()
+        return MQTT_ERR_SUCCESS
+
+    def _kept_by_client(self, rc, qos):
+        # paho holds on to messages with qos > 0 published while disconnected, and sends them once reconnected;
+        # any other error, e.g. MQTT_ERR_QUEUE_SIZE with its queue full, loses the message
+        return self.paho and qos > 0 and rc == MQTT_ERR_NO_CONN
+
+    def _start_replay(self):
+        # with the lock held: whether the caller has to start a replay of the outbox
+        if self.state != STATE_CONNECTED or self.replaying or len(self.outbox) == 0:
+            return False
+        self.replaying = True
+        return True
+
+    def _run_replay(self):
+        # replay outside the network loop, which has to keep running for the messages to go out
+        thread = threading.Thread(target=self._replay)
+        thread.daemon = True
+        thread.start()
+
+    def _replay(self):
+        num_replayed = 0
+        while True:
+            with self.lock:
+                messages = self.outbox.pop() if self.state == STATE_CONNECTED else []
+                if len(messages) == 0:
+                    self.replaying = False
+                    self.num_replayed += num_replayed
+                    break
+            for indx, (topic, payload, qos, retain) in enumerate(messages):
+                rc = self.client.publish(topic, payload, qos=qos, retain=retain)[0]
+                if rc != MQTT_ERR_SUCCESS:
+                    with self.lock:
+                        self.outbox.push_front(messages[indx+1 if self._kept_by_client(rc, qos) else indx:])
+                        self.replaying = False
+                        self.num_replayed += num_replayed
+                    return # disconnected again; the next connect replays the rest
+                num_replayed += 1
+        print(f'{APPNAME}::[{self.name}] replayed {num_replayed} buffered messages', flush=True)
+
+    def get_stats(self):
+        """Returns the connection state and outbox counters for the diagnostics report."""
+        with self.lock:
+            seconds_disconnected = self.seconds_disconnected
+            if self.disconnect_time is not None:
+                seconds_disconnected += time.monotonic() - self.disconnect_time
+            stats = {
+                "Connection state": self.state,
+                "Connected": int(self.state == STATE_CONNECTED), # numeric, for the metrics endpoint
+                "Disconnections": self.num_disconnects,
+                "Reconnect attempts": self.num_attempts,
+                "Seconds disconnected": seconds_disconnected,
+            }
+            if self.outbox is not None:
+                stats.update({
+                    "Outbox depth": len(self.outbox),
+                    "Outbox messages spilled": self.outbox.num_spilled,
+                    "Outbox messages dropped": self.outbox.num_dropped,
+                    "Outbox messages replayed": self.num_replayed,
+                })
+        return stats
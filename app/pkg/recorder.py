@@ -0,0 +1,225 @@
+# Audio Recorder Module
+#
+# This file is part of the Audio Connector Getting Started repository.
+# https://github.com/industrial-edge/audio-connector-getting-started
+#
+# MIT License
+#
+# Copyright (c) Siemens 2022
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import re
+import queue
+import struct
+import datetime
+import threading
+import numpy as np
+from pkg.timestamps import NS_PER_SECOND
+
+APPNAME = 'AudioRecorder'
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+
+class RingRecorder(object):
+    """Records the decoded audio of one connection into a preallocated, memory-mapped circular file.
+
+    The file holds the last retention_s seconds of samples; frames are written sequentially and wrap around
+    at its end. A compact in-memory index holds the timestamp and stream position of each recorded frame,
+    so an export of the last seconds only reads the samples it needs. Frames and export requests are queued,
+    and handled in order by a writer thread of the recorder, never by the caller. The file is allocated once
+    the first frame arrives, in the data type and number of channels of that frame."""
+
+    STATS_COUNTERS = ("Recorder frames dropped", "Recordings exported")
+
+    def __init__(self, name, sampling_rate, directory="/tmp/recordings", retention_s=60., export_dir=None, queue_size=256):
+        self.name = name
+        self.sampling_rate = sampling_rate
+        self.directory = directory
+        self.export_dir = directory if export_dir is None else export_dir
+        self.path = os.path.join(directory, _file_name(name) + '.ring')
+        self.capacity = max(1, round(retention_s * sampling_rate)) # samples
+        self.buffer = None          # memory-mapped (capacity, channels) sample array
+        self.position = 0           # samples written since the start, i.e. stream position of the next sample
+        # index ring buffer: timestamp (ns) and stream position of the first sample of each frame
+        self.index_size = self.capacity // 64 + 2 # frames are hardly ever shorter than 64 samples
+        self.index_ts = np.zeros(self.index_size, dtype=np.int64)
+        self.index_pos = np.zeros(self.index_size, dtype=np.int64)
+        self.index_len = 0          # frames recorded since the start
+        self.lock = threading.Lock() # guards buffer, position and index, which exports read
+        self.num_dropped = 0
+        self.num_exports = 0
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name=f'{APPNAME}-{self.name}')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Writes the queued frames, then ends the writer thread and releases the file."""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def add(self, ts, array):
+        """Queues a (frames, channels) array starting at ts (ns since the epoch) for recording.
+        Never blocks: if the writer falls behind, the frame is dropped and counted."""
+        try:
+            self.queue.put_nowait((self._write, (ts, array)))
+        except queue.Full:
+            self.num_dropped += 1
+
+    def export(self, seconds=None, path=None, start_ns=None, end_ns=None):
+        """Queues an export into a WAV file of the last seconds recorded (up to the frames queued before it), or of
+        the samples from start_ns to end_ns (ns since the epoch), as far as they are recorded; by default, named
+        after the connection and the time of the first sample exported, in export_dir."""
+        try:
+            self.queue.put_nowait((self._export, (seconds, path, start_ns, end_ns)))
+            return True
+        except queue.Full:
+            what = f'the last {seconds} s' if start_ns is None else f'{(end_ns - start_ns) / NS_PER_SECOND:g} s'
+            print(f'{APPNAME}::[{self.name}] Error - recorder queue full, export of {what} skipped', flush=True)
+            return False
+
+    def get_stats(self):
+        """Returns the recorder counters for the diagnostics report."""
+        with self.lock:
+            recorded = min(self.position, self.capacity) / self.sampling_rate
+        return {
+            "Recorded seconds": recorded,
+            "Recorder queue depth": self.queue.qsize(),
+            "Recorder frames dropped": self.num_dropped,
+            "Recordings exported": self.num_exports,
+        }
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            handler, args = item
+            try:
+                handler(*args)
+            except Exception as err:
+                print(f'{APPNAME}::[{self.name}] Error - {handler.__name__.strip("_")} failed: {err}', flush=True)
+        with self.lock:
+            if self.buffer is not None:
+                self.buffer.flush()
+                self.buffer = None # unmaps the file
+
+    def _allocate(self, array):
+        os.makedirs(self.directory, exist_ok=True)
+        self.buffer = np.memmap(self.path, dtype=array.dtype, mode='w+', shape=(self.capacity, array.shape[1]))
+        print(f'{APPNAME}::[{self.name}] recording the last {self.capacity / self.sampling_rate:g} s into {self.path} '
+              f'({self.buffer.nbytes / 2**20:.1f} MB)', flush=True)
+
+    def _write(self, ts, array):
+        if self.buffer is None:
+            self._allocate(array)
+        num_samples = min(array.shape[0], self.capacity)
+        array = array[array.shape[0]-num_samples:]
+        with self.lock:
+            # sequential write, in up to two parts where it wraps around the end of the file
+            start = self.position % self.capacity
+            first = min(num_samples, self.capacity - start)
+            self.buffer[start:start+first] = array[:first]
+            self.buffer[:num_samples-first] = array[first:]
+            indx = self.index_len % self.index_size
+            self.index_ts[indx] = ts
+            self.index_pos[indx] = self.position
+            self.index_len += 1
+            self.position += num_samples
+
+    def _stream_position(self, index_ts, index_pos, ts):
+        """Stream position of the sample at ts (ns), found by the timestamp of the frame holding it; timestamps
+        before the first frame indexed map to it, those in a gap between two frames to the start of the later one."""
+        frame = int(np.searchsorted(index_ts, ts, side='right')) - 1
+        if frame < 0:
+            return int(index_pos[0])
+        position = index_pos[frame] + round((ts - index_ts[frame]) * self.sampling_rate / NS_PER_SECOND)
+        if frame + 1 < len(index_pos):
+            position = min(position, index_pos[frame + 1])
+        return int(position)
+
+    def _export(self, seconds, path, start_ns, end_ns):
+        with self.lock:
+            if self.buffer is None or self.index_len == 0:
+                print(f'{APPNAME}::[{self.name}] nothing recorded yet, export skipped', flush=True)
+                return
+            # oldest sample still in the file, and the frames indexed since then
+            oldest = max(0, self.position - self.capacity)
+            count = min(self.index_len, self.index_size)
+            order = (np.arange(count) + self.index_len - count) % self.index_size
+            index_ts, index_pos = self.index_ts[order], self.index_pos[order]
+            valid = index_pos >= oldest
+            index_ts, index_pos = index_ts[valid], index_pos[valid]
+            if len(index_ts) == 0:
+                return
+            if start_ns is None:
+                end_ts = index_ts[-1] + round((self.position - index_pos[-1]) * NS_PER_SECOND / self.sampling_rate)
+                start_ns = end_ts - round(seconds * NS_PER_SECOND)
+            start = int(max(oldest, min(self._stream_position(index_ts, index_pos, start_ns), self.position)))
+            end = self.position if end_ns is None else self._stream_position(index_ts, index_pos, end_ns)
+            end = int(max(start, min(end, self.position)))
+            # timestamp of the first sample exported, from the frame holding it
+            frame = int(np.searchsorted(index_pos, start, side='right')) - 1
+            first_ts = index_ts[frame] + round((start - index_pos[frame]) * NS_PER_SECOND / self.sampling_rate)
+            # read only the samples exported, in up to two parts where they wrap around
+            begin, stop = start % self.capacity, start % self.capacity + end - start
+            samples = np.concatenate((self.buffer[begin:min(stop, self.capacity)], self.buffer[:max(0, stop - self.capacity)]))
+
+        if path is None:
+            stamp = datetime.datetime.fromtimestamp(first_ts / NS_PER_SECOND, datetime.timezone.utc).strftime('%Y%m%d-%H%M%S.%f')[:-3]
+            path = os.path.join(self.export_dir, f'{_file_name(self.name)}-{stamp}.wav')
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        write_wave(path, self.sampling_rate, samples)
+        self.num_exports += 1
+        print(f'{APPNAME}::[{self.name}] exported {samples.shape[0] / self.sampling_rate:.2f} s to {path}', flush=True)
+
+def write_wave(path, sampling_rate, array):
+    """Writes a (frames, channels) array as WAV file: integer PCM, or IEEE float for float arrays."""
+    array = np.asarray(array)
+    if array.ndim == 1:
+        array = array.reshape(-1, 1)
+    if np.issubdtype(array.dtype, np.floating):
+        fmt_tag = WAVE_FORMAT_IEEE_FLOAT
+    elif array.dtype.itemsize == 1:
+        fmt_tag = WAVE_FORMAT_PCM
+        if array.dtype != np.uint8:
+            array = (array.astype(np.int16) + 128).astype(np.uint8) # 8-bit WAV samples are unsigned
+    else:
+        fmt_tag = WAVE_FORMAT_PCM
+    data = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<')).tobytes()
+    num_chan, sample_size = array.shape[1], array.dtype.itemsize
+    rate = int(round(sampling_rate))
+    with open(path, 'wb') as file:
+        file.write(b'RIFF' + struct.pack('<I', 36 + len(data)) + b'WAVE')
+        file.write(b'fmt ' + struct.pack('<IHHIIHH', 16, fmt_tag, num_chan, rate,
+                                         rate * num_chan * sample_size, num_chan * sample_size, 8 * sample_size))
+        file.write(b'data' + struct.pack('<I', len(data)))
+        file.write(data)
+
+def _file_name(name):
+    # connection names may hold characters which are not valid in file names
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
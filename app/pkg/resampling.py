@@ -0,0 +1,113 @@
+# Resampling Module
+#
+# This file is part of the Audio Connector Getting Started repository.
+# https://github.com/industrial-edge/audio-connector-getting-started
+#
+# MIT License
+#
+# Copyright (c) Siemens 2022
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import math
+import functools
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from pkg.timestamps import NS_PER_SECOND
+
+APPNAME = 'Resampling'
+
+@functools.lru_cache(maxsize=32)
+def get_polyphase_filter(source_rate, target_rate, half_width=10, beta=5.):
+    """Returns the rational factors up, down (target_rate / source_rate = up / down), the delay of the filter in
+    samples of the upsampled stream, and its (read-only, cached) polyphase matrix of shape (up, taps): row p holds
+    the coefficients h[p], h[p+up], h[p+2*up], ... of the Kaiser windowed sinc lowpass filter h, which cuts off at
+    the lower of both Nyquist frequencies. half_width is the filter length either side of its center, in samples
+    of the lower rate. Cached per (source_rate, target_rate)."""
+    gcd = math.gcd(int(source_rate), int(target_rate))
+    up, down = int(target_rate) // gcd, int(source_rate) // gcd
+    max_rate = max(up, down)
+    half_len = half_width * max_rate
+    n = np.arange(-half_len, half_len + 1)
+    h = np.sinc(n / max_rate) / max_rate * np.kaiser(2 * half_len + 1, beta) * up # gain up, for the zeros inserted
+    taps = -(-len(h) // up)
+    h = np.concatenate((h, np.zeros(taps * up - len(h))))
+    phases = np.ascontiguousarray(h.reshape(taps, up).T)
+    phases.setflags(write=False)
+    return up, down, half_len, phases
+
+class PolyphaseResampler(object):
+    """Converts a continuous stream of frames from source_rate to target_rate.
+
+    Equivalent to upsampling by up, lowpass filtering and downsampling by down, but each output sample is computed
+    from the input samples and the one polyphase branch it depends on. Output samples k, k+up, k+2*up, ... share
+    their branch and lie down input samples apart, so each such group is a single product of a strided view of
+    the input with the branch, without copying the input.
+    The last input samples are kept between frames, so the filter runs across frame boundaries; the filter delay
+    is compensated by a look-ahead of half_width samples, so output samples keep the timestamps of their inputs."""
+
+    def __init__(self, source_rate, target_rate, half_width=10):
+        self.source_rate = source_rate
+        self.target_rate = target_rate
+        self.up, self.down, self.half_len, self.phases = get_polyphase_filter(
+            int(round(source_rate)), int(round(target_rate)), half_width)
+        self.taps = self.phases.shape[1]
+        self._branches = np.ascontiguousarray(self.phases[:, ::-1]) # oldest input sample first, as in the views
+        self.reset()
+
+    def reset(self):
+        """Forget all buffered samples, e.g. after a gap in the stream; the next frame starts a new stream."""
+        self._buf = None    # input samples still needed, preceded by zeros at the start of the stream
+        self._buf_start = 0 # input sample index of _buf[0], counted from the start of the stream
+        self._num_in = 0    # input samples pushed since the start of the stream
+        self._num_out = 0   # output samples returned since the start of the stream
+        self._anchor = None # timestamp of the first input sample (ns)
+
+    def push(self, array, ts=None):
+        """Add a (frames, channels) array starting at timestamp ts (ns). Returns the timestamp of the first output
+        sample and the (frames, channels) float array of all output samples which the input now suffices for."""
+        if self._buf is None:
+            self._buf = np.zeros((self.taps - 1, array.shape[1]))
+            self._buf_start = -(self.taps - 1)
+            self._anchor = ts
+        self._buf = np.concatenate((self._buf, array))
+        self._num_in += array.shape[0]
+
+        # output sample k is at k*down + half_len in the upsampled stream; it needs the inputs up to that position
+        num_out = max(0, (self._num_in * self.up - 1 - self.half_len) // self.down + 1)
+        positions = np.arange(self._num_out, num_out) * self.down + self.half_len
+        oldest = positions // self.up - (self.taps - 1) - self._buf_start # oldest input sample of each output sample
+        windows = sliding_window_view(self._buf, self.taps, axis=0) # windows[i, c, t] = _buf[i + t, c]
+        out = np.empty((len(positions), self._buf.shape[1]))
+        for group in range(min(self.up, len(positions))):
+            count = len(range(group, len(positions), self.up))
+            start = oldest[group]
+            out[group::self.up] = windows[start:start+count*self.down:self.down] @ self._branches[positions[group] % self.up]
+
+        out_ts = None
+        if self._anchor is not None:
+            out_ts = self._anchor + round(self._num_out * NS_PER_SECOND / self.target_rate)
+        self._num_out = num_out
+
+        # keep the inputs the next output sample starts from
+        oldest = (num_out * self.down + self.half_len) // self.up - (self.taps - 1)
+        if oldest > self._buf_start:
+            self._buf = self._buf[oldest - self._buf_start:]
+            self._buf_start = oldest
+        return out_ts, out
@@ -0,0 +1,164 @@
+# Spectral Analysis Module
+#
+# This file is part of the Audio Connector Getting Started repository.
+# https://github.com/industrial-edge/audio-connector-getting-started
+#
+# MIT License
+#
+# Copyright (c) Siemens 2022
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import functools
+import numpy as np
+from pkg.timestamps import NS_PER_SECOND
+
+APPNAME = 'SpectralAnalysis'
+
+# predefined band sets
+BANDS_OCTAVE = "octave"
+BANDS_THIRD_OCTAVE = "third_octave"
+
+WINDOW_FUNCTIONS = {
+    "hann": np.hanning,
+    "hamming": np.hamming,
+    "blackman": np.blackman,
+    "rectangular": np.ones,
+}
+
+@functools.lru_cache(maxsize=32)
+def get_window(name, size):
+    """Returns the (read-only, cached) window function of the given name and length."""
+    if name not in WINDOW_FUNCTIONS:
+        raise ValueError(f'unknown window function: {name}')
+    window = WINDOW_FUNCTIONS[name](size).astype(float)
+    window.setflags(write=False)
+    return window
+
+@functools.lru_cache(maxsize=32)
+def get_band_table(frame_size, sampling_rate, bands, window="hann", min_freq=20.):
+    """Returns band centers (Hz) and the (bins, bands) matrix which sums the rfft power of a frame_size frame
+    into bands. The matrix includes the one-sided spectrum and window scaling, so the band powers of a frame
+    add up to its mean square. bands is BANDS_OCTAVE, BANDS_THIRD_OCTAVE or a tuple of (low, high) tuples in Hz.
+    Octave bands containing no frequency bin are left out, user-defined bands are always kept.
+    Cached per (frame_size, sampling_rate, bands, window)."""
+    freqs = np.fft.rfftfreq(frame_size, 1. / sampling_rate)
+    edges = _band_edges(bands, sampling_rate / 2., min_freq)
+    masks = [(freqs >= low) & (freqs < high) for low, high in edges]
+    keep = [indx for indx, mask in enumerate(masks) if mask.any() or not isinstance(bands, str)]
+    centers = np.array([np.sqrt(edges[indx][0] * edges[indx][1]) if edges[indx][0] > 0 else edges[indx][1] / 2.
+                        for indx in keep])
+    matrix = np.array([masks[indx] for indx in keep], dtype=float).T.reshape(len(freqs), len(keep))
+
+    # one-sided spectrum: all bins but DC (and Nyquist) stand for two; undo the window gain
+    bin_weight = np.full(len(freqs), 2.)
+    bin_weight[0] = 1.
+    if frame_size % 2 == 0:
+        bin_weight[-1] = 1.
+    bin_weight /= frame_size * np.sum(get_window(window, frame_size)**2)
+    matrix *= bin_weight[:, None]
+    centers.setflags(write=False)
+    matrix.setflags(write=False)
+    return centers, matrix
+
+def _band_edges(bands, nyquist, min_freq):
+    if bands == BANDS_OCTAVE or bands == BANDS_THIRD_OCTAVE:
+        fraction = 1 if bands == BANDS_OCTAVE else 3
+        # nominal centers 1 kHz * 2^(k/fraction), edges half a band either side
+        k_min = int(np.floor(fraction * np.log2(min_freq / 1000.)))
+        k_max = int(np.ceil(fraction * np.log2(nyquist / 1000.)))
+        edges = []
+        for k in range(k_min, k_max + 1):
+            center = 1000. * 2**(k / fraction)
+            low, high = center * 2**(-0.5 / fraction), center * 2**(0.5 / fraction)
+            if high > min_freq and low < nyquist:
+                edges.append((low, high))
+        return edges
+    return [(float(low), float(high)) for low, high in bands]
+
+class SpectralAnalyzer(object):
+    """Band-aggregated power spectra of all channels of a stream.
+
+    Incoming samples are cut into consecutive frames of frame_size samples, independent of the size of the
+    blocks pushed, and collected into a batch of frames_per_batch frames, which is then transformed by a
+    single rfft across all frames and channels. Window functions and band tables are cached per
+    (frame_size, sampling_rate). With average=True, each batch yields one spectrum averaged over its frames."""
+
+    def __init__(self, sampling_rate, frame_size, bands=BANDS_THIRD_OCTAVE, window="hann", frames_per_batch=1, average=True, min_freq=20.):
+        if frame_size < 2:
+            raise ValueError(f'invalid frame size ({frame_size})')
+        self.sampling_rate = float(sampling_rate)
+        self.frame_size = int(frame_size)
+        self.bands = bands if isinstance(bands, str) else tuple(tuple(band) for band in bands)
+        self.window = window
+        self.frames_per_batch = max(1, int(frames_per_batch))
+        self.average = average
+        self.min_freq = min_freq
+        self._batch = None     # (frames_per_batch * frame_size, channels) samples, frame after frame
+        self._len = 0          # samples collected in the batch
+        self._batch_ts = []    # timestamp of each frame started in the batch
+        get_window(window, 2)  # fail early on unknown windows
+
+    def reset(self):
+        """Forget the samples collected so far, e.g. after a gap in the stream."""
+        self._len = 0
+        self._batch_ts = []
+
+    def push(self, array, ts=None):
+        """Append a (frames, channels) block of samples; ts is the int ns timestamp of its first sample.
+        Returns a list of (ts, band centers, levels) tuples, one per finished spectrum (none until the batch
+        is complete); levels are in dB, shaped (channels, bands)."""
+        if self._batch is None or self._batch.shape[1] != array.shape[1]:
+            self._batch = np.empty((self.frames_per_batch * self.frame_size, array.shape[1]))
+            self.reset() # channels changed
+        results = []
+        pos = 0
+        while pos < array.shape[0]:
+            num_new = min(array.shape[0] - pos, self._batch.shape[0] - self._len)
+            # timestamps of the frames starting within the new samples
+            for start in range(-(-self._len // self.frame_size) * self.frame_size, self._len + num_new, self.frame_size):
+                offset = pos + start - self._len
+                self._batch_ts.append(None if ts is None else ts + round(offset * NS_PER_SECOND / self.sampling_rate))
+            self._batch[self._len:self._len+num_new] = array[pos:pos+num_new]
+            self._len += num_new
+            pos += num_new
+            if self._len == self._batch.shape[0]:
+                results += self.flush()
+        return results
+
+    def flush(self):
+        """Transform the complete frames collected so far, even if the batch is not complete;
+        the samples of an incomplete frame are dropped."""
+        num_frames = self._len // self.frame_size
+        timestamps = self._batch_ts[:num_frames]
+        self.reset()
+        if num_frames == 0:
+            return []
+        batch = self._batch[:num_frames * self.frame_size].reshape(num_frames, self.frame_size, -1)
+        centers, matrix = get_band_table(self.frame_size, self.sampling_rate, self.bands, self.window, self.min_freq)
+        spectrum = np.fft.rfft(batch * get_window(self.window, self.frame_size)[:, None], axis=1)
+        power = spectrum.real**2 + spectrum.imag**2 # (frames, bins, channels)
+        band_power = np.matmul(power.transpose(0, 2, 1), matrix) # (frames, channels, bands)
+        if self.average:
+            return [(timestamps[0], centers, _to_db(band_power.mean(axis=0)))]
+        levels = _to_db(band_power)
+        return [(timestamps[indx], centers, levels[indx]) for indx in range(num_frames)]
+
+def _to_db(power):
+    return 10. * np.log10(np.maximum(power, 1e-20))
@@ -0,0 +1,129 @@
+# Timestamps Module
+#
+# This file is part of the Audio Connector Getting Started repository.
+# https://github.com/industrial-edge/audio-connector-getting-started
+#
+# MIT License
+#
+# Copyright (c) Siemens 2022
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import datetime
+
+APPNAME = 'Timestamps'
+
+# Databus timestamps are ISO 8601 strings with 7 decimal places and a Z, e.g. "2022-07-24T02:47:01.9981570Z".
+# Within the app they are handled as integer nanoseconds since the epoch (int64 range lasts until 2262),
+# which keeps their full precision and makes time arithmetic exact.
+NS_PER_SECOND = 1_000_000_000
+NS_PER_MINUTE = 60 * NS_PER_SECOND
+TIMESTAMP_DECIMALS = 7 # decimal places written by format_timestamp_ns, as in the Databus payloads
+
+_MAX_CACHE_SIZE = 256
+_parse_cache = {}      # "YYYY-MM-DDTHH:MM:SS" (UTC) or ("YYYY-MM-DDTHH:MM:SS", zone) -> ns of that second
+_format_cache = (None, None) # (minute since the epoch, "YYYY-MM-DDTHH:MM:") of the last formatted timestamp
+
+def parse_timestamp_ns(timestamp):
+    """Parses an ISO 8601 timestamp string into integer nanoseconds since the epoch.
+
+    Accepts any number of decimal places (digits beyond the ninth are truncated), and a Z or +HH:MM
+    offset; timestamps without either are taken as local time. Consecutive frames share the date and
+    time up to the seconds, so the epoch offset of that second is cached and only the decimals are parsed."""
+    end = len(timestamp)
+    if end == 28 and timestamp[27] == 'Z' and timestamp[19] == '.':
+        # the Databus layout: 7 decimals, i.e. 100 ns ticks
+        second_ns = _parse_cache.get(timestamp[:19])
+        if second_ns is not None:
+            try:
+                return second_ns + int(timestamp[20:27]) * 100
+            except ValueError:
+                return _parse_timestamp_ns_slow(timestamp)
+    if end < 19 or timestamp[16] != ':':
+        return _parse_timestamp_ns_slow(timestamp)
+    zone = ''
+    if timestamp[-1] == 'Z':
+        end -= 1
+        zone = 'Z'
+    elif end >= 25 and timestamp[-3] == ':' and timestamp[-6] in '+-':
+        end -= 6
+        zone = timestamp[end:]
+
+    try:
+        key = timestamp[:19] if zone == 'Z' else (timestamp[:19], zone)
+        second_ns = _parse_cache.get(key)
+        if second_ns is None:
+            second_ns = _second_ns(timestamp[:19], zone)
+            if len(_parse_cache) >= _MAX_CACHE_SIZE:
+                _parse_cache.clear()
+            _parse_cache[key] = second_ns
+        if end > 20 and timestamp[19] == '.':
+            decimals = timestamp[20:end]
+            if len(decimals) >= 9:
+                return second_ns + int(decimals[:9])
+            return second_ns + int(decimals) * 10 ** (9 - len(decimals))
+        if end != 19:
+            raise ValueError
+        return second_ns
+    except ValueError:
+        return _parse_timestamp_ns_slow(timestamp)
+
+def format_timestamp_ns(ns):
+    """Formats integer nanoseconds since the epoch as Databus timestamp string (UTC, 7 decimal places, Z).
+    As in parse_timestamp_ns, the date and time up to the minute are cached between consecutive calls."""
+    global _format_cache
+    ns = int(ns)
+    minute = ns // NS_PER_MINUTE
+    cached_minute, prefix = _format_cache
+    if minute != cached_minute:
+        prefix = datetime.datetime.fromtimestamp(minute * 60, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:')
+        _format_cache = (minute, prefix)
+    ns -= minute * NS_PER_MINUTE
+    return f'{prefix}{ns // NS_PER_SECOND:02d}.{ns % NS_PER_SECOND // 10 ** (9 - TIMESTAMP_DECIMALS):07d}Z'
+
+def datetime_to_ns(ts):
+    """Integer nanoseconds since the epoch of a datetime object; naive datetimes are taken as local time."""
+    if ts.tzinfo is None:
+        ts = ts.astimezone() # attach the local time zone
+    delta = ts - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * NS_PER_SECOND + delta.microseconds * 1000
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+def _second_ns(prefix, zone):
+    """ns since the epoch of the second "YYYY-MM-DDTHH:MM:SS" in the given zone ('', 'Z' or '+HH:MM')."""
+    ts = datetime.datetime.fromisoformat(prefix)
+    if zone == 'Z':
+        ts = ts.replace(tzinfo=datetime.timezone.utc)
+    elif zone:
+        ts = ts.replace(tzinfo=datetime.datetime.strptime(zone.replace(':', ''), '%z').tzinfo)
+    return datetime_to_ns(ts)
+
+def _parse_timestamp_ns_slow(timestamp):
+    """Fallback for timestamps the fast path does not handle, e.g. without seconds; microsecond precision."""
+    if timestamp.endswith('Z'):
+        timestamp = timestamp[:-1] + '+00:00'
+    decimal_index = timestamp.find('.')
+    if decimal_index >= 0:
+        # fromisoformat of python < 3.11 only accepts 3 or 6 decimal places
+        end = decimal_index + 1
+        while end < len(timestamp) and timestamp[end].isdigit():
+            end += 1
+        timestamp = timestamp[:decimal_index+1] + timestamp[decimal_index+1:end][:6].ljust(6, '0') + timestamp[end:]
+    return datetime_to_ns(datetime.datetime.fromisoformat(timestamp))
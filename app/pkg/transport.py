@@ -0,0 +1,429 @@
+# Transport Module
+#
+# This file is part of the Audio Connector Getting Started repository.
+# https://github.com/industrial-edge/audio-connector-getting-started
+#
+# MIT License
+#
+# Copyright (c) Siemens 2022
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import time
+import base64
+import threading
+import collections
+from paho.mqtt import client as mqtt
+
+APPNAME = 'Transport'
+
+# transport types, see create_transport
+TRANSPORT_MQTT = "mqtt"          # paho MQTT client, connecting to a broker (e.g. the IE Databus)
+TRANSPORT_LOOPBACK = "loopback"  # in-process broker stand-in, shared by all loopback clients of a process
+TRANSPORT_REPLAY = "replay"      # feeds the messages of a recorded trace file to the subscriber
+TRANSPORT_TYPES = (TRANSPORT_MQTT, TRANSPORT_LOOPBACK, TRANSPORT_REPLAY)
+
+def create_transport(config, client_id=""):
+    """Creates the client used to talk to the databus, as configured by a "transport" config section.
+    All transports offer the subset of the paho client interface used by the apps: on_connect,
+    on_disconnect and on_message callbacks, connect, reconnect, disconnect, subscribe, unsubscribe,
+    publish, loop_start, loop_stop and loop_forever."""
+    transport_type = config.get("type", TRANSPORT_MQTT)
+    if transport_type == TRANSPORT_MQTT:
+        return mqtt.Client(client_id=client_id)
+    if transport_type == TRANSPORT_LOOPBACK:
+        return LoopbackClient(client_id, inline=config.get("inline", False), queue_size=config.get("queue_size", 1024))
+    if transport_type == TRANSPORT_REPLAY:
+        return ReplayClient(config["trace_file"], speed=config.get("speed", 1.), loops=config.get("loops", 1),
+                            client_id=client_id)
+    raise ValueError(f'unknown transport type: {transport_type}')
+
+class TransportMessage(object):
+    """Received message; mirrors the attributes of paho's MQTTMessage used by the apps."""
+    __slots__ = ("topic", "payload", "qos", "retain", "timestamp")
+
+    def __init__(self, topic, payload, qos=0, retain=False, timestamp=None):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+def _to_bytes(payload):
+    # same conversions as paho's publish
+    if payload is None:
+        return b""
+    if isinstance(payload, (bytes, bytearray)):
+        return bytes(payload)
+    if isinstance(payload, str):
+        return payload.encode('utf-8')
+    return str(payload).encode('ascii')
+
+class LoopbackBroker(object):
+    """In-memory stand-in for an MQTT broker; routes published messages to the subscribed loopback clients."""
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.exact = {} # topic -> set of clients
+        self.wildcard = {} # topic filter with + or # -> set of clients
+        self.retained = {} # topic -> TransportMessage
+
+    def subscribe(self, client, topic_filter):
+        table = self.wildcard if ('+' in topic_filter or '#' in topic_filter) else self.exact
+        with self.lock:
+            table.setdefault(topic_filter, set()).add(client)
+            retained = [msg for topic, msg in self.retained.items() if mqtt.topic_matches_sub(topic_filter, topic)]
+        for msg in retained:
+            client._deliver(msg)
+
+    def unsubscribe(self, client, topic_filter):
+        table = self.wildcard if ('+' in topic_filter or '#' in topic_filter) else self.exact
+        with self.lock:
+            clients = table.get(topic_filter)
+            if clients is not None:
+                clients.discard(client)
+                if len(clients) == 0:
+                    del table[topic_filter]
+
+    def detach(self, client):
+        with self.lock:
+            for table in (self.exact, self.wildcard):
+                for topic_filter in [topic_filter for topic_filter, clients in table.items() if client in clients]:
+                    table[topic_filter].discard(client)
+                    if len(table[topic_filter]) == 0:
+                        del table[topic_filter]
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        msg = TransportMessage(topic, _to_bytes(payload), qos, retain)
+        with self.lock:
+            if retain:
+                if len(msg.payload) == 0:
+                    self.retained.pop(topic, None)
+                else:
+                    self.retained[topic] = msg
+            targets = set(self.exact.get(topic, ()))
+            for topic_filter, clients in self.wildcard.items():
+                if mqtt.topic_matches_sub(topic_filter, topic):
+                    targets.update(clients)
+        # deliver outside the lock; a subscriber may block on its full queue
+        for client in targets:
+            client._deliver(msg)
+
+_BROKERS = {}
+_BROKERS_LOCK = threading.Lock()
+
+def get_loopback_broker(name="loopback"):
+    """Returns the process-wide loopback broker of the given name (e.g. the databus host name)."""
+    with _BROKERS_LOCK:
+        broker = _BROKERS.get(name)
+        if broker is None:
+            broker = _BROKERS[name] = LoopbackBroker(name)
+        return broker
+
+class LoopbackClient(object):
+    """Client of an in-process LoopbackBroker, a drop-in replacement of the paho client without any network.
+
+    Like with paho, callbacks run in the client's network loop (loop_forever, or the thread of loop_start);
+    each client has a bounded queue of received messages, and publishers wait while it is full, so a fast
+    publisher is throttled to the pace of its subscribers. With inline=True, callbacks run right away in
+    the publisher's thread instead."""
+
+    def __init__(self, client_id="", inline=False, queue_size=1024):
+        self.client_id = client_id
+        self.inline = inline
+        self.queue_size = max(1, int(queue_size))
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.userdata = None
+        self.broker = None
+        self.host = None
+        self.subscriptions = set()
+        self.queue = collections.deque() # (callback kind, argument)
+        self.cond = threading.Condition()
+        self.loop_thread = None
+        self.thread = None
+        self.stopping = False
+        self.num_published = 0
+        self.mid = 0
+
+    def username_pw_set(self, username, password=None):
+        pass # no authentication
+
+    def connect(self, host="loopback", port=1883, keepalive=60):
+        self.host = host
+        self.broker = get_loopback_broker(host)
+        for topic_filter in self.subscriptions:
+            self.broker.subscribe(self, topic_filter)
+        self._post("connect", 0)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def reconnect(self):
+        if self.host is None:
+            raise ValueError('reconnect() called before connect()')
+        return self.connect(self.host)
+
+    def disconnect(self):
+        if self.broker is not None:
+            self.broker.detach(self)
+            self.broker = None
+            self._post("disconnect", 0)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.add(topic)
+        if self.broker is not None:
+            self.broker.subscribe(self, topic)
+        return mqtt.MQTT_ERR_SUCCESS, self._next_mid()
+
+    def unsubscribe(self, topic):
+        self.subscriptions.discard(topic)
+        if self.broker is not None:
+            self.broker.unsubscribe(self, topic)
+        return mqtt.MQTT_ERR_SUCCESS, self._next_mid()
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if self.broker is None:
+            return mqtt.MQTT_ERR_NO_CONN, self._next_mid()
+        self.broker.publish(topic, payload, qos, retain)
+        self.num_published += 1
+        return mqtt.MQTT_ERR_SUCCESS, self._next_mid()
+
+    def _next_mid(self):
+        self.mid += 1
+        return self.mid
+
+    def _deliver(self, msg):
+        self._post("message", msg)
+
+    def _post(self, kind, arg):
+        if self.inline:
+            self._dispatch(kind, arg)
+            return
+        with self.cond:
+            # throttle the publisher, unless no loop is serving the queue or the loop itself publishes
+            while (len(self.queue) >= self.queue_size and self.loop_thread is not None
+                   and self.loop_thread is not threading.current_thread()):
+                self.cond.wait()
+            self.queue.append((kind, arg))
+            self.cond.notify_all()
+
+    def _dispatch(self, kind, arg):
+        if kind == "message":
+            if self.on_message is not None:
+                self.on_message(self, self.userdata, arg)
+        elif kind == "connect":
+            if self.on_connect is not None:
+                self.on_connect(self, self.userdata, {}, arg)
+        elif self.on_disconnect is not None:
+            self.on_disconnect(self, self.userdata, arg)
+
+    def loop(self, timeout=1.0):
+        """Runs the callbacks of all queued events; waits up to timeout for the first one."""
+        with self.cond:
+            if len(self.queue) == 0:
+                self.cond.wait(timeout)
+            events = list(self.queue)
+            self.queue.clear()
+            self.cond.notify_all()
+        for kind, arg in events:
+            self._dispatch(kind, arg)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def loop_forever(self):
+        self.loop_thread = threading.current_thread()
+        self.stopping = False
+        try:
+            while not self.stopping:
+                with self.cond:
+                    while len(self.queue) == 0 and not self.stopping:
+                        self.cond.wait()
+                    if self.stopping:
+                        break
+                    kind, arg = self.queue.popleft()
+                    self.cond.notify_all()
+                self._dispatch(kind, arg)
+        finally:
+            self.loop_thread = None
+            with self.cond:
+                self.cond.notify_all() # release waiting publishers
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def loop_start(self):
+        if self.thread is not None:
+            return mqtt.MQTT_ERR_INVAL
+        self.thread = threading.Thread(target=self.loop_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def loop_stop(self):
+        if self.thread is None:
+            return mqtt.MQTT_ERR_INVAL
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        self.thread.join()
+        self.thread = None
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def queue_depth(self):
+        return len(self.queue)
+
+class ReplayClient(object):
+    """Plays back a trace recorded by TraceRecorder: its loop delivers the recorded messages of all
+    subscribed topics to on_message, paced as recorded and sped up by speed (0 = as fast as possible).
+    Published messages are only counted. After loops passes through the trace, the client disconnects."""
+
+    def __init__(self, trace_file, speed=1., loops=1, client_id=""):
+        self.trace_file = trace_file
+        self.speed = speed
+        self.loops = loops
+        self.client_id = client_id
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.userdata = None
+        self.subscriptions = set()
+        self.thread = None
+        self.stopping = False
+        self.num_published = 0
+        self.num_replayed = 0
+        self.mid = 0
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def connect(self, host=None, port=1883, keepalive=60):
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def reconnect(self):
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def disconnect(self):
+        self.stopping = True
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.add(topic)
+        self.mid += 1
+        return mqtt.MQTT_ERR_SUCCESS, self.mid
+
+    def unsubscribe(self, topic):
+        self.subscriptions.discard(topic)
+        self.mid += 1
+        return mqtt.MQTT_ERR_SUCCESS, self.mid
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.num_published += 1
+        self.mid += 1
+        return mqtt.MQTT_ERR_SUCCESS, self.mid
+
+    def is_subscribed(self, topic):
+        return topic in self.subscriptions or any(mqtt.topic_matches_sub(topic_filter, topic)
+                                                  for topic_filter in self.subscriptions)
+
+    def loop_forever(self):
+        self.stopping = False
+        if self.on_connect is not None:
+            self.on_connect(self, self.userdata, {}, 0)
+        loop_indx = 0
+        while not self.stopping and (self.loops <= 0 or loop_indx < self.loops):
+            self._replay_once()
+            loop_indx += 1
+        print(f'{APPNAME}::[REPLAY] replayed {self.num_replayed} messages from {self.trace_file}', flush=True)
+        if self.on_disconnect is not None:
+            self.on_disconnect(self, self.userdata, 0)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def _replay_once(self):
+        start = time.monotonic()
+        first_time = None
+        for msg in read_trace(self.trace_file):
+            if self.stopping:
+                return
+            if first_time is None:
+                first_time = msg.timestamp
+            if self.speed > 0:
+                delay = (msg.timestamp - first_time) / self.speed - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            if self.on_message is not None and self.is_subscribed(msg.topic):
+                self.on_message(self, self.userdata, msg)
+                self.num_replayed += 1
+
+    def loop_start(self):
+        self.thread = threading.Thread(target=self.loop_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def loop_stop(self):
+        self.stopping = True
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        return mqtt.MQTT_ERR_SUCCESS
+
+def read_trace(trace_file):
+    """Yields the TransportMessages of a trace file, one json object per line."""
+    with open(trace_file) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry.get("encoding") == "base64":
+                payload = base64.b64decode(entry["payload"])
+            else:
+                payload = entry["payload"].encode('utf-8')
+            yield TransportMessage(entry["topic"], payload, timestamp=entry["time"])
+
+class TraceRecorder(object):
+    """Records received messages into a trace file for the ReplayClient."""
+
+    def __init__(self, trace_file):
+        self.trace_file = trace_file
+        self.lock = threading.Lock()
+        self.file = open(trace_file, 'a')
+        print(f'{APPNAME}::[TRACE] recording received messages to {trace_file}', flush=True)
+
+    def write(self, topic, payload, timestamp=None):
+        entry = {"time":time.time() if timestamp is None else timestamp, "topic":topic}
+        payload = _to_bytes(payload)
+        try:
+            entry["payload"] = payload.decode('utf-8')
+        except UnicodeDecodeError:
+            entry["payload"] = base64.b64encode(payload).decode('ascii')
+            entry["encoding"] = "base64"
+        line = json.dumps(entry)
+        with self.lock:
+            self.file.write(line + "\n")
+
+    def wrap(self, on_message):
+        """Returns an on_message callback recording each message before passing it on."""
+        def recording_on_message(client, userdata, msg):
+            self.write(msg.topic, msg.payload)
+            on_message(client, userdata, msg)
+        return recording_on_message
+
+    def close(self):
+        with self.lock:
+            self.file.close()
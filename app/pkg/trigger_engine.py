@@ -0,0 +1,204 @@
+# Trigger Engine Module
+#
+# This file is part of the Audio Connector Getting Started repository.
+# https://github.com/industrial-edge/audio-connector-getting-started
+#
+# MIT License
+#
+# Copyright (c) Siemens 2022
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import collections
+import numpy as np
+from pkg.timestamps import NS_PER_SECOND
+
+APPNAME = 'TriggerEngine'
+
+class TriggerRule(object):
+    """A condition on one feature, evaluated per channel.
+
+    The rule becomes active when the feature is above `above` and/or below `below`, and stays active until it is
+    back within these limits by more than `hysteresis`. With rate_of_change, the condition applies to the change of
+    the feature per second instead of its value. The rule triggers once the condition held for min_duration_ms."""
+
+    __slots__ = ("name", "feature", "band", "channels", "above", "below", "hysteresis", "rate_of_change",
+                 "min_duration", "active", "run_start", "sustained", "prev_value", "prev_ts")
+
+    def __init__(self, name, feature="rms", above=None, below=None, hysteresis=0., rate_of_change=False,
+                 min_duration_ms=0, band=None, channels=None):
+        if above is None and below is None:
+            raise ValueError(f'trigger rule {name}: neither above nor below given')
+        self.name = name
+        self.feature = feature
+        self.band = band # band index, for band_energy
+        self.channels = channels # None = all channels
+        self.above = above
+        self.below = below
+        self.hysteresis = hysteresis
+        self.rate_of_change = rate_of_change
+        self.min_duration = round(min_duration_ms * NS_PER_SECOND / 1000)
+        self.active = None # per channel state, allocated with the first values
+
+    @classmethod
+    def from_config(cls, config, indx=0):
+        return cls(config.get("name", f'rule{indx}'), feature=config.get("feature", "rms"),
+                   above=config.get("above"), below=config.get("below"), hysteresis=config.get("hysteresis", 0.),
+                   rate_of_change=config.get("rate_of_change", False), min_duration_ms=config.get("min_duration_ms", 0),
+                   band=config.get("band"), channels=config.get("channels"))
+
+    def reset(self, num_chan):
+        self.active = np.zeros(num_chan, dtype=bool)          # condition holds (with hysteresis)
+        self.run_start = np.zeros(num_chan, dtype=np.int64)   # timestamp the condition started to hold (ns)
+        self.sustained = np.zeros(num_chan, dtype=bool)       # condition held for min_duration
+        self.prev_value = np.full(num_chan, np.nan)           # last value, for the rate of change
+        self.prev_ts = None
+
+    def values(self, features):
+        """The (values, channels) array this rule applies to; None if the feature is not computed."""
+        values = features.get(self.feature)
+        if values is None:
+            return None
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 3:
+            values = values[:, :, 0 if self.band is None else self.band]
+        return values
+
+    def evaluate(self, ts, values):
+        """Evaluates a block of values, (values, channels), at timestamps ts (ns); all values at once, while the
+        state is carried over between blocks. Returns the mask of values where the rule triggers, the values the
+        condition applies to, and the timestamps their active runs started at."""
+        num_values, num_chan = values.shape
+        if self.active is None or len(self.active) != num_chan:
+            self.reset(num_chan)
+        rows = np.arange(num_values).reshape(-1, 1)
+        cols = np.arange(num_chan)
+        if self.rate_of_change:
+            prev_ts = ts[0] if self.prev_ts is None else self.prev_ts # the first value ever has no rate
+            with np.errstate(invalid='ignore', divide='ignore'):
+                seconds = np.diff(np.concatenate(([prev_ts], ts))) / NS_PER_SECOND
+                rates = np.diff(np.vstack((self.prev_value, values)), axis=0) / seconds.reshape(-1, 1)
+            self.prev_value = values[-1].copy()
+            self.prev_ts = ts[-1]
+            values = rates
+
+        # set and reset conditions; NaN neither sets nor resets
+        set_mask = np.zeros(values.shape, dtype=bool)
+        reset_mask = np.ones(values.shape, dtype=bool)
+        with np.errstate(invalid='ignore'):
+            if self.above is not None:
+                set_mask |= values > self.above
+                reset_mask &= values <= self.above - self.hysteresis
+            if self.below is not None:
+                set_mask |= values < self.below
+                reset_mask &= values >= self.below + self.hysteresis
+        reset_mask &= ~np.isnan(values)
+
+        # hysteresis: the state follows the latest set or reset, i.e. a forward fill of their indices
+        last = np.maximum.accumulate(np.where(set_mask | reset_mask, rows, -1), axis=0)
+        active = np.where(last >= 0, set_mask[np.maximum(last, 0), cols], self.active)
+
+        # start of the current active run, forward filled from its onset
+        onset = active & ~np.vstack((self.active, active[:-1]))
+        last = np.maximum.accumulate(np.where(onset, rows, -1), axis=0)
+        run_start = np.where(last >= 0, ts[np.maximum(last, 0)], self.run_start)
+
+        # sustained: active for at least min_duration; triggers once per run
+        sustained = active & (ts.reshape(-1, 1) - run_start >= self.min_duration)
+        triggered = sustained & ~np.vstack((self.sustained, sustained[:-1]))
+        self.active, self.run_start, self.sustained = active[-1], run_start[-1], sustained[-1]
+        if self.channels is not None:
+            triggered[:, [ch for ch in range(num_chan) if ch not in self.channels]] = False
+        return triggered, values, run_start
+
+class TriggerEngine(object):
+    """Evaluates trigger rules on the features of one stream and emits events with pre- and post-trigger context.
+
+    Features are pushed as blocks of (timestamps, {name: (values, channels) array}), e.g. all windows completed
+    by a frame. Every rule is evaluated on the whole block at once. Each trigger yields one event, returned by push
+    once the features up to post_ms after it arrived; it holds the time its condition started to hold, and the
+    values of the rule's feature and channel from pre_ms before to post_ms after the trigger as context."""
+
+    STATS_COUNTERS = ("Trigger events",)
+
+    def __init__(self, rules, pre_ms=500, post_ms=500):
+        self.rules = [rule if isinstance(rule, TriggerRule) else TriggerRule.from_config(rule, indx)
+                      for indx, rule in enumerate(rules)]
+        self.pre = round(pre_ms * NS_PER_SECOND / 1000)
+        self.post = round(post_ms * NS_PER_SECOND / 1000)
+        self.history = collections.deque() # (timestamps, features) blocks, for the context
+        self.pending = [] # (rule, event) of the events waiting for their post-trigger context
+        self.num_events = 0
+
+    def push(self, ts, features):
+        """Adds a block of feature values at timestamps ts (ns); returns the events completed by it."""
+        ts = np.asarray(ts, dtype=np.int64)
+        if len(ts) == 0:
+            return []
+        self.history.append((ts, features))
+        for rule in self.rules:
+            values = rule.values(features)
+            if values is None:
+                continue
+            triggered, condition_values, run_start = rule.evaluate(ts, values)
+            for row, ch in zip(*np.nonzero(triggered)):
+                self.pending.append((rule, {"rule":rule.name, "feature":rule.feature, "channel":int(ch),
+                                            "timestamp":int(ts[row]), "start_timestamp":int(run_start[row, ch]),
+                                            "value":float(condition_values[row, ch])}))
+                self.num_events += 1
+        return self._complete(int(ts[-1]))
+
+    def flush(self):
+        """Returns all pending events, with the post-trigger context received so far."""
+        return self._complete(None)
+
+    def get_stats(self):
+        """Returns the trigger counters for the diagnostics report."""
+        return {"Trigger events": self.num_events, "Trigger events pending": len(self.pending)}
+
+    def _complete(self, latest_ts):
+        events = []
+        pending = []
+        for rule, event in self.pending:
+            if latest_ts is None or latest_ts >= event["timestamp"] + self.post:
+                events.append(self._add_context(rule, event))
+            else:
+                pending.append((rule, event))
+        self.pending = pending
+
+        # drop history no longer needed for any context
+        oldest = min([event["timestamp"] for _, event in self.pending], default=latest_ts)
+        if oldest is not None:
+            while len(self.history) > 1 and self.history[0][0][-1] < oldest - self.pre:
+                self.history.popleft()
+        return events
+
+    def _add_context(self, rule, event):
+        start, end = event["timestamp"] - self.pre, event["timestamp"] + self.post
+        context_ts, context_values = [], []
+        for ts, features in self.history:
+            if ts[-1] < start or ts[0] > end:
+                continue
+            values = rule.values(features)
+            selected = (ts >= start) & (ts <= end)
+            context_ts.append(ts[selected])
+            context_values.append(values[selected, event["channel"]])
+        event["context_timestamps"] = np.concatenate(context_ts) if context_ts else np.zeros(0, dtype=np.int64)
+        event["context_values"] = np.concatenate(context_values) if context_values else np.zeros(0)
+        return event
@@ -0,0 +1,178 @@
+# Worker Pool Module
+#
+# This file is part of the Audio Connector Getting Started repository.
+# https://github.com/industrial-edge/audio-connector-getting-started
+#
+# MIT License
+#
+# Copyright (c) Siemens 2022
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import threading
+import collections
+import multiprocessing
+import concurrent.futures
+
+APPNAME = 'WorkerPool'
+
+# what to do when a new message arrives while its queue is full
+BACKPRESSURE_BLOCK = "block"              # wait for space; stalls the caller (i.e. the MQTT network loop)
+BACKPRESSURE_DROP_OLDEST = "drop_oldest"  # discard the oldest queued message
+BACKPRESSURE_DROP_NEWEST = "drop_newest"  # discard the new message
+BACKPRESSURE_POLICIES = (BACKPRESSURE_BLOCK, BACKPRESSURE_DROP_OLDEST, BACKPRESSURE_DROP_NEWEST)
+
+# where the decoder runs
+MODE_THREAD = "thread"    # decoder and handler run in the worker threads
+MODE_PROCESS = "process"  # decoder runs in a process pool, handler in the worker threads
+POOL_MODES = (MODE_THREAD, MODE_PROCESS)
+
+class _Lane(object):
+    """Bounded FIFO queue served by a single worker thread."""
+    __slots__ = ("queue", "cond", "thread")
+
+    def __init__(self):
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.thread = None
+
+class WorkerPool(object):
+    """Decouples message reception from message processing.
+
+    Each submitted message is routed by its key (e.g. the streaming topic) to one of num_workers lanes,
+    each a bounded queue with its own worker thread, so messages sharing a key are processed in order.
+    Workers call decoder(*args) and pass the result on to handler(result, context). In process mode the
+    decoder runs in a process pool as soon as the message is submitted, so consecutive messages of a
+    single key are decoded in parallel while their handler still sees them in order."""
+
+    STATS_COUNTERS = ("Messages submitted", "Messages processed", "Messages dropped", "Messages failed")
+
+    def __init__(self, handler, decoder, num_workers=2, queue_size=64, policy=BACKPRESSURE_BLOCK, mode=MODE_THREAD):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f'unknown backpressure policy: {policy}')
+        if mode not in POOL_MODES:
+            raise ValueError(f'unknown worker pool mode: {mode}')
+        self.handler = handler
+        self.decoder = decoder
+        self.num_workers = max(1, int(num_workers))
+        self.queue_size = max(1, int(queue_size))
+        self.policy = policy
+        self.mode = mode
+        self.lanes = [_Lane() for _ in range(self.num_workers)]
+        self.executor = None
+        self.stop_event = threading.Event()
+
+        # counters
+        self.stats_lock = threading.Lock()
+        self.num_submitted = 0
+        self.num_processed = 0
+        self.num_dropped = 0
+        self.num_failed = 0
+        self.peak_depth = 0
+
+    def start(self):
+        print(f'{APPNAME}::[POOL] starting {self.num_workers} {self.mode} workers, queue size {self.queue_size}, '+
+              f'backpressure policy {self.policy}', flush=True)
+        if self.mode == MODE_PROCESS:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.num_workers,
+                                mp_context=multiprocessing.get_context("spawn"))
+        for indx, lane in enumerate(self.lanes):
+            lane.thread = threading.Thread(target=self.run_worker, args=(lane, ), name=f'{APPNAME}-{indx}')
+            lane.thread.daemon = True
+            lane.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        for lane in self.lanes:
+            with lane.cond:
+                lane.cond.notify_all()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, key, args, context=None):
+        """Queue a message for processing; returns False if it was dropped."""
+        lane = self.lanes[hash(key) % self.num_workers]
+        with lane.cond:
+            if len(lane.queue) >= self.queue_size:
+                if self.policy == BACKPRESSURE_DROP_NEWEST:
+                    self._count_drop()
+                    return False
+                elif self.policy == BACKPRESSURE_DROP_OLDEST:
+                    oldest = lane.queue.popleft()
+                    if isinstance(oldest[0], concurrent.futures.Future):
+                        oldest[0].cancel()
+                    self._count_drop()
+                else:
+                    while len(lane.queue) >= self.queue_size and not self.stop_event.is_set():
+                        lane.cond.wait()
+            if self.executor is not None:
+                args = self.executor.submit(self.decoder, *args) # start decoding right away
+            lane.queue.append((args, context))
+            depth = len(lane.queue)
+            lane.cond.notify_all()
+        with self.stats_lock:
+            self.num_submitted += 1
+            if depth > self.peak_depth:
+                self.peak_depth = depth
+        return True
+
+    def run_worker(self, lane):
+        while not self.stop_event.is_set():
+            with lane.cond:
+                while len(lane.queue) == 0 and not self.stop_event.is_set():
+                    lane.cond.wait()
+                if self.stop_event.is_set():
+                    return
+                args, context = lane.queue.popleft()
+                lane.cond.notify_all() # wake up a blocked submit()
+            try:
+                if isinstance(args, concurrent.futures.Future):
+                    result = args.result()
+                else:
+                    result = self.decoder(*args)
+                self.handler(result, context)
+                with self.stats_lock:
+                    self.num_processed += 1
+            except Exception as err:
+                with self.stats_lock:
+                    self.num_failed += 1
+                print(f'{APPNAME}::[POOL] Error - failed to process message: {err!r}', flush=True)
+
+    def queue_depth(self):
+        return sum(len(lane.queue) for lane in self.lanes)
+
+    def get_stats(self, reset_peak=True):
+        """Returns the pool counters for the diagnostics report."""
+        depth = self.queue_depth()
+        with self.stats_lock:
+            stats = {
+                "Worker queue depth": depth,
+                "Worker queue peak depth": self.peak_depth,
+                "Messages submitted": self.num_submitted,
+                "Messages processed": self.num_processed,
+                "Messages dropped": self.num_dropped,
+                "Messages failed": self.num_failed,
+            }
+            if reset_peak:
+                self.peak_depth = depth
+        return stats
+
+    def _count_drop(self):
+        with self.stats_lock:
+            self.num_dropped += 1
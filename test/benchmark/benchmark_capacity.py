@@ -0,0 +1,178 @@
+# Audio Processor Capacity Benchmark
+#
+# This file is part of the Audio Connector Getting Started repository.
+# https://github.com/industrial-edge/audio-connector-getting-started
+#
+# MIT License
+#
+# Copyright (c) Siemens 2022
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Drives the Audio Processor through the in-process loopback transport as fast as it
+# can process, for increasing channel counts, and reports its real-time factor (seconds
+# of audio processed per second). The largest channel count with a real-time factor of
+# at least 1 is the maximum the processor sustains on this machine.
+#
+# usage: python benchmark_capacity.py [--channels 1,2,4,8,16,32,64] [--mode inline] [--config extra.json]
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import numpy as np
+
+# make the app importable when run from a source checkout
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'app'))
+import audio_processor as processor
+from pkg.audio_packing import pack_metadata, decode_payload
+from pkg.configuration_manager import ConfigurationManager, MetadataManager
+from pkg.conn_diagnostics import PacketDiagnostics
+from pkg.worker_pool import WorkerPool
+from pkg.transport import LoopbackClient
+from benchmark_pipeline import make_payloads, SAMPLING_RATE, METADATA_TOPIC, STREAMING_TOPIC
+
+CHANNEL_COUNTS = [1, 2, 4, 8, 16, 32, 64]
+DISTINCT_FRAMES = 8 # payloads are generated once and cycled
+
+def start_processor(broker, args, extra_config):
+    """Sets up the processor's globals as its __main__ would, connected to the given loopback broker."""
+    config_manager = ConfigurationManager()
+    config_data = {
+        "connection_name":"capacity",
+        "databus":{"metadata_topic":METADATA_TOPIC, "output_topic":"capacity/output",
+                   "metadata_qos":0, "streaming_qos":0, "output_qos":0},
+    }
+    config_data.update(extra_config)
+    config_manager.set_config_data(config_data)
+    processor.CONFIG_MANAGER = config_manager
+    processor.CONFIG_DATA = config_data
+    processor.METADATA_MANAGER = MetadataManager(config_manager)
+    processor.DIAGNOSTICS_ENGINE = PacketDiagnostics(name="DATABUS", interval=processor.DIAGNOSTICS_INTERVAL,
+                                                     history=processor.DIAGNOSTICS_HISTORY)
+    processor.CONNECTIONS = {}
+    processor.STREAM_ROUTES = {}
+    processor.WORKER_POOL = None
+    if args.mode != "inline":
+        processor.WORKER_POOL = WorkerPool(processor.handle_frame, decode_payload, num_workers=args.workers,
+                                           queue_size=args.queue_size, mode=args.mode)
+        processor.WORKER_POOL.start()
+
+    client = LoopbackClient(processor.APP_NAME, queue_size=args.queue_size)
+    client.on_connect = processor.on_connect
+    client.on_message = processor.on_message
+    processor.MQTT_CLIENT = client
+    client.connect(broker)
+    client.loop_start()
+    return client
+
+def stop_processor(client):
+    client.loop_stop()
+    client.disconnect()
+    if processor.WORKER_POOL is not None:
+        processor.WORKER_POOL.stop()
+    for connection in processor.CONNECTIONS.values():
+        connection.stop()
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+def run_case(num_chan, args, extra_config, rng):
+    payloads = make_payloads(rng, DISTINCT_FRAMES, args.frame_size, num_chan, args.data_type, 1, args.encoding)
+    num_frames = max(DISTINCT_FRAMES, int(args.seconds * SAMPLING_RATE / args.frame_size))
+    broker = f'capacity-{num_chan}' # fresh broker, no subscriptions left over from earlier cases
+
+    with contextlib.redirect_stdout(io.StringIO()): # silence the processor's log
+        client = start_processor(broker, args, extra_config)
+        producer = LoopbackClient("capacity-producer")
+        producer.connect(broker)
+        producer.publish(METADATA_TOPIC, pack_metadata("capacity", SAMPLING_RATE, num_chan, args.data_type,
+                                                       STREAMING_TOPIC, args.encoding), retain=True)
+        if not wait_for(lambda: STREAMING_TOPIC in processor.STREAM_ROUTES, 10.):
+            raise RuntimeError('processor did not subscribe to the streaming topic')
+
+        # publish as fast as the processor's queue accepts, then wait for the backlog
+        start = time.perf_counter()
+        for indx in range(num_frames):
+            producer.publish(STREAMING_TOPIC, payloads[indx % DISTINCT_FRAMES])
+        done = wait_for(lambda: processor.DIAGNOSTICS_ENGINE.total_packets >= num_frames, args.timeout)
+        elapsed = time.perf_counter() - start
+        processed = processor.DIAGNOSTICS_ENGINE.total_packets
+        stop_processor(client)
+        producer.disconnect()
+
+    audio_seconds = processed * args.frame_size / SAMPLING_RATE
+    return {
+        "channels":num_chan,
+        "frames":processed,
+        "complete":done,
+        "seconds":elapsed,
+        "frames_per_second":processed / elapsed,
+        "realtime_factor":audio_seconds / elapsed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the channel count the Audio Processor sustains in real time.")
+    parser.add_argument("--channels", default=",".join(map(str, CHANNEL_COUNTS)), help="comma separated channel counts")
+    parser.add_argument("--frame-size", type=int, default=4096, help="samples per channel and frame")
+    parser.add_argument("--data-type", default="Int16", help="Int16, Int32 or Float32")
+    parser.add_argument("--encoding", default="json", help="payload encoding: json, base64 or base64-zlib")
+    parser.add_argument("--seconds", type=float, default=10., help="seconds of audio per channel count")
+    parser.add_argument("--mode", default="inline", help="processing mode: inline, thread or process")
+    parser.add_argument("--workers", type=int, default=2, help="worker pool size (thread/process mode)")
+    parser.add_argument("--queue-size", type=int, default=64, help="queued messages before the publisher waits")
+    parser.add_argument("--timeout", type=float, default=300., help="seconds to wait for the processor per case")
+    parser.add_argument("--config", default=None, help="json file with extra processor config, e.g. features/spectrum")
+    parser.add_argument("--output", default=None, help="json result file")
+    args = parser.parse_args()
+
+    extra_config = {}
+    if args.config is not None:
+        with open(args.config) as f:
+            extra_config = json.load(f)
+
+    rng = np.random.default_rng(0)
+    results = []
+    print(f'{"channels":>8} {"frames/s":>10} {"realtime x":>11}', flush=True)
+    for num_chan in [int(chan) for chan in args.channels.split(",")]:
+        result = run_case(num_chan, args, extra_config, rng)
+        results.append(result)
+        note = "" if result["complete"] else " (timed out)"
+        print(f'{num_chan:>8} {result["frames_per_second"]:>10.1f} {result["realtime_factor"]:>10.2f}x{note}', flush=True)
+
+    sustained = [result["channels"] for result in results if result["complete"] and result["realtime_factor"] >= 1.]
+    if sustained:
+        print(f'maximum sustained channel count: {max(sustained)}', flush=True)
+    else:
+        print('no channel count is sustained in real time', flush=True)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({"settings":vars(args), "results":results}, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# Payload Decoder Benchmark
+#
+# This file is part of the Audio Connector Getting Started repository.
+# https://github.com/industrial-edge/audio-connector-getting-started
+#
+# MIT License
+#
+# Copyright (c) Siemens 2022
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Compares the fast payload decoder (decode_payload) against the record-by-record
+# decoder of unpack_payload before it, copied below as it was.
+#
+# usage: python benchmark_decoder.py [--frame-size 4096] [--repeat 50]
+
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import numpy as np
+
+# make the app's pkg importable when run from a source checkout
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'app'))
+from pkg.audio_packing import pack_payload, decode_payload
+
+CHANNEL_COUNTS = [1, 8, 32]
+
+def legacy_unpack(payload):
+    """unpack_payload before the fast decoder."""
+    msg_dict = json.loads(payload)
+    array_list = []
+    ids_list = []
+    rseq_list = []
+    ts_list = []
+    for payload_record in msg_dict["records"]: # loop through records
+        array, ids, rseq, ts = _legacy_unpack_payload_record(payload_record)
+        array_list.append(array)
+        ids_list.append(ids)
+        rseq_list.append(rseq)
+        ts_list.append(ts)
+    merged_array, merged_ids, sorted_rseq, sorted_ts = _legacy_merge_payload_records(array_list,ids_list,rseq_list,ts_list)
+    return merged_array, sorted_ts[0], merged_array.shape
+
+def _legacy_unpack_payload_record(payload_record):
+    rseq = payload_record["rseq"]
+    timestamp = payload_record["ts"]
+    ids = []
+    ch_list = []
+    for ch in payload_record["vals"]: # loop over datapoints
+        ids.append(ch["id"])
+        ch_list.append(np.reshape(np.array([ch["val"]]),(-1,1)))
+    array = np.hstack(tuple(ch_list))
+    return array, ids, rseq, timestamp
+
+def _legacy_merge_payload_records(array_list,ids_list,rseq_list,ts_list):
+    sort_key = [jj for _, jj in sorted(zip(rseq_list, range(len(rseq_list))))] # to sort by rseq
+
+    # collect set of unique datapoint IDs
+    id_set = set()
+    for ids in ids_list:
+        id_set.update(ids)
+
+    # build up signals one datapoint at a time
+    ch_list = []
+    for id in id_set: # loop over all datapoint ids
+        ch_data_items = []
+        for ii in range(len(rseq_list)):
+            jj = sort_key[ii] # sorted index
+            jj_array = array_list[jj]
+            jj_ids = ids_list[jj] # datapoints contained in this record
+            if id in jj_ids:
+                ch_data_items.append(np.reshape(jj_array[:,jj_ids.index(id)],(-1,1)))
+        if len(ch_data_items) > 1:
+            ch_data = np.vstack(tuple(ch_data_items))
+        else:
+            ch_data = ch_data_items[0]
+        ch_list.append(ch_data)
+    merged_array = np.hstack(tuple(ch_list))
+
+    return merged_array, list(id_set), [rseq_list[ii] for ii in sort_key], [ts_list[ii] for ii in sort_key]
+
+def fast_unpack(payload):
+    frame = decode_payload(payload, "Int16")
+    return frame.array, frame.timestamp, frame.shape
+
+def time_decoder(decoder, payload, repeat):
+    decoder(payload) # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        decoder(payload)
+    return (time.perf_counter() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the audio payload decoders.")
+    parser.add_argument("--frame-size", type=int, default=4096, help="samples per channel and frame")
+    parser.add_argument("--repeat", type=int, default=50, help="decodes per measurement")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    timestamp = datetime.datetime(2022, 7, 24, 2, 47, 1, 998157).isoformat()
+    print(f'{"channels":>8} {"json (ms)":>10} {"legacy (ms)":>12} {"fast (ms)":>10} {"speedup":>8}', flush=True)
+    for num_chan in CHANNEL_COUNTS:
+        array = rng.integers(-2**15, 2**15, size=(args.frame_size, num_chan), dtype=np.int16)
+        payload = pack_payload(array, timestamp)
+
+        # both decoders must agree before they are compared
+        legacy_array = legacy_unpack(payload)[0]
+        fast_array = fast_unpack(payload)[0]
+        assert np.array_equal(legacy_array, fast_array) and np.array_equal(fast_array, array)
+
+        json_sec = time_decoder(json.loads, payload, args.repeat) # shared by both decoders
+        legacy_sec = time_decoder(legacy_unpack, payload, args.repeat)
+        fast_sec = time_decoder(fast_unpack, payload, args.repeat)
+        print(f'{num_chan:>8} {json_sec*1e3:>10.3f} {legacy_sec*1e3:>12.3f} {fast_sec*1e3:>10.3f} {legacy_sec/fast_sec:>7.2f}x', flush=True)
+
+if __name__ == "__main__":
+    main()
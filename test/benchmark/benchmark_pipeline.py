@@ -0,0 +1,278 @@
+# Audio Pipeline Throughput Benchmark
+#
+# This file is part of the Audio Connector Getting Started repository.
+# https://github.com/industrial-edge/audio-connector-getting-started
+#
+# MIT License
+#
+# Copyright (c) Siemens 2022
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Measures the throughput of the audio pipeline stages on synthetic payloads,
+# over a matrix of channel counts, frame sizes, data types and records per payload:
+#   unpack   - unpack_payload
+#   rms      - _compute_rms of the processor
+#   diag     - AudioStreamDiagnostics.store_packet
+#   pipeline - the processor's on_message, publishing to a fake MQTT client
+# Results are written as json; --compare prints the change against an earlier result file.
+#
+# usage: python benchmark_pipeline.py [--quick] [--output results.json] [--compare baseline.json]
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import platform
+import tracemalloc
+import contextlib
+import numpy as np
+try:
+    import resource # not available on Windows
+except ImportError:
+    resource = None
+
+# make the app importable when run from a source checkout
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'app'))
+import audio_processor as processor
+from pkg.audio_packing import pack_payload, pack_metadata, unpack_payload, decode_payload
+from pkg.configuration_manager import ConfigurationManager, MetadataManager
+from pkg.conn_diagnostics import PacketDiagnostics, AudioStreamDiagnostics
+from pkg.timestamps import NS_PER_SECOND, parse_timestamp_ns
+
+BENCHMARKS = ["unpack", "rms", "diag", "pipeline"]
+CHANNEL_COUNTS = [1, 2, 8, 32]
+FRAME_SIZES = [256, 1024, 4096, 16384]
+DATA_TYPES = ["Int16", "Int32", "Float32"]
+RECORD_COUNTS = [1, 4]
+QUICK_MATRIX = {"channels":[1, 8], "frame_sizes":[1024, 4096], "data_types":["Int16"], "records":[1, 4]}
+
+SAMPLING_RATE = 48000
+METADATA_TOPIC = "benchmark/metadata"
+STREAMING_TOPIC = "benchmark/stream"
+START_TIME = parse_timestamp_ns("2022-07-24T02:47:01.9981570Z")
+
+class FakeClient(object):
+    """Stands in for the MQTT client; counts the published messages."""
+    def __init__(self):
+        self.num_published = 0
+
+    def publish(self, topic, payload, qos=0):
+        self.num_published += 1
+
+    def subscribe(self, topic, qos=0):
+        pass
+
+    def unsubscribe(self, topic):
+        pass
+
+class Message(object):
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+def make_signal(rng, frame_size, num_chan, data_type):
+    if data_type.startswith("Float"):
+        return (rng.standard_normal((frame_size, num_chan)) * 0.1).astype(np.float32)
+    info = np.iinfo(data_type.lower())
+    return rng.integers(info.min // 8, info.max // 8, size=(frame_size, num_chan), dtype=data_type.lower())
+
+def make_payloads(rng, num_frames, frame_size, num_chan, data_type, num_records, encoding):
+    """Consecutive payloads, each of frame_size samples per channel, split into num_records records."""
+    payloads = []
+    record_size = frame_size // num_records
+    for frame_indx in range(num_frames):
+        array = make_signal(rng, frame_size, num_chan, data_type)
+        records = []
+        for record_indx in range(num_records):
+            offset = frame_indx * frame_size + record_indx * record_size
+            timestamp = START_TIME + offset * NS_PER_SECOND // SAMPLING_RATE
+            record = json.loads(pack_payload(array[record_indx*record_size:(record_indx+1)*record_size],
+                                            timestamp, encoding=encoding))["records"][0]
+            record["rseq"] = record_indx + 1
+            records.append(record)
+        payloads.append(json.dumps({"seq":frame_indx + 1, "mdHashVer":1, "records":records}))
+    return payloads
+
+def setup_processor(num_chan, data_type, encoding):
+    """Configures the processor's globals as its __main__ would, for a single inline connection."""
+    metadata = pack_metadata("benchmark", SAMPLING_RATE, num_chan, data_type, STREAMING_TOPIC, encoding=encoding)
+    config_manager = ConfigurationManager()
+    config_manager.set_config_data({
+        "connection_name":"benchmark",
+        "databus":{"metadata_topic":METADATA_TOPIC, "output_topic":"benchmark/output",
+                   "metadata_qos":0, "streaming_qos":0, "output_qos":0},
+    })
+    processor.CONFIG_MANAGER = config_manager
+    processor.CONFIG_DATA = config_manager.get_config_data()
+    processor.METADATA_MANAGER = MetadataManager(config_manager)
+    processor.DIAGNOSTICS_ENGINE = PacketDiagnostics(name="DATABUS", interval=processor.DIAGNOSTICS_INTERVAL,
+                                                     history=processor.DIAGNOSTICS_HISTORY)
+    processor.WORKER_POOL = None
+    processor.CONNECTIONS = {}
+    processor.STREAM_ROUTES = {}
+    client = FakeClient()
+    processor.on_message(client, None, Message(METADATA_TOPIC, metadata))
+    return client
+
+def teardown_processor():
+    for connection in processor.CONNECTIONS.values():
+        connection.stop()
+    processor.CONNECTIONS = {}
+    processor.STREAM_ROUTES = {}
+
+def make_case(name, num_chan, frame_size, data_type, num_records, encoding, num_frames, rng):
+    """Returns step(indx), processing the indx-th frame, and the bytes processed per frame."""
+    payloads = make_payloads(rng, num_frames, frame_size, num_chan, data_type, num_records, encoding)
+    if name == "unpack":
+        data_types = [data_type] * num_chan
+        return (lambda indx: unpack_payload(payloads[indx], data_types, encoding)), len(payloads[0])
+    if name == "pipeline":
+        client = setup_processor(num_chan, data_type, encoding)
+        messages = [Message(STREAMING_TOPIC, payload) for payload in payloads]
+        return (lambda indx: processor.on_message(client, None, messages[indx])), len(payloads[0])
+
+    frames = [decode_payload(payload, [data_type] * num_chan, encoding) for payload in payloads]
+    if name == "rms":
+        return (lambda indx: processor._compute_rms(frames[indx].array)), frames[0].array.nbytes
+    if name == "diag":
+        diagnostics = AudioStreamDiagnostics(name="benchmark", interval=processor.DIAGNOSTICS_INTERVAL,
+                            history=processor.DIAGNOSTICS_HISTORY, samp_rate=SAMPLING_RATE, buff_size=frame_size)
+        timestamps = [parse_timestamp_ns(frame.timestamp) for frame in frames]
+        return (lambda indx: diagnostics.store_packet(frames[indx], ts=timestamps[indx])), frames[0].array.nbytes
+    raise ValueError(f'unknown benchmark: {name}')
+
+def measure(step, num_frames, min_time):
+    """Runs step over the frames until min_time passed; returns seconds per frame and allocation peak."""
+    step(0) # warm up
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    step(1 % num_frames)
+    alloc_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    count = 0
+    start = time.perf_counter()
+    while True:
+        step(count % num_frames)
+        count += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time and count >= num_frames:
+            break
+    return elapsed / count, alloc_peak
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # kB on Linux
+
+def run_matrix(matrix, benchmarks, encoding, num_frames, min_time):
+    rng = np.random.default_rng(0)
+    results = []
+    print(f'{"benchmark":>9} {"chan":>5} {"frame":>6} {"type":>8} {"rec":>4} {"frames/s":>10} {"MB/s":>9} {"alloc kB":>9}', flush=True)
+    for name in benchmarks:
+        for num_chan in matrix["channels"]:
+            for frame_size in matrix["frame_sizes"]:
+                for data_type in matrix["data_types"]:
+                    for num_records in matrix["records"]:
+                        with contextlib.redirect_stdout(io.StringIO()): # silence the processor's log
+                            step, frame_bytes = make_case(name, num_chan, frame_size, data_type, num_records,
+                                                          encoding, num_frames, rng)
+                            sec_per_frame, alloc_peak = measure(step, num_frames, min_time)
+                            if name == "pipeline":
+                                teardown_processor()
+                        result = {
+                            "benchmark":name,
+                            "channels":num_chan,
+                            "frame_size":frame_size,
+                            "data_type":data_type,
+                            "records":num_records,
+                            "encoding":encoding,
+                            "frame_bytes":frame_bytes,
+                            "seconds_per_frame":sec_per_frame,
+                            "frames_per_second":1. / sec_per_frame,
+                            "megabytes_per_second":frame_bytes / sec_per_frame / 1e6,
+                            "alloc_peak_bytes":alloc_peak,
+                            "peak_rss_bytes":peak_rss_bytes(), # process-wide, grows over the run
+                        }
+                        results.append(result)
+                        print(f'{name:>9} {num_chan:>5} {frame_size:>6} {data_type:>8} {num_records:>4} '+
+                              f'{result["frames_per_second"]:>10.1f} {result["megabytes_per_second"]:>9.2f} '+
+                              f'{alloc_peak/1024:>9.1f}', flush=True)
+    return results
+
+def case_key(result):
+    return (result["benchmark"], result["channels"], result["frame_size"], result["data_type"],
+            result["records"], result["encoding"])
+
+def compare(results, baseline_path):
+    """Prints the throughput change of every case found in both result sets."""
+    with open(baseline_path) as f:
+        baseline = {case_key(result):result for result in json.load(f)["results"]}
+    print(f'\ncompared to {baseline_path}:', flush=True)
+    print(f'{"benchmark":>9} {"chan":>5} {"frame":>6} {"type":>8} {"rec":>4} {"change":>8}', flush=True)
+    for result in results:
+        base = baseline.get(case_key(result))
+        if base is None:
+            continue
+        change = result["frames_per_second"] / base["frames_per_second"] - 1.
+        print(f'{result["benchmark"]:>9} {result["channels"]:>5} {result["frame_size"]:>6} '+
+              f'{result["data_type"]:>8} {result["records"]:>4} {change*100:>+7.1f}%', flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the throughput of the audio pipeline.")
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS), help="comma separated subset of "+",".join(BENCHMARKS))
+    parser.add_argument("--quick", action="store_true", help="run a reduced matrix")
+    parser.add_argument("--encoding", default="json", help="payload encoding: json, base64 or base64-zlib")
+    parser.add_argument("--frames", type=int, default=8, help="distinct frames per case")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds measured per case")
+    parser.add_argument("--output", default="benchmark_results.json", help="json result file")
+    parser.add_argument("--compare", default=None, help="earlier json result file to compare against")
+    args = parser.parse_args()
+
+    if args.quick:
+        matrix = QUICK_MATRIX
+    else:
+        matrix = {"channels":CHANNEL_COUNTS, "frame_sizes":FRAME_SIZES, "data_types":DATA_TYPES, "records":RECORD_COUNTS}
+    benchmarks = args.benchmarks.split(",")
+    results = run_matrix(matrix, benchmarks, args.encoding, max(2, args.frames), args.min_time)
+
+    report = {
+        "created":datetime.datetime.now().isoformat(),
+        "platform":{"python":platform.python_version(), "numpy":np.__version__,
+                    "machine":platform.machine(), "system":platform.system()},
+        "settings":{"matrix":matrix, "benchmarks":benchmarks, "encoding":args.encoding,
+                    "frames":args.frames, "min_time":args.min_time},
+        "results":results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f'results written to {args.output}', flush=True)
+    if args.compare is not None:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -26,16 +26,24 @@
 # SOFTWARE.
 
 # import the necessary packages
-import datetime
 import time
-import wave
+import json
+import struct
 import numpy as np
-from paho.mqtt import client as mqtt
 from pkg.configuration_manager import ConfigurationManager
-from pkg.audio_packing import pack_payload, pack_metadata
+from pkg.audio_packing import pack_payload, pack_metadata, get_data_type_name
 from pkg.conn_diagnostics import AudioStreamDiagnostics
+from pkg.transport import create_transport
+from pkg.reconnect import ReconnectManager
+from pkg.timestamps import NS_PER_SECOND
 
-INT_DATA_TYPES = {8: np.int8, 16: np.int16, 24: None, 32: np.int32}
+# WAV sample formats
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE # actual format in the first two bytes of the sub-format GUID
+PCM_DATA_TYPES = {8: np.uint8, 16: np.int16, 24: np.int32, 32: np.int32} # 8-bit WAV samples are unsigned
+FLOAT_DATA_TYPES = {32: np.float32, 64: np.float64}
+RECONNECT = None # reconnects the client with backoff, see pkg.reconnect
 
 def on_connect(client, userdata, flags, rc):
     # print(f"CONNACK received with code {rc}")
@@ -44,36 +52,115 @@ def on_connect(client, userdata, flags, rc):
         client.connected_flag = True  # set flag
     else:
         print("Bad connection to MQTT broker, returned code=", rc, flush=True)
+    if RECONNECT is not None:
+        RECONNECT.handle_connect(rc)
 
 def on_disconnect(client, userdata, rc):
     print("on_disconnect() called", flush=True)
-    client.connected_flag = False
-    if rc != 0:
-    #ERROR: unexpected broker disconection. Try to reconnect. Stop only if config file changes
-        while True: 
-            try:
-                client.reconnect()
-                return
-            except:
-                #ERROR:broker not available. Keep trying
-                continue
+    client.connected_flag = False # frames are skipped until reconnected
+    if RECONNECT is not None:
+        RECONNECT.handle_disconnect(rc) # reconnects with backoff if unexpected, without blocking the network loop
+
+def read_wave_header(file_path):
+    """Parses the chunks of a RIFF/WAVE file: returns its sample format and the position of its sample data.
+    Unlike the wave module, this also accepts float and WAVE_FORMAT_EXTENSIBLE files."""
+    header = {}
+    with open(file_path, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError(f'{file_path} is not a WAV file')
+        while "data_offset" not in header:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError(f'{file_path} has no data chunk')
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+            if chunk_id == b'fmt ':
+                fmt = f.read(chunk_size)
+                format_tag, num_chan, samp_rate, _, _, bit_depth = struct.unpack('<HHIIHH', fmt[:16])
+                if format_tag == WAVE_FORMAT_EXTENSIBLE:
+                    format_tag = struct.unpack('<H', fmt[24:26])[0]
+                header.update(format_tag=format_tag, num_chan=num_chan, samp_rate=samp_rate, bit_depth=bit_depth)
+                f.seek(chunk_size & 1, 1)
+            elif chunk_id == b'data':
+                header.update(data_offset=f.tell(), data_size=chunk_size)
+            else:
+                f.seek(chunk_size + (chunk_size & 1), 1) # chunks are padded to even sizes
+    if "format_tag" not in header:
+        raise ValueError(f'{file_path} has no fmt chunk')
+    return header
+
+def int24_to_int32(raw):
+    """Converts packed little-endian 24-bit samples, a uint8 array of shape (..., 3), to int32 (vectorized)."""
+    padded = np.zeros(raw.shape[:-1] + (4,), dtype=np.uint8)
+    padded[..., 1:] = raw # 24-bit sample in the upper three bytes
+    return padded.view('<i4')[..., 0] >> 8 # arithmetic shift sign-extends
+
+def load_wave(file_path, file_access="preload"):
+    """Loads a WAV file once: returns (sampling rate, sample dtype, samples as (num_samples, num_chan) array).
+    file_access "mmap" maps the file into memory instead of reading it; 24-bit samples are then left
+    packed, as a (num_samples, num_chan, 3) uint8 array, and converted frame by frame (see int24_to_int32)."""
+    header = read_wave_header(file_path)
+    bit_depth = header["bit_depth"]
+    num_chan = header["num_chan"]
+    if header["format_tag"] == WAVE_FORMAT_PCM and bit_depth in PCM_DATA_TYPES:
+        dtype = np.dtype(PCM_DATA_TYPES[bit_depth])
+    elif header["format_tag"] == WAVE_FORMAT_IEEE_FLOAT and bit_depth in FLOAT_DATA_TYPES:
+        dtype = np.dtype(FLOAT_DATA_TYPES[bit_depth])
+    else:
+        raise ValueError(f'unsupported WAV sample format {header["format_tag"]} with {bit_depth} bits')
+
+    sample_bytes = bit_depth // 8
+    num_samples = header["data_size"] // (num_chan * sample_bytes)
+    file_dtype = np.uint8 if bit_depth == 24 else dtype.newbyteorder('<')
+    shape = (num_samples, num_chan, 3) if bit_depth == 24 else (num_samples, num_chan)
+    if file_access == "mmap":
+        data = np.memmap(file_path, dtype=file_dtype, mode='r', offset=header["data_offset"], shape=shape)
+    else:
+        data = np.fromfile(file_path, dtype=file_dtype, count=int(np.prod(shape)), offset=header["data_offset"])
+        data = data.reshape(shape)
+        if bit_depth == 24:
+            data = int24_to_int32(data)
+    return header["samp_rate"], dtype, data
+
+def pack_devices_metadata(devices, data_type, payload_encoding):
+    """Metadata of all simulated devices, as one message listing one connection per device."""
+    metadata = None
+    for device in devices:
+        device_metadata = json.loads(pack_metadata(device["name"], device["samp_rate"], device["num_chan"],
+                                                   data_type, device["topic"], payload_encoding))
+        if metadata is None:
+            metadata = device_metadata
+        else:
+            metadata["connections"].extend(device_metadata["connections"])
+    return json.dumps(metadata)
 
 # main function for running standalone
 def main():
+    global RECONNECT
     # load config file
     config_obj = ConfigurationManager('/app/config/config.json')
     config_data = config_obj.get_config_data()
     print('Wave File to load: '+config_data["file_name"],flush=True)
     AUDIO_FILEPATH = '/app/data/'+config_data["file_name"]
-    with wave.open(AUDIO_FILEPATH, mode='rb') as audio_reader:
-        samp_rate = audio_reader.getframerate()
+
+    # load the file once; it is played from memory in an endless loop
+    file_access = config_data.get("file_access", "preload") # preload or mmap
+    samp_rate, sample_dtype, audio_data = load_wave(AUDIO_FILEPATH, file_access)
+    num_chan = audio_data.shape[1]
+    print("file samp freq detected: "+str(samp_rate)+", samples: "+get_data_type_name(sample_dtype)+
+          ", loaded via "+file_access, flush=True)
 
     # Start MQTT client
-    client = mqtt.Client(client_id="audio-playback")
+    client = create_transport(config_data.get("transport", {}), client_id="audio-playback")
     client.connected_flag = False  # set flag
     client.on_connect = on_connect
     client.on_disconnect = on_disconnect
     client.username_pw_set(config_data[ "databus"]["databus_username"], config_data[ "databus"]["databus_password"])
+    reconnect_config = config_data.get("reconnect", {})
+    RECONNECT = ReconnectManager(client, name="playback",
+                                 min_delay=reconnect_config.get("min_delay", 1.),
+                                 max_delay=reconnect_config.get("max_delay", 60.),
+                                 jitter=reconnect_config.get("jitter", 0.5))
     client.connect(config_data[ "databus"]["databus_host"], config_data[ "databus"]["databus_port"])
     client.loop_start()
     time.sleep(4)  # Wait for connection setup to complete
@@ -81,73 +168,68 @@ def main():
         ",\n\t metadata topic: "+config_data["databus"]["metadata_topic"]+
         ",\n\t streaming topic: "+config_data["databus"]["streaming_topic"], flush=True)
 
-    # create empty buffer
     frame_len = config_data[ "frame_size"]
-    data_buffer = np.zeros((frame_len,1))
+    payload_encoding = config_data.get("payload_encoding", "json") # json, base64 or base64-zlib
+    speed = config_data.get("speed", 1.) # playback speed multiplier; 0 = as fast as possible
+    num_devices = config_data.get("num_devices", 1)
+    num_frames = -(-len(audio_data) // frame_len) # last frame is zero padded
+    frame_delay_sec = frame_len/samp_rate
 
-    # Start Diagnostics Engine
-    conn_diag = AudioStreamDiagnostics(name="PLAYBACK",
-                                      interval=60,
-                                      history=10,
-                                      samp_rate=samp_rate,
-                                      buff_size=frame_len)
-    conn_diag.start_reporting()
+    # simulated devices, each with its own connection name, streaming topic and Diagnostics Engine;
+    # device i starts i/num_devices into the file, so their streams differ
+    devices = []
+    for indx in range(num_devices):
+        if num_devices == 1:
+            name, topic = config_data["file_name"], config_data["databus"]["streaming_topic"]
+        else:
+            name, topic = f'{config_data["file_name"]}-{indx}', f'{config_data["databus"]["streaming_topic"]}/{indx}'
+        conn_diag = AudioStreamDiagnostics(name=name,
+                                          interval=60,
+                                          history=10,
+                                          samp_rate=samp_rate,
+                                          buff_size=frame_len)
+        conn_diag.add_report_source(RECONNECT.get_stats, counters=ReconnectManager.STATS_COUNTERS)
+        conn_diag.start_reporting()
+        devices.append({"name":name, "topic":topic, "samp_rate":samp_rate, "num_chan":num_chan,
+                        "frame_offset":indx * num_frames // num_devices, "diagnostics":conn_diag})
+    metadata_packet = pack_devices_metadata(devices, sample_dtype, payload_encoding)
+    print(f'simulating {num_devices} device(s) at {speed if speed > 0 else "unthrottled"} x real time', flush=True)
 
-    # the file is played in an endeless loop
+    # frames are scheduled against a monotonic clock, so sleep inaccuracies do not add up to drift;
+    # timestamps (int ns, UTC) advance by exactly one frame of audio time, whatever the playback speed
+    stream_start = time.time_ns()
+    schedule_start = time.monotonic()
+    frame_count = 0
     while True:
-        with wave.open(AUDIO_FILEPATH, mode='rb') as audio_reader:
-            samp_rate = audio_reader.getframerate()
-            bit_depth = audio_reader.getsampwidth() * 8
-            num_chan = audio_reader.getnchannels()
-            if num_chan > 1:
-                data_buffer = np.zeros((frame_len,num_chan))
-            
-            print("file samp freq detected: "+str(samp_rate), flush=True)
-            frame_delay_sec = frame_len/samp_rate
-
-            metadata_packet = pack_metadata(config_data["file_name"],
-                                            samp_rate,
-                                            num_chan,
-                                            "Int"+str(bit_depth),
-                                            config_data["databus"]["streaming_topic"])
+        if frame_count % num_frames == 0:
+            # (re)announce the devices whenever the file starts over
             if client.connected_flag:
                 client.publish(config_data["databus"]["metadata_topic"], metadata_packet, qos=config_data["databus"]["metadata_qos"])
+            if frame_count > 0:
+                print('Once more, from the top!',flush=True)
+
+        timestamp = stream_start + frame_count * frame_len * NS_PER_SECOND // samp_rate
+        for device in devices:
+            frame_indx = (frame_count + device["frame_offset"]) % num_frames
+            data_buffer = audio_data[frame_indx*frame_len:(frame_indx+1)*frame_len]
+            if data_buffer.ndim == 3:
+                data_buffer = int24_to_int32(data_buffer) # memory-mapped 24-bit samples
+            if data_buffer.shape[0] < frame_len:
+                # zero pad if needed
+                data_buffer = np.pad(data_buffer,((0, frame_len-data_buffer.shape[0]), (0, 0)))
+            if client.connected_flag:
+                data_packet = pack_payload(data_buffer, timestamp, encoding=payload_encoding, seq=frame_count + 1)
+                client.publish(device["topic"], data_packet, qos=config_data["databus"]["streaming_qos"])
+
+                # Upload to Diagnostics Engine
+                device["diagnostics"].store_packet(data_packet,ts=timestamp)
+        frame_count += 1
 
-            while True:
-                # publish frame
-                cycle_start_t = datetime.datetime.now()
-                buffer_bytes = audio_reader.readframes(frame_len)
-                if buffer_bytes is None or len(buffer_bytes)==0:
-                    print('End of file reached, restarting...',flush=True)
-                    # break at end of file
-                    break
-                
-                timestamp = datetime.datetime.now()
-                idata = np.frombuffer(buffer_bytes, dtype=INT_DATA_TYPES[bit_depth])
-                data_buffer = idata.reshape([-1, num_chan])
-                if data_buffer.shape[0] < frame_len:
-                    # zero pad if needed
-                    num_pad = frame_len-data_buffer.shape[0]
-                    print("incomplete buffer - padding with "+str(num_pad)+" zeros", flush=True)
-                    data_buffer = np.pad(data_buffer,((0, num_pad), (0, 0)))
-                if client.connected_flag:
-                    data_packet = pack_payload(data_buffer, timestamp.isoformat())
-                    client.publish(config_data["databus"]["streaming_topic"], data_packet, qos=config_data["databus"]["streaming_qos"])
-                    # print('Published '+str(data_buffer.shape[0])+' samples onto the databus',flush=True)
-
-                    # Upload to Diagnostics Engine
-                    conn_diag.store_packet(data_packet,ts=timestamp)
-
-                # sleep rest of the cycle
-                cycle_end = datetime.datetime.now()
-                diff_sec = (cycle_end - cycle_start_t).total_seconds()
-                if diff_sec < frame_delay_sec:
-                    sleep_time = frame_delay_sec - diff_sec
-                    time.sleep(sleep_time)
-            
-        print('Once more, from the top!',flush=True)
-    client.disconnect()
-    client.loop_stop()
+        # sleep until the next frame is due
+        if speed > 0:
+            sleep_time = schedule_start + frame_count * frame_delay_sec / speed - time.monotonic()
+            if sleep_time > 0:
+                time.sleep(sleep_time)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# make the app importable when run from a source checkout
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'app'))
@@ -0,0 +1,66 @@
+import json
+import numpy as np
+import pytest
+from pkg.audio_packing import pack_payload, decode_payload, _encode_values, _count_values, PAYLOAD_ENCODINGS
+
+TIMESTAMP = 1658630821998157300
+
+def float_payload(values):
+    # json payload of an Int16 device which sent float samples
+    payload = json.loads(pack_payload(np.zeros((len(values), 1), dtype=np.int16), TIMESTAMP))
+    payload["records"][0]["vals"][0]["val"] = values
+    return json.dumps(payload)
+
+def test_float_values_of_integer_datapoints_are_rounded():
+    frame = decode_payload(float_payload([1.6, -1.6, 2.4, -0.4, 7.0]), "Int16")
+    assert frame.array.dtype == np.int16
+    assert frame.array[:, 0].tolist() == [2, -2, 2, 0, 7]
+
+def test_float_values_are_rounded_for_64_bit_integers():
+    frame = decode_payload(float_payload([1.6, -1.6]), "Int64")
+    assert frame.array[:, 0].tolist() == [2, -2]
+
+def test_integer_values_are_decoded_exactly():
+    array = np.array([[-32768, 2147483647], [32767, -2147483648]], dtype=np.int32)
+    frame = decode_payload(pack_payload(array, TIMESTAMP), "Int32")
+    assert frame.array.dtype == np.int32
+    assert np.array_equal(frame.array, array)
+
+def test_records_without_selected_datapoints_keep_their_samples():
+    payload = json.loads(pack_payload(np.arange(6, dtype=np.int16).reshape(3, 2), TIMESTAMP))
+    second = json.loads(pack_payload(np.arange(8, dtype=np.int16).reshape(4, 2), TIMESTAMP + 10**6, seq=2))
+    record = second["records"][0]
+    record["rseq"] = payload["records"][0]["rseq"] + 1
+    record["vals"] = record["vals"][:1] # only datapoint 0, which is not selected
+    payload["records"].append(record)
+    frame = decode_payload(json.dumps(payload), "Int16", select=[1])
+    assert frame.ids == [1]
+    assert frame.array[:, 0].tolist() == [1, 3, 5, 0, 0, 0, 0]
+
+@pytest.mark.parametrize("encoding", PAYLOAD_ENCODINGS)
+def test_values_are_counted_without_decoding_them(encoding):
+    for dtype in (np.int8, np.int16, np.float32, np.float64):
+        for length in range(7): # every base64 padding
+            val = json.loads(json.dumps(_encode_values(np.arange(length, dtype=dtype), encoding)))
+            assert _count_values(val, encoding=encoding, raw_dtype=dtype) == length
+
+@pytest.mark.parametrize("encoding", PAYLOAD_ENCODINGS)
+def test_zero_filled_records_keep_their_samples_in_any_encoding(encoding):
+    payload = json.loads(pack_payload(np.arange(6, dtype=np.int16).reshape(3, 2), TIMESTAMP, encoding=encoding))
+    record = json.loads(pack_payload(np.arange(10, dtype=np.int16).reshape(5, 2), TIMESTAMP + 10**6, encoding=encoding))["records"][0]
+    record["rseq"] = payload["records"][0]["rseq"] + 1
+    record["vals"] = record["vals"][:1]
+    payload["records"].append(record)
+    frame = decode_payload(json.dumps(payload), "Int16", encoding=encoding, select=[1])
+    assert frame.array[:, 0].tolist() == [1, 3, 5, 0, 0, 0, 0, 0]
+
+def test_selected_datapoints_have_the_same_ids_on_both_decoders():
+    array = np.arange(6, dtype=np.int16).reshape(3, 2)
+    uniform = decode_payload(pack_payload(array, TIMESTAMP), "Int16", select=["1", "0"])
+    payload = json.loads(pack_payload(array, TIMESTAMP))
+    record = dict(payload["records"][0], rseq=payload["records"][0]["rseq"] + 1)
+    record["vals"] = record["vals"][1:] # differing datapoints need the generic decoder
+    payload["records"].append(record)
+    generic = decode_payload(json.dumps(payload), "Int16", select=["1", "0"])
+    assert uniform.ids == generic.ids == ["1", "0"]
+    assert generic.array[:, 1].tolist() == [0, 2, 4, 0, 0, 0]
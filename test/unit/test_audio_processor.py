@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import wave
+import numpy as np
+import audio_processor
+from pkg.audio_packing import pack_payload, pack_metadata
+from pkg.configuration_manager import ConfigurationManager, MetadataManager
+from pkg.conn_diagnostics import PacketDiagnostics
+from pkg.reconnect import ReconnectManager, Outbox
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'app', 'config', 'config.json')
+TIMESTAMP = 1658630821998157300
+
+class Message(object):
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+class FakeClient(object):
+    """Stands in for the MQTT client; publish fails like paho's while not connected."""
+    def __init__(self):
+        self.connected = True
+        self.published = []
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if not self.connected:
+            return (4, 0) # MQTT_ERR_NO_CONN
+        self.published.append((topic, payload))
+        return (0, len(self.published))
+    def subscribe(self, topic, qos=0):
+        pass
+    def unsubscribe(self, topic):
+        pass
+    def reconnect(self):
+        pass
+
+def metadata_message(connections, num_chan=1):
+    metadata = {"seq":len(connections), "connections":[]}
+    for name, topic in connections:
+        metadata["connections"] += json.loads(pack_metadata(name, 48000, num_chan, "Int16", topic))["connections"]
+    return json.dumps(metadata)
+
+def setup_processor(monkeypatch, **config_data):
+    config_manager = ConfigurationManager(CONFIG_FILE)
+    config = dict(config_manager.get_config_data(), connection_name="mic", **config_data)
+    monkeypatch.setattr(audio_processor, "CONFIG_DATA", config)
+    monkeypatch.setattr(audio_processor, "CONFIG_MANAGER", config_manager)
+    monkeypatch.setattr(audio_processor, "METADATA_MANAGER", MetadataManager(config_manager))
+    monkeypatch.setattr(audio_processor, "DIAGNOSTICS_ENGINE", PacketDiagnostics(name="TEST", interval=60))
+    monkeypatch.setattr(audio_processor, "CONNECTIONS", {})
+    monkeypatch.setattr(audio_processor, "STREAM_ROUTES", {})
+    return config
+
+def test_frames_are_processed_in_the_channel_layout_they_were_decoded_in(monkeypatch):
+    config = setup_processor(monkeypatch, channels=[{"datapoint":"ch1", "gain":2.}])
+    client = FakeClient()
+    audio_processor.on_message(client, None, Message(config["databus"]["metadata_topic"],
+                                                     metadata_message([("mic", "stream/mic")], num_chan=2)))
+    connection = audio_processor.CONNECTIONS["mic"]
+    payload = pack_payload(np.full((480, 2), [1, 3], dtype=np.int16), TIMESTAMP)
+    decode_args, layout = connection.decode_args(payload) # queued for a worker...
+    config["channels"] = [{"datapoint":"ch1", "gain":4.}]
+    connection.reconfigure(("channels", )) # ...while the config changes
+    audio_processor.process_payload(decode_args, (client, connection, 0, layout))
+    results = [json.loads(payload)["result"] for _, payload in client.published]
+    assert np.allclose(results, [[6.]]) # scaled as when it was decoded
+
+    decode_args, layout = connection.decode_args(payload)
+    config["channels"] = ["ch0", "ch1"]
+    connection.reconfigure(("channels", ))
+    audio_processor.process_payload(decode_args, (client, connection, 0, layout))
+    assert len(client.published) == 1 # one column, while the stages now expect two
+
+def test_batches_flushed_while_disconnected_are_kept_for_the_reconnect(monkeypatch):
+    config = setup_processor(monkeypatch, output={"batch_size":100, "batch_interval_ms":60000})
+    client = FakeClient()
+    reconnect = ReconnectManager(client, "TEST", outbox=Outbox("test"))
+    monkeypatch.setattr(audio_processor, "RECONNECT", reconnect)
+    reconnect.handle_connect(0)
+    metadata_topic = config["databus"]["metadata_topic"]
+    output_topic = config["databus"]["output_topic"]
+
+    audio_processor.on_message(client, None, Message(metadata_topic, metadata_message([("mic", "stream/mic")])))
+    audio_processor.on_message(client, None, Message("stream/mic", pack_payload(np.ones((480, 1), dtype=np.int16), TIMESTAMP)))
+    client.connected = False
+    reconnect.handle_disconnect(1)
+    # the connection goes away while disconnected: its pending batch is flushed
+    audio_processor.on_message(client, None, Message(metadata_topic, metadata_message([("other", "stream/other")])))
+    assert "mic" not in audio_processor.CONNECTIONS
+    assert [topic for topic, _ in client.published if topic == output_topic] == []
+    assert reconnect.get_stats()["Outbox depth"] == 1
+
+    client.connected = True
+    reconnect.handle_connect(0)
+    for _ in range(100):
+        if not reconnect.replaying:
+            break
+        time.sleep(0.01)
+    batches = [json.loads(payload) for topic, payload in client.published if topic == output_topic]
+    assert len(batches) == 1
+    assert batches[0]["connection_name"] == "mic"
+
+def test_frames_held_after_a_gap_are_processed_when_the_stream_stalls(monkeypatch):
+    config = setup_processor(monkeypatch, reassembly={"jitter_ms":1000, "max_hold_ms":0}, features={"window_ms":10})
+    client = FakeClient()
+    audio_processor.on_message(client, None, Message(config["databus"]["metadata_topic"], metadata_message([("mic", "stream/mic")])))
+    samples = np.ones((480, 1), dtype=np.int16)
+    audio_processor.on_message(client, None, Message("stream/mic", pack_payload(samples, TIMESTAMP)))
+    audio_processor.on_message(client, None, Message("stream/mic", pack_payload(samples, TIMESTAMP + 20 * 10**6))) # after a gap
+    assert len(client.published) == 1 # the first frame's window; the second frame is held back
+    audio_processor.release_held_frames(client) # the stream stalled
+    results = [json.loads(payload) for _, payload in client.published]
+    assert results[1]["gap"] == {"samples":480, "filled":True}
+    assert len([result for result in results if "features" in result]) == 3
+
+def test_pending_trigger_events_are_published_when_the_connection_stops(monkeypatch):
+    config = setup_processor(monkeypatch, triggers={"rules":[{"name":"loud", "above":100}], "post_ms":5000})
+    client = FakeClient()
+    metadata_topic = config["databus"]["metadata_topic"]
+    audio_processor.on_message(client, None, Message(metadata_topic, metadata_message([("mic", "stream/mic")])))
+    audio_processor.on_message(client, None, Message("stream/mic", pack_payload(np.full((480, 1), 1000, dtype=np.int16), TIMESTAMP)))
+    assert [json.loads(payload).get("event") for _, payload in client.published] == [None] # waiting for post_ms
+    audio_processor.on_message(client, None, Message(metadata_topic, metadata_message([("other", "stream/other")])))
+    events = [json.loads(payload) for _, payload in client.published if "event" in json.loads(payload)]
+    assert [(event["event"], event["connection_name"]) for event in events] == [("loud", "mic")]
+
+def test_event_recordings_start_before_the_event(monkeypatch, tmp_path):
+    config = setup_processor(monkeypatch, triggers={"rules":[{"name":"loud", "above":100}], "pre_ms":200, "post_ms":100, "record":True},
+                             recorder={"directory":str(tmp_path), "export_dir":str(tmp_path / "events")})
+    client = FakeClient()
+    audio_processor.on_message(client, None, Message(config["databus"]["metadata_topic"],
+                                                     metadata_message([("mic", "stream/mic")], num_chan=2)))
+    for indx in range(8): # 100 ms frames, loud on both channels from the sixth on
+        samples = np.full((4800, 2), 1 if indx < 5 else 1000, dtype=np.int16)
+        audio_processor.on_message(client, None, Message("stream/mic", pack_payload(samples, TIMESTAMP + indx * 10**8)))
+    audio_processor.CONNECTIONS["mic"].stop(client)
+    events = [json.loads(payload) for _, payload in client.published if "event" in json.loads(payload)]
+    assert [event["channel"] for event in events] == [0, 1]
+    recordings = os.listdir(tmp_path / "events")
+    assert len(recordings) == 1 # both events in one recording
+    with wave.open(str(tmp_path / "events" / recordings[0])) as file:
+        samples = np.frombuffer(file.readframes(file.getnframes()), dtype='<i2').reshape(-1, 2)
+    # from pre_ms before the event to post_ms after it
+    assert samples.shape == (14400, 2)
+    assert np.all(samples[:9600] == 1) and np.all(samples[9600:] == 1000)
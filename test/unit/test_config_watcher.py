@@ -0,0 +1,70 @@
+import os
+import json
+import time
+from pkg.configuration_manager import ConfigurationManager, ConfigWatcher
+
+def write_config(path, data, age=10.):
+    """Writes a config file last modified age seconds ago."""
+    with open(path, 'w') as f:
+        f.write(data if isinstance(data, str) else json.dumps(data))
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+def setup_watcher(tmp_path, debounce=1.):
+    path = str(tmp_path / "config.json")
+    write_config(path, {"gain": 1}, age=100.)
+    changes = []
+    watcher = ConfigWatcher(ConfigurationManager(path), lambda old, new: changes.append((old, new)), debounce=debounce)
+    return path, watcher, changes
+
+def test_settled_changes_are_applied_once(tmp_path):
+    path, watcher, changes = setup_watcher(tmp_path)
+    assert watcher.check() is False and changes == []
+    write_config(path, {"gain": 2})
+    assert watcher.check() is False
+    assert watcher.check() is False
+    assert changes == [({"gain": 1}, {"gain": 2})]
+
+def test_changes_are_debounced(tmp_path):
+    path, watcher, changes = setup_watcher(tmp_path, debounce=60.)
+    write_config(path, {"gain": 2}, age=0.)
+    assert watcher.check() is True # still settling
+    assert changes == []
+
+def test_unchanged_contents_are_not_applied(tmp_path):
+    path, watcher, changes = setup_watcher(tmp_path)
+    write_config(path, {"gain": 1}) # e.g. touched, or saved again
+    assert watcher.check() is False
+    assert changes == []
+
+def test_invalid_files_are_skipped_until_the_next_change(tmp_path):
+    path, watcher, changes = setup_watcher(tmp_path)
+    write_config(path, '{"gain": ')
+    assert watcher.check() is False
+    assert watcher.check() is False # reported once
+    write_config(path, {"gain": 3}, age=5.)
+    watcher.check()
+    assert changes == [({"gain": 1}, {"gain": 3})]
+
+def test_missing_files_and_failing_changes_keep_the_watcher_going(tmp_path):
+    path, watcher, changes = setup_watcher(tmp_path)
+    os.remove(path)
+    assert watcher.check() is True # being replaced
+    write_config(path, {"gain": 2})
+    watcher.on_change = lambda old, new: 1 / 0
+    assert watcher.check() is False
+    assert watcher.config_mgr.get_config_data() == {"gain": 2}
+
+def test_replaced_files_are_picked_up_by_the_watcher_thread(tmp_path):
+    path, watcher, changes = setup_watcher(tmp_path, debounce=0.05)
+    watcher.poll_interval = 0.05
+    watcher.start()
+    time.sleep(0.05)
+    write_config(path + ".tmp", {"gain": 4}, age=0.)
+    os.replace(path + ".tmp", path) # like editors and mounted volumes do
+    deadline = time.monotonic() + 5.
+    while len(changes) == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    watcher.stop()
+    watcher.thread.join(1.)
+    assert changes == [({"gain": 1}, {"gain": 4})]
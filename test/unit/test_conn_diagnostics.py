@@ -0,0 +1,25 @@
+import functools
+from pkg.conn_diagnostics import PacketDiagnostics
+from pkg.profiling import StageProfiler
+
+def test_snapshots_leave_resetting_sources_to_the_report():
+    profiler = StageProfiler(enabled=True)
+    profiler.lap("decode", profiler.start())
+    diagnostics = PacketDiagnostics(name="TEST", interval=60)
+    diagnostics.add_report_source(profiler.get_stats, peek=functools.partial(profiler.get_stats, reset=False))
+    assert diagnostics.snapshot()["extra"]["Stage decode calls"] == 1
+    assert diagnostics.snapshot()["extra"]["Stage decode calls"] == 1 # not reset by the first snapshot
+    diagnostics.generate_report(print_report=False)
+    assert diagnostics.report_data["Stage decode calls"] == 1
+    assert "Stage decode calls" not in diagnostics.snapshot()["extra"] # reset by the report
+
+def test_report_drops_keys_a_source_no_longer_reports():
+    stats = {"Frames buffered": 1, "Gaps filled": 2}
+    diagnostics = PacketDiagnostics(name="TEST", interval=60)
+    diagnostics.add_report_source(lambda: dict(stats))
+    diagnostics.generate_report(print_report=False)
+    assert diagnostics.report_data["Gaps filled"] == 2
+    del stats["Gaps filled"]
+    diagnostics.generate_report(print_report=False)
+    assert "Gaps filled" not in diagnostics.report_data
+    assert diagnostics.report_data["Frames buffered"] == 1
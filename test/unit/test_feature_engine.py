@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from pkg.feature_engine import FeatureEngine
+
+SAMPLING_RATE = 8000.
+
+def push_in_chunks(engine, signal, chunk_sizes):
+    """Pushes signal in chunks of the given sizes, in turn; returns the absolute window starts and the features."""
+    starts, results = [], {}
+    position, indx = 0, 0
+    while position < len(signal):
+        size = chunk_sizes[indx % len(chunk_sizes)]
+        indx += 1
+        offsets, features = engine.push(signal[position:position+size])
+        starts += (position + offsets).tolist()
+        for name, values in features.items():
+            results.setdefault(name, []).append(values)
+        position += size
+    return starts, {name: np.concatenate(values) for name, values in results.items()}
+
+def naive_windows(signal, window, hop):
+    return [signal[start:start+window] for start in range(0, len(signal) - window + 1, hop)]
+
+@pytest.mark.parametrize("window, hop", [(256, 256), (256, 100), (200, 450)])
+def test_rms_peak_and_zcr_match_a_naive_computation(window, hop):
+    rng = np.random.default_rng(1)
+    signal = rng.normal(size=(5000, 2)) + [[0., 0.5]]
+    engine = FeatureEngine(SAMPLING_RATE, 2, window, hop, features=("rms", "peak", "crest_factor", "zcr"))
+    starts, features = push_in_chunks(engine, signal, [160, 1000, 37, 480])
+
+    windows = naive_windows(signal, window, hop)
+    assert starts == list(range(0, len(signal) - window + 1, hop))
+    rms = np.array([np.sqrt(np.mean(x**2, axis=0)) for x in windows])
+    peak = np.array([np.max(np.abs(x), axis=0) for x in windows])
+    crossings = np.array([np.sum(np.signbit(x[1:]) != np.signbit(x[:-1]), axis=0) for x in windows])
+    assert np.allclose(features["rms"], rms)
+    assert np.allclose(features["peak"], peak)
+    assert np.allclose(features["crest_factor"], peak / rms)
+    assert np.allclose(features["zcr"], crossings * SAMPLING_RATE / (window - 1))
+
+def test_band_energy_matches_a_naive_fft():
+    window = 512
+    bands = [(0., 500.), (500., 1500.), (1500., 4001.)]
+    time = np.arange(4096) / SAMPLING_RATE
+    signal = np.column_stack([np.sin(2 * np.pi * 1000. * time), np.sin(2 * np.pi * 250. * time) + 0.1 * np.sin(2 * np.pi * 3000. * time)])
+    engine = FeatureEngine(SAMPLING_RATE, 2, window, features=("band_energy", ), bands=bands)
+    _, features = push_in_chunks(engine, signal, [700])
+
+    taper = np.hanning(window)
+    freqs = np.abs(np.fft.fftfreq(window, 1. / SAMPLING_RATE))
+    expected = []
+    for x in naive_windows(signal, window, window):
+        power = np.abs(np.fft.fft(x * taper[:, None], axis=0))**2 # two-sided
+        expected.append([[power[(freqs >= low) & (freqs < high), chan].sum() for low, high in bands] for chan in range(2)])
+    expected = np.array(expected) / (window * np.sum(taper**2))
+    assert np.allclose(features["band_energy"], expected)
+    # the band energies of a sine add up to its mean square
+    assert np.allclose(features["band_energy"][:, 0].sum(axis=-1), 0.5, rtol=0.01)
+
+def test_reset_starts_a_new_window():
+    engine = FeatureEngine(SAMPLING_RATE, 1, 100)
+    engine.push(np.ones((60, 1)))
+    engine.reset()
+    offsets, features = engine.push(np.full((100, 1), 2.))
+    assert offsets.tolist() == [0]
+    assert np.allclose(features["rms"], 2.)
@@ -0,0 +1,13 @@
+from pkg.conn_diagnostics import PacketDiagnostics
+from pkg.metrics_server import format_metrics
+from pkg.worker_pool import WorkerPool
+
+def test_lifetime_totals_of_sources_are_counters():
+    diagnostics = PacketDiagnostics(name="DATABUS", interval=60)
+    stats = {"Worker queue depth": 3, "Messages dropped": 5, "Connection state": "connected"}
+    diagnostics.add_report_source(lambda: stats, counters=WorkerPool.STATS_COUNTERS)
+    lines = format_metrics([diagnostics.snapshot()]).splitlines()
+    assert '# TYPE audio_processor_messages_dropped_total counter' in lines
+    assert 'audio_processor_messages_dropped_total{connection="DATABUS"} 5' in lines
+    assert '# TYPE audio_processor_worker_queue_depth gauge' in lines
+    assert not any("connection_state" in line for line in lines) # not numeric
@@ -0,0 +1,38 @@
+import json
+from pkg.output_batching import OutputBatcher
+
+HEADER = {"connection_name":"test", "streaming_topic":"t/1"}
+
+def spectrum(num_bands, level):
+    centers = [31.25 * 2**indx for indx in range(num_bands)]
+    return {"band_centers_hz":centers, "levels_db":[[level] * num_bands, [level + 1.] * num_bands]}
+
+def test_results_are_columnar():
+    batcher = OutputBatcher(HEADER, max_records=2, max_delay_ms=60000)
+    assert batcher.add("t0", "result", [1., 2.]) == []
+    message = json.loads(batcher.add("t1", "result", [3., 4.])[0])
+    assert message["timestamps"] == ["t0", "t1"]
+    assert message["result"] == [[1., 3.], [2., 4.]]
+
+def test_spectra_with_the_same_bands_share_their_band_centers():
+    batcher = OutputBatcher(HEADER, max_records=2, max_delay_ms=60000)
+    batcher.add("t0", "spectrum", spectrum(3, 10.))
+    message = json.loads(batcher.add("t1", "spectrum", spectrum(3, 20.))[0])
+    assert message["spectrum"]["band_centers_hz"] == spectrum(3, 0.)["band_centers_hz"]
+    assert message["spectrum"]["levels_db"][0] == [[10., 20.]] * 3
+
+def test_spectra_with_differing_band_counts_in_one_batch():
+    batcher = OutputBatcher(HEADER, max_records=3, max_delay_ms=60000)
+    batcher.add("t0", "spectrum", spectrum(3, 10.))
+    batcher.add("t1", "spectrum", spectrum(3, 20.))
+    message = json.loads(batcher.add("t2", "spectrum", spectrum(4, 30.))[0])
+    value = message["spectrum"]
+    # kept per record, as neither can be stacked along time
+    assert value["band_centers_hz"] == [spectrum(n, 0.)["band_centers_hz"] for n in (3, 3, 4)]
+    assert value["levels_db"] == [spectrum(3, 10.)["levels_db"], spectrum(3, 20.)["levels_db"], spectrum(4, 30.)["levels_db"]]
+
+def test_change_threshold_with_differing_band_counts():
+    batcher = OutputBatcher(HEADER, max_records=2, max_delay_ms=60000, change_threshold=1.)
+    batcher.add("t0", "spectrum", spectrum(3, 10.))
+    messages = batcher.add("t1", "spectrum", spectrum(4, 10.))
+    assert len(json.loads(messages[0])["spectrum"]["levels_db"]) == 2
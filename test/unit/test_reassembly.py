@@ -0,0 +1,86 @@
+import time
+import numpy as np
+from pkg.reassembly import StreamReassembler
+
+SAMPLING_RATE = 1000. # 1 ms per sample
+T0 = 1658630821998000000
+
+def frame(start, length=100):
+    """Frame of the samples start .. start+length-1, whose values are their sample numbers."""
+    return np.arange(start, start + length, dtype=np.int16).reshape(-1, 1), T0 + start * 1000000
+
+def stream(chunks):
+    return np.concatenate([chunk for _, chunk, _ in chunks if chunk is not None])
+
+def test_frames_in_order_pass_right_through():
+    reassembler = StreamReassembler(SAMPLING_RATE)
+    for start in range(0, 500, 100):
+        chunks = reassembler.push(*frame(start))
+        assert [(ts, gap) for ts, _, gap in chunks] == [(T0 + start * 1000000, 0)]
+
+def test_reordered_frames_are_put_back_in_order():
+    reassembler = StreamReassembler(SAMPLING_RATE, jitter_ms=500)
+    chunks = reassembler.push(*frame(0))
+    chunks += reassembler.push(*frame(200)) # held back until 100 arrives
+    assert len(chunks) == 1
+    chunks += reassembler.push(*frame(100))
+    chunks += reassembler.push(*frame(300))
+    assert stream(chunks)[:, 0].tolist() == list(range(400))
+    assert all(gap == 0 for _, _, gap in chunks)
+    assert reassembler.get_stats()["Frames reordered"] == 1
+
+def test_gaps_are_filled_once_the_jitter_bound_is_passed():
+    reassembler = StreamReassembler(SAMPLING_RATE, jitter_ms=150, fill="zeros")
+    chunks = reassembler.push(*frame(0))
+    chunks += reassembler.push(*frame(200))
+    chunks += reassembler.push(*frame(300)) # 200 ms past the gap
+    assert [(ts, gap) for ts, _, gap in chunks] == [(T0, 0), (T0 + 100000000, 100), (T0 + 200000000, 0), (T0 + 300000000, 0)]
+    samples = stream(chunks)[:, 0]
+    assert samples[100:200].tolist() == [0] * 100
+    assert samples[200:].tolist() == list(range(200, 400))
+    assert reassembler.get_stats()["Samples filled"] == 100
+
+    late = reassembler.push(*frame(100)) # its place was filled already
+    assert late == [] and reassembler.get_stats()["Late frames dropped"] == 1
+
+def test_interpolated_gaps_join_the_samples_around_them():
+    reassembler = StreamReassembler(SAMPLING_RATE, fill="interpolate")
+    reassembler.push(*frame(0))
+    chunks = reassembler.flush() + reassembler.push(*frame(200))
+    chunks += reassembler.flush()
+    _, fill, gap = chunks[0]
+    assert gap == 100
+    assert np.array_equal(fill[:, 0], np.arange(100, 200)) # a straight line from 99 to 200
+
+def test_long_gaps_restart_the_stream():
+    reassembler = StreamReassembler(SAMPLING_RATE, max_fill_ms=50)
+    reassembler.push(*frame(0))
+    reassembler.push(*frame(200))
+    chunks = reassembler.flush()
+    assert [(ts, chunk is None, gap) for ts, chunk, gap in chunks] == [(T0 + 100000000, True, 100), (T0 + 200000000, False, 0)]
+    assert reassembler.get_stats()["Stream restarts"] == 1
+
+def test_overlapping_samples_are_trimmed():
+    reassembler = StreamReassembler(SAMPLING_RATE)
+    chunks = reassembler.push(*frame(0))
+    chunks += reassembler.push(*frame(60))
+    assert stream(chunks)[:, 0].tolist() == list(range(160))
+    assert reassembler.get_stats()["Overlapping samples trimmed"] == 40
+
+def test_frames_held_after_a_gap_are_released_when_the_stream_stalls():
+    reassembler = StreamReassembler(SAMPLING_RATE, jitter_ms=1000, max_hold_ms=50)
+    reassembler.push(*frame(0))
+    assert reassembler.push(*frame(200)) == []
+    assert reassembler.release() == [] # not held long enough
+    chunks = reassembler.release(now=time.monotonic() + 0.05)
+    assert [gap for _, _, gap in chunks] == [100, 0]
+    assert stream(chunks)[100:, 0].tolist() == list(range(200, 300))
+    assert reassembler.release(now=time.monotonic() + 1.) == [] # nothing held any more
+
+def test_missing_sequence_numbers_are_counted():
+    reassembler = StreamReassembler(SAMPLING_RATE)
+    reassembler.push(*frame(0), seq=1, rseq=[1, 2])
+    reassembler.push(*frame(100), seq=3, rseq=[5])
+    stats = reassembler.get_stats()
+    assert stats["Messages missing (seq)"] == 1
+    assert stats["Records missing (rseq)"] == 2
@@ -0,0 +1,157 @@
+import time
+import random
+from pkg.reconnect import ReconnectManager, Outbox, STATE_RECONNECTING
+
+MQTT_ERR_CONN_LOST = 7
+MQTT_ERR_QUEUE_SIZE = 15
+
+class FakeClient(object):
+    """Publishes into a list while connected; rc is returned instead while not."""
+    def __init__(self):
+        self.connected = True
+        self.rc = 4 # MQTT_ERR_NO_CONN
+        self.published = []
+        self.reconnects = 0
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if not self.connected:
+            return (self.rc, 0)
+        self.published.append((topic, payload))
+        return (0, len(self.published))
+    def reconnect(self):
+        self.reconnects += 1
+
+class FakePahoClient(FakeClient):
+    """Network loop of a paho client, which loses the connection and refuses the first reconnect attempts."""
+    def __init__(self, failed_attempts=2):
+        super().__init__()
+        self.manager = None
+        self.failed_attempts = failed_attempts
+        self.connecting = False
+    def reconnect_delay_set(self, min_delay=1, max_delay=120):
+        raise AssertionError("reconnects follow the manager's backoff, not paho's")
+    def loop(self, timeout=1.):
+        if self.connecting: # CONNACK
+            self.connecting, self.connected = False, True
+            self.manager.handle_connect(0)
+        if self.connected and self.reconnects == 0:
+            self.connected = False
+            self.manager.handle_disconnect(MQTT_ERR_CONN_LOST) # on_disconnect, called by the loop
+        if not self.connected:
+            return MQTT_ERR_CONN_LOST
+        self.manager.stop()
+        return 0
+    def reconnect(self):
+        super().reconnect()
+        if self.reconnects <= self.failed_attempts:
+            raise ConnectionRefusedError()
+        self.connecting = True
+
+def wait_for_replay(manager):
+    for _ in range(200):
+        if not manager.replaying:
+            break
+        time.sleep(0.01)
+
+def test_backoff_doubles_up_to_max_delay_shortened_by_jitter(monkeypatch):
+    manager = ReconnectManager(FakeClient(), min_delay=1., max_delay=10., jitter=0.5)
+    monkeypatch.setattr(random, "random", lambda: 0.)
+    assert [manager.next_delay() for _ in range(6)] == [1., 2., 4., 8., 10., 10.]
+    monkeypatch.setattr(random, "random", lambda: 1.)
+    manager.attempt = 0
+    assert [manager.next_delay() for _ in range(3)] == [0.5, 1., 2.]
+    manager.handle_connect(0)
+    assert manager.attempt == 0 # starts over once connected
+
+def test_paho_reconnects_with_the_managers_jittered_backoff(monkeypatch):
+    client = FakePahoClient(failed_attempts=2)
+    manager = ReconnectManager(client, min_delay=0.01, max_delay=1., jitter=0.5)
+    client.manager = manager
+    delays = []
+    schedule = manager._schedule
+    monkeypatch.setattr(manager, "_schedule", lambda delay: (delays.append(delay), schedule(delay)))
+    values = iter([0.2, 0.4, 0.6])
+    monkeypatch.setattr(random, "random", lambda: next(values))
+    manager.handle_connect(0)
+    manager.loop_forever(timeout=0.)
+    # every attempt after its own jittered delay: 0.01 * 2^n * (1 - 0.5 * random)
+    assert [round(delay, 6) for delay in delays] == [0.009, 0.016, 0.028]
+    assert client.reconnects == 3 and manager.num_attempts == 3
+    assert manager.get_stats()["Disconnections"] == 1
+
+def test_loop_forever_runs_the_loop_of_other_transports():
+    client = FakeClient()
+    client.loop_forever = lambda: client.published.append(("loop", None))
+    ReconnectManager(client).loop_forever()
+    assert client.published == [("loop", None)]
+
+def test_other_transports_are_reconnected_from_a_timer():
+    client = FakeClient()
+    manager = ReconnectManager(client, min_delay=0.01, jitter=0.)
+    manager.handle_connect(0)
+    manager.handle_disconnect(1)
+    assert manager.state == STATE_RECONNECTING
+    for _ in range(200):
+        if client.reconnects > 0:
+            break
+        time.sleep(0.01)
+    assert client.reconnects == 1
+    manager.handle_disconnect(0) # on purpose: no further attempts
+    manager.stop()
+
+def test_messages_published_while_disconnected_are_replayed_in_order():
+    client = FakeClient()
+    manager = ReconnectManager(client, outbox=Outbox("test"))
+    manager.handle_connect(0)
+    manager.publish("topic", "0")
+    client.connected = False
+    manager.handle_disconnect(1)
+    for indx in range(1, 5):
+        manager.publish("topic", str(indx))
+    assert len(manager.outbox) == 4
+    client.connected = True
+    manager.handle_connect(0)
+    manager.publish("topic", "5") # after the buffered ones, even while they are replayed
+    wait_for_replay(manager)
+    manager.stop()
+    assert [payload for _, payload in client.published] == [str(indx) for indx in range(6)]
+    assert len(manager.outbox) == 0
+
+def test_messages_kept_by_paho_are_not_buffered_twice():
+    client = FakePahoClient()
+    manager = ReconnectManager(client, outbox=Outbox("test"))
+    manager.handle_connect(0)
+    client.connected = False # lost, but on_disconnect not called yet
+    manager.publish("topic", "qos 1", qos=1) # paho sends it once reconnected
+    manager.publish("topic", "qos 0", qos=0)
+    client.rc = MQTT_ERR_QUEUE_SIZE # paho's queue is full: lost unless buffered
+    manager.publish("topic", "queue full", qos=1)
+    assert [message[1] for message in manager.outbox.pop()] == ["qos 0", "queue full"]
+
+def test_outbox_spills_beyond_its_size_and_pops_in_order(tmp_path):
+    outbox = Outbox("spill", max_messages=2, spill_dir=str(tmp_path))
+    messages = [("topic", str(indx), 0, False) for indx in range(5)] + [("topic", b"\xff\x00", 1, True)]
+    for message in messages:
+        assert outbox.push(message)
+    assert len(outbox) == 6 and outbox.num_spilled == 4
+    first = outbox.pop(3)
+    assert first == messages[:3]
+    outbox.push(("topic", "later", 0, False)) # after the spilled messages
+    outbox.push_front(first[2:]) # not published after all
+    assert outbox.pop() == messages[2:] + [("topic", "later", 0, False)]
+    assert len(outbox) == 0 and not (tmp_path / "spill.outbox").exists()
+
+def test_outbox_picks_up_the_spill_file_of_a_previous_run(tmp_path):
+    outbox = Outbox("left", max_messages=0, spill_dir=str(tmp_path))
+    outbox.push(("topic", "left over", 1, False))
+    restarted = Outbox("left", max_messages=10, spill_dir=str(tmp_path))
+    restarted.push(("topic", "new", 1, False))
+    assert [message[1] for message in restarted.pop()] == ["left over", "new"]
+
+def test_outbox_drops_beyond_its_limits(tmp_path):
+    outbox = Outbox("full", max_messages=1)
+    assert outbox.push(("topic", "kept", 0, False))
+    assert not outbox.push(("topic", "dropped", 0, False))
+    spilling = Outbox("full", max_messages=0, spill_dir=str(tmp_path), max_spill_bytes=1)
+    assert spilling.push(("topic", "spilled", 0, False))
+    assert not spilling.push(("topic", "dropped", 0, False))
+    assert outbox.num_dropped == spilling.num_dropped == 1
@@ -0,0 +1,82 @@
+import os
+import wave
+import struct
+import numpy as np
+from pkg.recorder import RingRecorder, write_wave
+
+SAMPLING_RATE = 1000 # 1 ms per sample
+T0 = 1658630821998000000
+
+def read_wave(path):
+    """(format tag, channels, rate, bits, samples) of a WAV file, parsed by hand."""
+    with open(path, 'rb') as file:
+        data = file.read()
+    assert data[:4] == b'RIFF' and data[8:12] == b'WAVE' and struct.unpack('<I', data[4:8])[0] == len(data) - 8
+    fmt_tag, num_chan, rate, byte_rate, block_align, bits = struct.unpack('<HHIIHH', data[20:36])
+    assert data[12:16] == b'fmt ' and data[36:40] == b'data'
+    assert byte_rate == rate * block_align and block_align == num_chan * bits // 8
+    dtype = {1: {8: np.uint8, 16: np.int16, 32: np.int32}, 3: {32: np.float32, 64: np.float64}}[fmt_tag][bits]
+    samples = np.frombuffer(data[44:44 + struct.unpack('<I', data[40:44])[0]], dtype=np.dtype(dtype).newbyteorder('<'))
+    return fmt_tag, num_chan, rate, bits, samples.reshape(-1, num_chan)
+
+def test_pcm_wave_files_round_trip(tmp_path):
+    array = np.array([[0, -32768], [32767, 1], [-2, 3]], dtype=np.int16)
+    path = str(tmp_path / "pcm.wav")
+    write_wave(path, 48000, array)
+    with wave.open(path) as file: # readable by the standard library
+        assert (file.getnchannels(), file.getsampwidth(), file.getframerate(), file.getnframes()) == (2, 2, 48000, 3)
+        assert np.array_equal(np.frombuffer(file.readframes(3), dtype='<i2').reshape(-1, 2), array)
+
+def test_float_wave_files_round_trip(tmp_path):
+    array = np.array([[0.5], [-0.25], [1e-3]], dtype=np.float32)
+    path = str(tmp_path / "float.wav")
+    write_wave(path, 44100, array)
+    fmt_tag, num_chan, rate, bits, samples = read_wave(path)
+    assert (fmt_tag, num_chan, rate, bits) == (3, 1, 44100, 32)
+    assert np.array_equal(samples, array)
+
+def test_8_bit_samples_are_stored_unsigned(tmp_path):
+    path = str(tmp_path / "int8.wav")
+    write_wave(path, 8000, np.array([-128, 0, 127], dtype=np.int8))
+    assert read_wave(path)[4][:, 0].tolist() == [0, 128, 255]
+
+def record(recorder, starts, length=100):
+    # frames whose samples are their sample numbers
+    for start in starts:
+        recorder.add(T0 + start * 1000000, np.arange(start, start + length, dtype=np.int16).reshape(-1, 1))
+
+def test_export_holds_the_last_seconds_across_the_wrap_around(tmp_path):
+    recorder = RingRecorder("mic/1", SAMPLING_RATE, directory=str(tmp_path), retention_s=0.5)
+    recorder.start()
+    record(recorder, range(0, 1200, 100)) # 1.2 s, the file wraps around twice
+    path = str(tmp_path / "last.wav")
+    recorder.export(0.3, path)
+    recorder.export(0.3) # named after the connection and its first sample
+    recorder.stop()
+    assert read_wave(path)[4][:, 0].tolist() == list(range(900, 1200))
+    assert os.path.exists(tmp_path / "mic_1-20220724-024702.898.wav")
+    assert recorder.get_stats()["Recordings exported"] == 2
+
+def test_export_is_limited_to_the_retention(tmp_path):
+    recorder = RingRecorder("mic", SAMPLING_RATE, directory=str(tmp_path), retention_s=0.5)
+    recorder.start()
+    record(recorder, range(0, 1000, 100))
+    path = str(tmp_path / "all.wav")
+    recorder.export(10, path)
+    recorder.stop()
+    assert read_wave(path)[4][:, 0].tolist() == list(range(500, 1000))
+
+def test_export_of_a_time_range(tmp_path):
+    recorder = RingRecorder("mic", SAMPLING_RATE, directory=str(tmp_path), retention_s=0.5)
+    recorder.start()
+    record(recorder, range(0, 400, 100))
+    record(recorder, [600]) # after a gap
+    path = str(tmp_path / "range.wav")
+    recorder.export(path=path, start_ns=T0 + 150 * 1000000, end_ns=T0 + 250 * 1000000)
+    recorder.export(path=str(tmp_path / "gap.wav"), start_ns=T0 + 350 * 1000000, end_ns=T0 + 650 * 1000000)
+    recorder.export(path=str(tmp_path / "early.wav"), start_ns=T0 - 10**9, end_ns=T0 + 50 * 1000000)
+    recorder.stop()
+    assert read_wave(path)[4][:, 0].tolist() == list(range(150, 250))
+    # the samples recorded in the range, joined across the gap
+    assert read_wave(str(tmp_path / "gap.wav"))[4][:, 0].tolist() == list(range(350, 400)) + list(range(600, 650))
+    assert read_wave(str(tmp_path / "early.wav"))[4][:, 0].tolist() == list(range(50))
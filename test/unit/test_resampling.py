@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from pkg.resampling import PolyphaseResampler, get_polyphase_filter
+from pkg.spectral_analysis import SpectralAnalyzer
+
+T0 = 1658630821998000000
+CHUNK_SIZES = [4800, 1, 333, 4800, 2047, 4019] # 16000 samples, in uneven chunks
+
+def resample_in_chunks(resampler, signal, sizes=CHUNK_SIZES):
+    """Output chunks (timestamp, array) of a signal pushed in chunks of the given sizes."""
+    chunks, position = [], 0
+    for size in sizes:
+        chunks.append(resampler.push(signal[position:position+size], T0 + round(position * 1e9 / resampler.source_rate)))
+        position += size
+    assert position == len(signal)
+    return chunks
+
+@pytest.mark.parametrize("source_rate, target_rate", [(48000, 16000), (44100, 48000), (16000, 48000)])
+def test_resampled_sine_matches_the_ideal_one(source_rate, target_rate):
+    freq, num_samples = 1000., sum(CHUNK_SIZES)
+    signal = np.sin(2 * np.pi * freq * np.arange(num_samples) / source_rate).reshape(-1, 1)
+    resampler = PolyphaseResampler(source_rate, target_rate)
+    out = np.concatenate([array for _, array in resample_in_chunks(resampler, signal)])
+    # all output samples but those waiting for the look-ahead of the filter
+    assert abs(len(out) - (num_samples * resampler.up - resampler.half_len) / resampler.down) <= 1
+    ideal = np.sin(2 * np.pi * freq * np.arange(len(out)) / target_rate)
+    settled = slice(100, None) # past the zeros before the start of the stream
+    assert np.max(np.abs(out[settled, 0] - ideal[settled])) < 2e-3
+
+def test_chunks_are_stamped_with_the_time_of_their_first_sample():
+    resampler = PolyphaseResampler(48000, 16000)
+    chunks = resample_in_chunks(resampler, np.zeros((sum(CHUNK_SIZES), 2)))
+    position = 0
+    for ts, array in chunks:
+        assert ts == T0 + round(position * 1e9 / 16000)
+        position += len(array)
+
+def test_chunking_does_not_change_the_output():
+    signal = np.random.default_rng(4).normal(size=(sum(CHUNK_SIZES), 2))
+    whole = PolyphaseResampler(44100, 48000).push(signal, T0)[1]
+    chunked = np.concatenate([array for _, array in resample_in_chunks(PolyphaseResampler(44100, 48000), signal)])
+    assert np.allclose(chunked, whole)
+
+def test_reset_starts_a_new_stream():
+    resampler = PolyphaseResampler(48000, 16000)
+    first = resampler.push(np.ones((4800, 1)), T0)[1]
+    resampler.push(np.ones((999, 1)), T0 + 10**8)
+    resampler.reset()
+    ts, again = resampler.push(np.ones((4800, 1)), T0 + 10**9)
+    assert ts == T0 + 10**9
+    assert np.array_equal(again, first) # the filter starts over
+    assert get_polyphase_filter(48000, 16000) is get_polyphase_filter(48000, 16000) # cached
+
+def test_spectra_behind_the_resampler_do_not_depend_on_the_chunks():
+    signal = np.random.default_rng(5).normal(size=(sum(CHUNK_SIZES), 1))
+    spectra = []
+    analyzer = SpectralAnalyzer(16000, 512, frames_per_batch=2)
+    for ts, array in resample_in_chunks(PolyphaseResampler(48000, 16000), signal):
+        spectra += analyzer.push(array, ts)
+    expected = SpectralAnalyzer(16000, 512, frames_per_batch=2).push(PolyphaseResampler(48000, 16000).push(signal, T0)[1], T0)
+    assert len(spectra) == len(expected) > 0
+    assert [ts for ts, _, _ in spectra] == [ts for ts, _, _ in expected]
+    assert np.allclose([levels for _, _, levels in spectra], [levels for _, _, levels in expected])
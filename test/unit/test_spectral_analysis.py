@@ -0,0 +1,57 @@
+import numpy as np
+from pkg.spectral_analysis import SpectralAnalyzer, get_band_table
+
+SAMPLING_RATE = 8000.
+BANDS = ((0., 500.), (500., 1500.), (1500., 4001.))
+
+def naive_levels(frames, window="hann"):
+    """Band levels in dB of each (frame_size, channels) frame, from a two-sided FFT per frame and channel."""
+    frame_size = frames[0].shape[0]
+    taper = np.hanning(frame_size) if window == "hann" else np.ones(frame_size)
+    freqs = np.abs(np.fft.fftfreq(frame_size, 1. / SAMPLING_RATE))
+    levels = []
+    for frame in frames:
+        power = [np.abs(np.fft.fft(frame[:, chan] * taper))**2 / (frame_size * np.sum(taper**2)) for chan in range(frame.shape[1])]
+        levels.append([[10. * np.log10(p[(freqs >= low) & (freqs < high)].sum()) for low, high in BANDS] for p in power])
+    return np.array(levels)
+
+def test_band_levels_match_a_naive_fft_per_frame():
+    rng = np.random.default_rng(2)
+    signal = rng.normal(size=(4 * 512, 2))
+    analyzer = SpectralAnalyzer(SAMPLING_RATE, 512, bands=BANDS, frames_per_batch=4, average=False)
+    spectra = analyzer.push(signal, 0)
+    assert len(spectra) == 4
+    expected = naive_levels([signal[start:start+512] for start in range(0, len(signal), 512)])
+    assert np.allclose([levels for _, _, levels in spectra], expected)
+    assert np.allclose(spectra[0][1], get_band_table(512, SAMPLING_RATE, BANDS)[0])
+
+def test_frames_are_independent_of_the_pushed_block_sizes():
+    rng = np.random.default_rng(3)
+    signal = rng.normal(size=(20 * 256 + 100, 1))
+    analyzer = SpectralAnalyzer(SAMPLING_RATE, 256, bands=BANDS, frames_per_batch=3)
+    spectra = []
+    position = 0
+    for size in [1356, 1365, 1365, 17, 900, 217]:
+        spectra += analyzer.push(signal[position:position+size], position * 125000) # 8 kHz: 125000 ns per sample
+        position += size
+    assert position == len(signal)
+
+    assert len(spectra) == 20 // 3 # only full batches of full frames
+    frames = [signal[start:start+256] for start in range(0, len(signal) - 255, 256)]
+    expected = 10. * np.log10(np.mean(10**(naive_levels(frames[:18]) / 10.).reshape(6, 3, 1, len(BANDS)), axis=1))
+    assert np.allclose([levels for _, _, levels in spectra], expected)
+    assert [ts for ts, _, _ in spectra] == [batch * 3 * 256 * 125000 for batch in range(6)]
+
+def test_reset_drops_the_frames_collected_before_a_gap():
+    analyzer = SpectralAnalyzer(SAMPLING_RATE, 256, bands=BANDS, frames_per_batch=2)
+    assert analyzer.push(np.ones((300, 1)), 0) == []
+    analyzer.reset()
+    assert analyzer.push(np.ones((300, 1)), 10**9) == []
+    spectra = analyzer.push(np.ones((300, 1)), 10**9 + 300 * 125000)
+    assert [ts for ts, _, _ in spectra] == [10**9]
+
+def test_flush_transforms_the_complete_frames():
+    analyzer = SpectralAnalyzer(SAMPLING_RATE, 256, bands=BANDS, frames_per_batch=4, average=False)
+    analyzer.push(np.ones((600, 1)), 0)
+    assert [ts for ts, _, _ in analyzer.flush()] == [0, 256 * 125000]
+    assert analyzer.flush() == []
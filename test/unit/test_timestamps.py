@@ -0,0 +1,36 @@
+import datetime
+import pytest
+from pkg.timestamps import parse_timestamp_ns, format_timestamp_ns, datetime_to_ns, NS_PER_SECOND
+
+TIMESTAMP_NS = 1658630821998157000 # 2022-07-24T02:47:01.998157Z
+
+def test_databus_timestamps_round_trip():
+    for ns in (TIMESTAMP_NS, TIMESTAMP_NS + 100, TIMESTAMP_NS + 59 * NS_PER_SECOND, 0):
+        assert parse_timestamp_ns(format_timestamp_ns(ns)) == ns
+    assert format_timestamp_ns(TIMESTAMP_NS + 100) == "2022-07-24T02:47:01.9981571Z"
+
+@pytest.mark.parametrize("timestamp, ns", [
+    ("2022-07-24T02:47:01.9981570Z", TIMESTAMP_NS),
+    ("2022-07-24T02:47:01.998157Z", TIMESTAMP_NS),
+    ("2022-07-24T02:47:01.998157123456Z", TIMESTAMP_NS + 123), # beyond ns truncated
+    ("2022-07-24T02:47:01Z", TIMESTAMP_NS - 998157000),
+    ("2022-07-24T04:47:01.9981570+02:00", TIMESTAMP_NS),
+    ("2022-07-23T21:17:01.9981570-05:30", TIMESTAMP_NS),
+    ("2022-07-24T02:47Z", TIMESTAMP_NS - 1998157000), # no seconds: slow path
+])
+def test_timestamps_parse_like_datetime(timestamp, ns):
+    assert parse_timestamp_ns(timestamp) == ns
+    assert parse_timestamp_ns(timestamp) == ns # again, from the cache
+
+def test_cached_seconds_do_not_mix_up_zones():
+    utc = parse_timestamp_ns("2022-07-24T02:47:01.5Z")
+    assert parse_timestamp_ns("2022-07-24T02:47:01.5+01:00") == utc - 3600 * NS_PER_SECOND
+
+def test_naive_timestamps_are_local_time():
+    local = datetime.datetime(2022, 7, 24, 2, 47, 1, 998157)
+    assert parse_timestamp_ns("2022-07-24T02:47:01.998157") == datetime_to_ns(local)
+    assert datetime_to_ns(local) == round(local.timestamp() * 1e6) * 1000
+
+def test_invalid_timestamps_raise():
+    with pytest.raises(ValueError):
+        parse_timestamp_ns("2022-07-24T02:47:0x.5Z")
@@ -0,0 +1,90 @@
+import time
+import pytest
+from paho.mqtt import client as mqtt
+from pkg.transport import create_transport, LoopbackClient, ReplayClient, TraceRecorder, read_trace
+
+def received_by(client):
+    messages = []
+    client.on_message = lambda client, userdata, msg: messages.append((msg.topic, msg.payload))
+    return messages
+
+def test_loopback_routes_exact_and_wildcard_subscriptions():
+    publisher, exact, wildcard = [LoopbackClient(inline=True) for _ in range(3)]
+    exact_messages, wildcard_messages = received_by(exact), received_by(wildcard)
+    for client in (publisher, exact, wildcard):
+        client.connect("routing")
+    exact.subscribe("audio/a")
+    wildcard.subscribe("audio/+")
+    publisher.publish("audio/a", "1")
+    publisher.publish("audio/b", b"2")
+    publisher.publish("other/a", "3")
+    assert exact_messages == [("audio/a", b"1")]
+    assert wildcard_messages == [("audio/a", b"1"), ("audio/b", b"2")]
+
+    wildcard.unsubscribe("audio/+")
+    publisher.publish("audio/b", "4")
+    assert len(wildcard_messages) == 2
+
+def test_loopback_delivers_retained_messages_on_subscribe():
+    publisher, subscriber = LoopbackClient(inline=True), LoopbackClient(inline=True)
+    messages = received_by(subscriber)
+    publisher.connect("retained")
+    subscriber.connect("retained")
+    publisher.publish("metadata", "first", retain=True)
+    publisher.publish("metadata", "latest", retain=True)
+    subscriber.subscribe("metadata")
+    assert messages == [("metadata", b"latest")]
+
+def test_loopback_publish_fails_while_disconnected():
+    client = LoopbackClient(inline=True)
+    assert client.publish("topic", "payload")[0] == mqtt.MQTT_ERR_NO_CONN
+    client.connect("disconnected")
+    client.disconnect()
+    assert client.publish("topic", "payload")[0] == mqtt.MQTT_ERR_NO_CONN
+    client.reconnect()
+    assert client.publish("topic", "payload")[0] == mqtt.MQTT_ERR_SUCCESS
+
+def test_loopback_runs_callbacks_in_its_network_loop():
+    publisher, subscriber = LoopbackClient(), LoopbackClient(queue_size=2)
+    messages = received_by(subscriber)
+    connected = []
+    subscriber.on_connect = lambda client, userdata, flags, rc: connected.append(rc)
+    publisher.connect("threaded")
+    subscriber.connect("threaded")
+    subscriber.subscribe("topic")
+    for indx in range(2):
+        publisher.publish("topic", str(indx))
+    assert messages == [] and subscriber.queue_depth() == 3 # not before the loop runs
+    subscriber.loop_start()
+    for indx in range(2, 10):
+        publisher.publish("topic", str(indx)) # waits while the queue is full
+    deadline = time.monotonic() + 2.
+    while len(messages) < 10 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    subscriber.loop_stop()
+    assert connected == [0]
+    assert [payload for _, payload in messages] == [str(indx).encode() for indx in range(10)]
+
+def test_replay_delivers_recorded_messages_of_subscribed_topics(tmp_path):
+    trace_file = str(tmp_path / "trace.jsonl")
+    recorder = TraceRecorder(trace_file)
+    recorder.write("audio/a", "text", timestamp=100.)
+    recorder.write("audio/a", b"\xff\x00", timestamp=100.5)
+    recorder.write("other", "ignored", timestamp=101.)
+    recorder.close()
+    assert [msg.payload for msg in read_trace(trace_file)] == [b"text", b"\xff\x00", b"ignored"]
+
+    client = create_transport({"type":"replay", "trace_file":trace_file, "speed":0, "loops":2})
+    assert isinstance(client, ReplayClient)
+    messages = received_by(client)
+    events = []
+    client.on_connect = lambda client, userdata, flags, rc: client.subscribe("audio/#")
+    client.on_disconnect = lambda client, userdata, rc: events.append(rc)
+    client.loop_forever()
+    assert messages == [("audio/a", b"text"), ("audio/a", b"\xff\x00")] * 2
+    assert events == [0]
+
+def test_create_transport_rejects_unknown_types():
+    assert isinstance(create_transport({"type":"loopback"}), LoopbackClient)
+    with pytest.raises(ValueError):
+        create_transport({"type":"carrier pigeon"})
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from pkg.trigger_engine import TriggerRule, TriggerEngine
+
+T0 = 1658630821998000000
+MS = 1000000
+
+def timestamps(num_values, start=0, step_ms=10):
+    return T0 + (start + np.arange(num_values) * step_ms) * MS
+
+def test_hysteresis_keeps_the_rule_active_until_it_is_back_within_the_limit():
+    rule = TriggerRule("loud", above=10., hysteresis=2.)
+    values = np.array([[5.], [11.], [9.], [8.5], [11.], [7.9], [8.], [11.]])
+    triggered, _, run_start = rule.evaluate(timestamps(len(values)), values)
+    # 9 and 8.5 are within the hysteresis, 7.9 is not: two runs
+    assert np.nonzero(triggered[:, 0])[0].tolist() == [1, 7]
+    assert run_start[7, 0] == T0 + 70 * MS
+
+def test_state_carries_over_between_blocks():
+    values = np.array([[5.], [11.], [9.], [11.], [5.], [11.]])
+    whole = TriggerRule("loud", above=10., hysteresis=2.).evaluate(timestamps(6), values)[0]
+    rule = TriggerRule("loud", above=10., hysteresis=2.)
+    blocks = [rule.evaluate(timestamps(3), values[:3])[0], rule.evaluate(timestamps(3, start=30), values[3:])[0]]
+    assert np.array_equal(np.vstack(blocks), whole)
+
+def test_min_duration_triggers_once_the_condition_held_long_enough():
+    rule = TriggerRule("quiet", below=1., min_duration_ms=30, channels=[1])
+    values = np.array([[0., 5.], [0., 0.], [0., 0.], [0., 5.], [0., 0.], [0., 0.], [0., 0.], [0., 0.], [0., 0.]])
+    triggered, _, run_start = rule.evaluate(timestamps(len(values)), values)
+    assert not triggered[:, 0].any() # not one of the rule's channels
+    # the first run lasts 20 ms only; the second triggers 30 ms after it started, once
+    assert np.nonzero(triggered[:, 1])[0].tolist() == [7]
+    assert run_start[7, 1] == T0 + 40 * MS
+
+def test_rate_of_change_applies_to_the_change_per_second():
+    rule = TriggerRule("impact", above=500., rate_of_change=True)
+    triggered, rates, _ = rule.evaluate(timestamps(4), np.array([[0.], [1.], [7.], [8.]]))
+    assert np.allclose(rates[1:, 0], [100., 600., 100.]) and np.isnan(rates[0, 0])
+    assert np.nonzero(triggered[:, 0])[0].tolist() == [2]
+
+def test_rules_need_a_limit():
+    with pytest.raises(ValueError):
+        TriggerRule("nothing")
+
+def test_events_hold_their_start_and_context_once_post_trigger_values_arrived():
+    engine = TriggerEngine([{"name":"loud", "above":10., "min_duration_ms":20}], pre_ms=30, post_ms=20)
+    values = np.array([1., 2., 11., 12., 13., 14., 3., 4.])
+    assert engine.push(timestamps(5), {"rms":values[:5].reshape(-1, 1)}) == [] # triggered at 40 ms, waits until 60 ms
+    events = engine.push(timestamps(3, start=50), {"rms":values[5:].reshape(-1, 1)})
+    assert len(events) == 1
+    event = events[0]
+    assert (event["rule"], event["channel"], event["value"]) == ("loud", 0, 13.)
+    assert (event["start_timestamp"], event["timestamp"]) == (T0 + 20 * MS, T0 + 40 * MS)
+    assert event["context_values"].tolist() == [2., 11., 12., 13., 14., 3.] # 10 .. 60 ms
+    assert engine.get_stats() == {"Trigger events": 1, "Trigger events pending": 0}
+
+def test_flush_returns_the_pending_events():
+    engine = TriggerEngine([{"above":10.}], post_ms=1000)
+    assert engine.push(timestamps(2), {"rms":np.array([[1.], [11.]])}) == []
+    events = engine.flush()
+    assert [(event["rule"], event["timestamp"]) for event in events] == [("rule0", T0 + 10 * MS)]
+    assert engine.flush() == []
@@ -0,0 +1,66 @@
+import time
+import threading
+from pkg.worker_pool import WorkerPool, BACKPRESSURE_DROP_NEWEST, BACKPRESSURE_DROP_OLDEST
+
+def wait_for(condition, timeout=2.):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+def test_messages_of_one_key_are_handled_in_order():
+    handled = []
+    pool = WorkerPool(lambda result, context: handled.append((context, result)), lambda value: value * 2, num_workers=3)
+    pool.start()
+    for indx in range(50):
+        pool.submit("stream/a", (indx, ), "a")
+        pool.submit("stream/b", (indx, ), "b")
+    assert wait_for(lambda: len(handled) == 100)
+    pool.stop()
+    assert [result for key, result in handled if key == "a"] == [2 * indx for indx in range(50)]
+    assert [result for key, result in handled if key == "b"] == [2 * indx for indx in range(50)]
+    assert pool.get_stats()["Messages processed"] == 100
+
+def blocked_pool(policy, handled):
+    # a single worker held up by the first message, so the following ones queue up
+    release = threading.Event()
+    def handler(result, context):
+        release.wait()
+        handled.append(result)
+    pool = WorkerPool(handler, lambda value: value, num_workers=1, queue_size=2, policy=policy)
+    pool.start()
+    pool.submit("stream", (0, ))
+    assert wait_for(lambda: pool.queue_depth() == 0) # taken by the worker
+    return pool, release
+
+def test_drop_newest_keeps_the_queued_messages():
+    handled = []
+    pool, release = blocked_pool(BACKPRESSURE_DROP_NEWEST, handled)
+    assert [pool.submit("stream", (indx, )) for indx in range(1, 5)] == [True, True, False, False]
+    release.set()
+    assert wait_for(lambda: len(handled) == 3)
+    pool.stop()
+    assert handled == [0, 1, 2]
+    assert pool.get_stats()["Messages dropped"] == 2
+
+def test_drop_oldest_keeps_the_latest_messages():
+    handled = []
+    pool, release = blocked_pool(BACKPRESSURE_DROP_OLDEST, handled)
+    for indx in range(1, 5):
+        pool.submit("stream", (indx, ))
+    release.set()
+    assert wait_for(lambda: len(handled) == 3)
+    pool.stop()
+    assert handled == [0, 3, 4]
+    assert pool.get_stats()["Messages dropped"] == 2
+
+def test_failed_messages_are_counted_and_do_not_stop_the_worker():
+    handled = []
+    pool = WorkerPool(lambda result, context: handled.append(result), lambda value: 1 / value, num_workers=1)
+    pool.start()
+    for value in (1, 0, 2):
+        pool.submit("stream", (value, ))
+    assert wait_for(lambda: len(handled) == 2)
+    pool.stop()
+    assert handled == [1., 0.5]
+    assert pool.get_stats()["Messages failed"] == 1